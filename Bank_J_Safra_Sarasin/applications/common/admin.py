@@ -0,0 +1,19 @@
+"""Protection for operator-only endpoints (shared admin token)."""
+
+from __future__ import annotations
+import hmac
+import os
+
+from fastapi import Header, HTTPException
+
+
+def require_admin_token(x_admin_token: str | None = Header(default=None)) -> None:
+    """
+    FastAPI dependency: the X-Admin-Token header must match ADMIN_TOKEN.
+    Without ADMIN_TOKEN configured, admin endpoints are disabled (404).
+    """
+    expected = os.getenv("ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=404, detail="not_found")
+    if not x_admin_token or not hmac.compare_digest(x_admin_token, expected):
+        raise HTTPException(status_code=403, detail="forbidden")
@@ -0,0 +1,161 @@
+"""
+Admission control / load shedding (pure ASGI middleware, per worker).
+
+- Caps concurrent in-flight requests; a short, bounded queue absorbs small bursts.
+- Requests that cannot be admitted in time get a fast 503 + Retry-After instead of
+  piling up on the DB pool / upstream calls until they time out.
+- Optional per-client token bucket answers 429 + Retry-After. It is keyed on the
+  connection peer; X-Forwarded-For is only honoured when the peer is in TRUSTED_PROXIES
+  (see trusted_client_ip). StatisticsAPI forwards the original client as
+  X-Forwarded-For to DeviceRegistrationAPI, so a per-client limit there needs
+  TRUSTED_PROXIES covering the StatisticsAPI pods. Without it, every user behind
+  one StatisticsAPI pod would share a single bucket.
+- Probe (and metrics) routes are exempt so Kubernetes never kills a healthy-but-busy pod.
+
+Env (see admission_options_from_env):
+  ADMISSION_MAX_IN_FLIGHT     = int, concurrent requests per worker (default 64, 0 disables)
+  ADMISSION_QUEUE             = int, max requests waiting for a slot (default 32)
+  ADMISSION_QUEUE_TIMEOUT_MS  = int, max wait for a slot (default 100)
+  ADMISSION_CLIENT_RATE       = float, requests/s per client IP (default 0 = off)
+  ADMISSION_CLIENT_BURST      = int, bucket size per client (default 2x rate)
+  ADMISSION_RETRY_AFTER       = int, seconds advertised on 503 (default 1)
+  TRUSTED_PROXIES             = comma-separated IPs/CIDRs whose X-Forwarded-For is trusted (default none)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Any
+
+from starlette.requests import Request
+
+from common.config import get_env
+from common.http_utils import IPNetwork, trusted_client_ip, trusted_proxies_from_env
+
+PROBE_PATHS = frozenset({"/livez", "/readyz", "/startupz", "/healthz", "/metrics"})
+
+
+class TokenBuckets:
+    """Per-key token buckets with LRU eviction so memory stays bounded."""
+
+    def __init__(self, rate: float, burst: int, max_keys: int = 10_000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """Consume one token; return 0.0 if allowed, else seconds until a token is available."""
+        now = time.monotonic()
+        tokens, last = self._buckets.pop(key, (float(self.burst), now))
+        tokens = min(float(self.burst), tokens + (now - last) * self.rate)
+        wait = 0.0
+        if tokens >= 1.0:
+            tokens -= 1.0
+        else:
+            wait = (1.0 - tokens) / self.rate
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class AdmissionControlMiddleware:
+    """Bounded concurrency + bounded queue + optional per-client rate limit."""
+
+    def __init__(
+        self,
+        app: Any,
+        *,
+        max_in_flight: int = 64,
+        max_queue: int = 32,
+        queue_timeout: float = 0.1,
+        client_rate: float = 0.0,
+        client_burst: int | None = None,
+        retry_after: int = 1,
+        exempt_paths: frozenset[str] = PROBE_PATHS,
+        trusted_proxies: tuple[IPNetwork, ...] = (),
+    ):
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self.exempt_paths = exempt_paths
+        self.trusted_proxies = trusted_proxies
+        self.buckets = (
+            TokenBuckets(client_rate, client_burst or max(1, math.ceil(client_rate * 2)))
+            if client_rate > 0 else None
+        )
+        self.in_flight = 0
+        self.waiting = 0
+        self._slots: asyncio.Semaphore | None = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.max_in_flight <= 0 or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if self.buckets is not None:
+            key = trusted_client_ip(Request(scope), self.trusted_proxies) or "unknown"
+            wait = self.buckets.take(key)
+            if wait > 0:
+                await _reject(send, 429, "too_many_requests", max(1, math.ceil(wait)))
+                return
+
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+
+        if self._slots.locked():
+            if self.waiting >= self.max_queue:
+                await _reject(send, 503, "overloaded", self.retry_after)
+                return
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._slots.acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                await _reject(send, 503, "overloaded", self.retry_after)
+                return
+            finally:
+                self.waiting -= 1
+        else:
+            await self._slots.acquire()
+
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+
+async def _reject(send, status: int, message: str, retry_after: int) -> None:
+    body = json.dumps({"statusCode": status, "message": message}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode("ascii")),
+            (b"retry-after", str(retry_after).encode("ascii")),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def admission_options_from_env() -> dict[str, Any]:
+    """Middleware kwargs from ADMISSION_* env vars (use with app.add_middleware)."""
+    burst = get_env("ADMISSION_CLIENT_BURST", "")
+    return {
+        "max_in_flight": int(get_env("ADMISSION_MAX_IN_FLIGHT", "64")),
+        "max_queue": int(get_env("ADMISSION_QUEUE", "32")),
+        "queue_timeout": int(get_env("ADMISSION_QUEUE_TIMEOUT_MS", "100")) / 1000.0,
+        "client_rate": float(get_env("ADMISSION_CLIENT_RATE", "0")),
+        "client_burst": int(burst) if burst else None,
+        "retry_after": int(get_env("ADMISSION_RETRY_AFTER", "1")),
+        "trusted_proxies": trusted_proxies_from_env(),
+    }
@@ -17,6 +17,28 @@ def database_url(env_var: str = "DATABASE_URL", default: str | None = None) -> s
     return get_env(env_var, default)
 
 
+def database_urls(env_var: str = "DATABASE_SHARD_URLS", default: str | None = None) -> list[str]:
+    """
+    Shard DB URLs (comma-separated, order matters and is append-only; see common.db.shard_index).
+    Falls back to a single shard from DATABASE_URL.
+    """
+    raw = os.getenv(env_var, "")
+    urls = [u.strip() for u in raw.split(",") if u.strip()]
+    return urls or [database_url(default=default)]
+
+
+def write_legacy_columns(env_var: str = "WRITE_LEGACY_COLUMNS") -> bool:
+    """
+    Whether the expand-phase string columns (device_type, user_agent, client_ip) are still
+    written next to their typed encodings and read instead of them (default "1").
+    Set "0" once `common.tools.backfill --check` passes on every shard and no pod of an
+    earlier release remains: new rows then leave the strings NULL and reads use the typed
+    columns, so rows stop carrying both (see common.migrations). One-way: rows written
+    while it is "0" have no strings for a "1" reader to count.
+    """
+    return os.getenv(env_var, "1") in {"1", "true", "TRUE", "yes", "on"}
+
+
 def device_api_url(env_var: str = "DEVICE_API_URL", default: str | None = None) -> str:
     """Internal URL for DeviceRegistrationAPI (used by StatisticsAPI)."""
     return get_env(env_var, default or "http://device_reg_api:8001")
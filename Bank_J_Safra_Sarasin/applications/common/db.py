@@ -1,23 +1,102 @@
-"""Shared async SQLAlchemy 2.x database utilities."""
+"""Shared async SQLAlchemy 2.x database utilities.
+
+sqlalchemy.ext.asyncio (and the asyncpg driver) load on the first create_engine() call,
+not at import, so importing the models stays cheap for app modules and tools.
+"""
 
 from __future__ import annotations
 
+import asyncio
+import hashlib
+from collections.abc import Awaitable, Callable
 from contextlib import asynccontextmanager
-from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine, AsyncSession, async_sessionmaker
+from typing import TYPE_CHECKING, TypeVar
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy import String, DateTime, func, Integer
+from sqlalchemy import String, DateTime, func, Integer, SmallInteger, ForeignKey, Index, text
+from sqlalchemy.dialects.postgresql import INET
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
 
 def create_engine(db_url: str, echo: bool = False) -> AsyncEngine:
     """Create an async SQLAlchemy engine."""
+    from sqlalchemy.ext.asyncio import create_async_engine
     return create_async_engine(db_url, echo=echo, pool_pre_ping=True)
 
 
 def make_sessionmaker(engine: AsyncEngine) -> async_sessionmaker[AsyncSession]:
     """Create an async sessionmaker bound to the engine."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker
     return async_sessionmaker(engine, expire_on_commit=False)
 
 
+T = TypeVar("T")
+
+
+def shard_index(user_key: str, shards: int) -> int:
+    """
+    Owning shard of a userKey: jump consistent hash (Lamping & Veach) of a blake2b digest.
+    Stable across processes, and growing from n to n+1 shards moves only ~1/(n+1) of the keys,
+    all of them to the new shard.
+    """
+    key = int.from_bytes(hashlib.blake2b(user_key.encode("utf-8"), digest_size=8).digest(), "little")
+    b, j = -1, 0
+    while j < shards:
+        b = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((b + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return b
+
+
+class ShardSet:
+    """
+    One engine/sessionmaker per shard DSN. Rows live on shard_index(user_key); every shard
+    has the full schema. Shard 0 (primary) also holds global data (heavy-hitter buckets).
+    A single DSN is simply a one-shard set.
+    """
+
+    def __init__(self, urls: list[str], echo: bool = False):
+        if not urls:
+            raise ValueError("at least one shard URL is required")
+        self.urls = list(urls)
+        self.engines = [create_engine(url, echo=echo) for url in self.urls]
+        self.sessionmakers = [make_sessionmaker(engine) for engine in self.engines]
+
+    def __len__(self) -> int:
+        return len(self.engines)
+
+    @property
+    def primary(self) -> async_sessionmaker[AsyncSession]:
+        return self.sessionmakers[0]
+
+    def index_for(self, user_key: str) -> int:
+        return shard_index(user_key, len(self.engines))
+
+    def for_key(self, user_key: str) -> async_sessionmaker[AsyncSession]:
+        return self.sessionmakers[self.index_for(user_key)]
+
+    async def fan_out(self, fn: Callable[[async_sessionmaker[AsyncSession]], Awaitable[T]]) -> list[T]:
+        """Run fn against every shard concurrently; results in shard order (first error propagates)."""
+        if len(self.sessionmakers) == 1:
+            return [await fn(self.sessionmakers[0])]
+        return list(await asyncio.gather(*(fn(sm) for sm in self.sessionmakers)))
+
+    async def dispose(self) -> None:
+        await asyncio.gather(*(engine.dispose() for engine in self.engines))
+
+
+def shards_of(app) -> ShardSet:
+    """The app's ShardSet (app.state.shards, built in its lifespan)."""
+    shards = getattr(app.state, "shards", None)
+    if shards is None:
+        raise RuntimeError(
+            "Database shards are not initialized: app.state.shards is set by the app's lifespan, "
+            "so serve it with lifespan enabled (e.g. TestClient used as a context manager)"
+        )
+    return shards
+
+
 @asynccontextmanager
 async def session_scope(session_factory: async_sessionmaker[AsyncSession]):
     """Async context manager to provide a unit-of-work style session."""
@@ -35,16 +114,52 @@ class Base(DeclarativeBase):
     pass
 
 
+class DeviceTypeLookup(Base):
+    """Code -> name table for SQL readers (seeded by migrations from DEVICE_TYPE_CODES)."""
+    __tablename__ = "device_types"
+
+    code: Mapped[int] = mapped_column(SmallInteger, primary_key=True)
+    name: Mapped[str] = mapped_column(String(50), nullable=False, unique=True)
+
+
+class UserAgent(Base):
+    """Dictionary of distinct User-Agent strings (few thousand rows, referenced by id)."""
+    __tablename__ = "user_agents"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True)
+    user_agent: Mapped[str] = mapped_column(String(1024), nullable=False, unique=True)
+
+
 # Shared table model used by both services (DRY)
 class DeviceRegistration(Base):
     """Event log of device registrations (append-only)."""
     __tablename__ = "device_registrations"
+    __table_args__ = (
+        Index(
+            "ux_device_registrations_idempotency", "user_key", "idempotency_key",
+            unique=True, postgresql_where=text("idempotency_key IS NOT NULL"),
+        ),
+        Index(
+            "ix_device_registrations_device_type_code_client_inet", "device_type_code", "client_inet",
+            postgresql_where=text("client_inet IS NOT NULL"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(Integer, primary_key=True, index=True)
     user_key: Mapped[str] = mapped_column(String(255), nullable=False, index=True)
-    device_type: Mapped[str] = mapped_column(String(50), nullable=False, index=True)
+    # Writers set both columns of each pair (expand phase, see common.migrations): the string
+    # is what the previous release reads and writes, the other its compact encoding. With
+    # WRITE_LEGACY_COLUMNS=0 (common.config) the strings are left NULL.
+    device_type: Mapped[str | None] = mapped_column(String(50), nullable=True, index=True)
+    device_type_code: Mapped[int | None] = mapped_column(
+        SmallInteger, ForeignKey("device_types.code"), nullable=True, index=True
+    )
     user_agent: Mapped[str | None] = mapped_column(String(1024), nullable=True)
-    client_ip: Mapped[str | None] = mapped_column(String(45), nullable=True)  # IPv4/IPv6 string
+    user_agent_id: Mapped[int | None] = mapped_column(Integer, ForeignKey("user_agents.id"), nullable=True)
+    client_ip: Mapped[str | None] = mapped_column(String(45), nullable=True)  # IPv4/IPv6 address
+    client_inet: Mapped[str | None] = mapped_column(INET, nullable=True)
+    # Client-supplied Idempotency-Key (see common.idempotency); unique per user_key when set
+    idempotency_key: Mapped[str | None] = mapped_column(String(255), nullable=True)
     created_at: Mapped[str] = mapped_column(
         DateTime(timezone=True), nullable=False, server_default=func.now(), index=True
     )
@@ -124,3 +124,41 @@ def normalize_device_type(raw: str) -> DeviceType:
     """
     key = _normalize_key(raw)
     return _CANON_MAP.get(key, DeviceType.Unknown)
+
+# Compact storage codes (device_registrations.device_type_code is SMALLINT).
+# Append-only: never renumber. A new DeviceType member needs a new code here AND a
+# migration inserting its row into public.device_types.
+DEVICE_TYPE_CODES: dict[DeviceType, int] = {
+    DeviceType.Unknown: 0,
+    DeviceType.Android: 1,
+    DeviceType.iOS: 2,
+    DeviceType.Windows: 3,
+    DeviceType.macOS: 4,
+    DeviceType.Linux: 5,
+    DeviceType.BSD: 6,
+    DeviceType.Desktop: 7,
+    DeviceType.Laptop: 8,
+    DeviceType.Tablet: 9,
+    DeviceType.Phone: 10,
+    DeviceType.SmartTV: 11,
+    DeviceType.Wearable: 12,
+    DeviceType.Bot: 13,
+}
+_CODE_TO_TYPE = {code: dt for dt, code in DEVICE_TYPE_CODES.items()}
+
+def _check_codes() -> None:
+    # Not an assert: those are stripped under python -O
+    missing = [dt.value for dt in DeviceType if dt not in DEVICE_TYPE_CODES]
+    if missing or len(_CODE_TO_TYPE) != len(DEVICE_TYPE_CODES):
+        raise RuntimeError(f"Every DeviceType needs a unique storage code (missing: {missing})")
+
+_check_codes()
+
+def device_type_code(value: DeviceType | str) -> int:
+    """Storage code for a DeviceType (raw strings are normalized first)."""
+    dt = value if isinstance(value, DeviceType) else normalize_device_type(value)
+    return DEVICE_TYPE_CODES[dt]
+
+def device_type_from_code(code: int) -> DeviceType:
+    """DeviceType for a storage code; unknown codes map to DeviceType.Unknown."""
+    return _CODE_TO_TYPE.get(code, DeviceType.Unknown)
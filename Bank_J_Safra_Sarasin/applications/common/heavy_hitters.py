@@ -0,0 +1,298 @@
+"""
+Heavy-hitter detection (most active userKeys) with a windowed Count-Min sketch.
+
+- Each worker keeps, per time bucket, a Count-Min sketch plus a bounded set of
+  candidate keys (the top ones by sketch estimate). Recording is a few hash
+  lookups, cheap enough for the registration path.
+- A background flusher merges the worker's per-bucket deltas into
+  public.heavy_hitter_buckets (row-locked read-modify-write), so every worker and
+  pod contributes to the same sketches. Sketches are additive, so merging is exact.
+- Queries sum every persisted bucket overlapping the requested window (the current,
+  still-filling one included) at the candidate keys' positions only; results are cached
+  per worker for a few seconds. Registrations not yet flushed (up to
+  HEAVY_HITTER_FLUSH_SECONDS old) are not visible to queries.
+
+Estimates never undercount; they overcount by at most ~e/width of the bucket total
+(with probability 1 - e^-depth).
+
+Env:
+  HEAVY_HITTER_WIDTH              = int, counters per sketch row (default 2048)
+  HEAVY_HITTER_DEPTH              = int, hash rows (default 4)
+  HEAVY_HITTER_CANDIDATES         = int, candidate keys kept per bucket (default 100)
+  HEAVY_HITTER_BUCKET_SECONDS     = int, bucket length (default 300)
+  HEAVY_HITTER_RETENTION_BUCKETS  = int, buckets kept in the DB (default 288 = 24 h)
+  HEAVY_HITTER_FLUSH_SECONDS      = int, flush interval per worker (default 10)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from array import array
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING
+
+from sqlalchemy import text
+from common.config import get_env
+from common.db import session_scope
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+logger = logging.getLogger("heavy_hitters")
+
+
+class CountMinSketch:
+    def __init__(self, width: int, depth: int, counters: array | None = None):
+        self.width = width
+        self.depth = depth
+        self.counters = counters if counters is not None else array("I", bytes(4 * width * depth))
+
+    def positions(self, key: str) -> list[int]:
+        # blake2b is stable across processes (unlike hash()), so sketches from all workers line up
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=4 * self.depth).digest()
+        return [
+            d * self.width + int.from_bytes(digest[4 * d:4 * d + 4], "little") % self.width
+            for d in range(self.depth)
+        ]
+
+    def add(self, key: str, n: int = 1) -> int:
+        """Add n to key; return its new estimate."""
+        c = self.counters
+        est = None
+        for pos in self.positions(key):
+            c[pos] += n
+            est = c[pos] if est is None else min(est, c[pos])
+        return est or 0
+
+    def estimate(self, key: str) -> int:
+        return min(self.counters[pos] for pos in self.positions(key))
+
+    def merge(self, other: "CountMinSketch") -> None:
+        self.counters = array("I", (a + b for a, b in zip(self.counters, other.counters)))
+
+    def to_bytes(self) -> bytes:
+        return self.counters.tobytes()
+
+    @classmethod
+    def from_bytes(cls, width: int, depth: int, raw: bytes) -> "CountMinSketch":
+        counters = array("I")
+        counters.frombytes(raw)
+        return cls(width, depth, counters)
+
+
+def _keep_top(candidates: dict[str, int], k: int) -> dict[str, int]:
+    if len(candidates) <= k:
+        return candidates
+    return dict(sorted(candidates.items(), key=lambda kv: kv[1], reverse=True)[:k])
+
+
+class _Bucket:
+    """One worker's unflushed delta for one time bucket."""
+
+    def __init__(self, width: int, depth: int, k: int):
+        self.sketch = CountMinSketch(width, depth)
+        self.candidates: dict[str, int] = {}
+        self.k = k
+        self._floor = 0  # lower bound of the smallest candidate estimate
+
+    def add(self, key: str) -> None:
+        est = self.sketch.add(key)
+        c = self.candidates
+        if key in c:
+            c[key] = est
+        elif len(c) < self.k:
+            c[key] = est
+            if len(c) == self.k:
+                self._floor = min(c.values())
+        elif est > self._floor:
+            # Estimates only grow, so the floor may be stale-low: re-check the real minimum
+            victim = min(c, key=c.__getitem__)
+            if c[victim] < est:
+                del c[victim]
+                c[key] = est
+            self._floor = min(c.values())
+
+
+class HeavyHitterTracker:
+    def __init__(
+        self,
+        *,
+        width: int = 2048,
+        depth: int = 4,
+        k: int = 100,
+        bucket_seconds: int = 300,
+        retention_buckets: int = 288,
+    ):
+        self.width = width
+        self.depth = depth
+        self.k = k
+        self.bucket_seconds = bucket_seconds
+        self.retention_buckets = retention_buckets
+        self._buckets: dict[int, _Bucket] = {}
+
+    @classmethod
+    def from_env(cls) -> "HeavyHitterTracker":
+        return cls(
+            width=int(get_env("HEAVY_HITTER_WIDTH", "2048")),
+            depth=int(get_env("HEAVY_HITTER_DEPTH", "4")),
+            k=int(get_env("HEAVY_HITTER_CANDIDATES", "100")),
+            bucket_seconds=int(get_env("HEAVY_HITTER_BUCKET_SECONDS", "300")),
+            retention_buckets=int(get_env("HEAVY_HITTER_RETENTION_BUCKETS", "288")),
+        )
+
+    def record(self, key: str, now: float | None = None) -> None:
+        start = int((now if now is not None else time.time()) // self.bucket_seconds) * self.bucket_seconds
+        bucket = self._buckets.get(start)
+        if bucket is None:
+            bucket = self._buckets[start] = _Bucket(self.width, self.depth, self.k)
+        bucket.add(key)
+
+    async def flush(self, session_factory: async_sessionmaker[AsyncSession]) -> None:
+        """Merge all pending local buckets into the DB; failed buckets are kept for the next flush."""
+        pending, self._buckets = self._buckets, {}
+        for start, bucket in sorted(pending.items()):
+            try:
+                await self._merge_bucket(session_factory, start, bucket)
+            except Exception:
+                logger.warning("Heavy-hitter flush failed for bucket %d; will retry", start, exc_info=True)
+                self._requeue(start, bucket)
+        cutoff = datetime.fromtimestamp(time.time() - self.bucket_seconds * self.retention_buckets, timezone.utc)
+        try:
+            async with session_scope(session_factory) as session:
+                await session.execute(
+                    text("DELETE FROM public.heavy_hitter_buckets WHERE bucket_start < :c"), {"c": cutoff}
+                )
+        except Exception:
+            logger.warning("Heavy-hitter retention prune failed; will retry", exc_info=True)
+
+    def _requeue(self, start: int, bucket: _Bucket) -> None:
+        current = self._buckets.get(start)
+        if current is None:
+            self._buckets[start] = bucket
+            return
+        current.sketch.merge(bucket.sketch)
+        for key in bucket.candidates:
+            current.candidates[key] = current.sketch.estimate(key)
+        current.candidates = _keep_top(current.candidates, self.k)
+
+    async def _merge_bucket(self, session_factory, start: int, bucket: _Bucket) -> None:
+        ts = datetime.fromtimestamp(start, timezone.utc)
+        async with session_scope(session_factory) as session:
+            await session.execute(
+                text(
+                    "INSERT INTO public.heavy_hitter_buckets (bucket_start, width, depth, counters) "
+                    "VALUES (:b, :w, :d, :c) ON CONFLICT (bucket_start) DO NOTHING"
+                ),
+                {"b": ts, "w": self.width, "d": self.depth, "c": bytes(4 * self.width * self.depth)},
+            )
+            row = (await session.execute(
+                text(
+                    "SELECT width, depth, counters, candidates FROM public.heavy_hitter_buckets "
+                    "WHERE bucket_start = :b FOR UPDATE"
+                ),
+                {"b": ts},
+            )).one()
+            if (row.width, row.depth) != (self.width, self.depth):
+                logger.warning("Skipping bucket %s: stored sketch has different dimensions", ts)
+                return
+            merged = CountMinSketch.from_bytes(self.width, self.depth, row.counters)
+            merged.merge(bucket.sketch)
+            keys = set(row.candidates or {}) | set(bucket.candidates)
+            candidates = _keep_top({key: merged.estimate(key) for key in keys}, self.k)
+            await session.execute(
+                text(
+                    "UPDATE public.heavy_hitter_buckets SET counters = :c, candidates = CAST(:k AS jsonb) "
+                    "WHERE bucket_start = :b"
+                ),
+                {"b": ts, "c": merged.to_bytes(), "k": json.dumps(candidates)},
+            )
+
+    async def run_flusher(self, session_factory: async_sessionmaker[AsyncSession], interval: float | None = None) -> None:
+        interval = interval if interval is not None else float(get_env("HEAVY_HITTER_FLUSH_SECONDS", "10"))
+        try:
+            while True:
+                await asyncio.sleep(interval)
+                if self._buckets:
+                    try:
+                        await self.flush(session_factory)
+                    except Exception:
+                        # Never let one bad flush end the task: buckets would pile up unflushed
+                        logger.exception("Heavy-hitter flush failed")
+        except asyncio.CancelledError:
+            # Best-effort final flush on shutdown
+            if self._buckets:
+                try:
+                    await self.flush(session_factory)
+                except Exception:
+                    logger.warning("Final heavy-hitter flush failed", exc_info=True)
+            raise
+
+
+_query_cache: dict[tuple[int, int], tuple[float, list[dict]]] = {}
+
+
+def window_start(now: float, window_seconds: int, bucket_seconds: int) -> float:
+    """Start of the oldest bucket overlapping [now - window_seconds, now]."""
+    return (now - window_seconds) // bucket_seconds * bucket_seconds
+
+
+async def query_top(
+    session_factory: async_sessionmaker[AsyncSession],
+    *,
+    window_seconds: int,
+    limit: int = 10,
+    cache_seconds: float = 5.0,
+    bucket_seconds: int | None = None,
+) -> list[dict]:
+    """
+    Top `limit` keys over the last `window_seconds`, from the persisted buckets. Buckets are
+    counted whole, so the window effectively reaches back to the start of its oldest bucket.
+    """
+    cache_key = (window_seconds, limit)
+    cached = _query_cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < cache_seconds:
+        return cached[1]
+
+    if bucket_seconds is None:
+        bucket_seconds = int(get_env("HEAVY_HITTER_BUCKET_SECONDS", "300"))
+    since = datetime.fromtimestamp(window_start(time.time(), window_seconds, bucket_seconds), timezone.utc)
+    async with session_factory() as session:
+        rows = (await session.execute(
+            text(
+                "SELECT width, depth, counters, candidates FROM public.heavy_hitter_buckets "
+                "WHERE bucket_start >= :s"
+            ),
+            {"s": since},
+        )).all()
+
+    result = estimate_top(rows, limit)
+    _query_cache[cache_key] = (time.monotonic(), result)
+    return result
+
+
+def estimate_top(rows, limit: int) -> list[dict]:
+    """Top keys from bucket rows (width, depth, counters, candidates)."""
+    # Estimate only the candidate keys (from any bucket in the window): sum every bucket's
+    # counters at the key's positions, i.e. query the merged sketch without materializing it.
+    sketches = [CountMinSketch.from_bytes(row.width, row.depth, row.counters) for row in rows]
+    keys = {key for row in rows for key in (row.candidates or {})}
+    estimates: dict[str, int] = {}
+    for key in keys:
+        positions: dict[tuple[int, int], list[int]] = {}
+        sums: list[int] | None = None
+        for sketch in sketches:
+            dims = (sketch.width, sketch.depth)
+            if dims not in positions:
+                positions[dims] = sketch.positions(key)
+            row_vals = [sketch.counters[pos] for pos in positions[dims]]
+            if sums is None:
+                sums = row_vals
+            elif len(sums) == len(row_vals):
+                sums = [a + b for a, b in zip(sums, row_vals)]
+        estimates[key] = min(sums) if sums else 0
+    top = sorted(estimates.items(), key=lambda kv: kv[1], reverse=True)[:limit]
+    return [{"userKey": key, "count": count} for key, count in top]
@@ -1,8 +1,15 @@
-"""HTTP helpers (client IP extraction, etc.)."""
+"""HTTP helpers (client IP extraction, conditional requests, etc.)."""
 
 from __future__ import annotations
+import ipaddress
+from collections.abc import Iterable
+
 from fastapi import Request
 
+from common.config import get_env
+
+IPNetwork = ipaddress.IPv4Network | ipaddress.IPv6Network
+
 
 def get_client_ip(request: Request) -> str | None:
     """Extract client IP considering common proxy headers; fall back to connection peer."""
@@ -18,3 +25,58 @@ def get_client_ip(request: Request) -> str | None:
     if request.client and request.client.host:
         return request.client.host
     return None
+
+
+def parse_networks(raw: str) -> tuple[IPNetwork, ...]:
+    """Comma-separated addresses/CIDRs (e.g. "10.0.0.0/8, 127.0.0.1"); ValueError on a bad entry."""
+    return tuple(ipaddress.ip_network(part.strip(), strict=False) for part in raw.split(",") if part.strip())
+
+
+def trusted_proxies_from_env() -> tuple[IPNetwork, ...]:
+    """TRUSTED_PROXIES: proxies (ingress, StatisticsAPI pods) whose X-Forwarded-For is believed."""
+    return parse_networks(get_env("TRUSTED_PROXIES", ""))
+
+
+def _is_trusted(value: str, trusted: Iterable[IPNetwork]) -> bool:
+    try:
+        ip = ipaddress.ip_address(value)
+    except ValueError:
+        return False
+    return any(ip in net for net in trusted)
+
+
+def trusted_client_ip(request: Request, trusted: Iterable[IPNetwork]) -> str | None:
+    """
+    Client address for keying limits. The connection peer, unless it is a trusted proxy;
+    then the right-most X-Forwarded-For hop that is not a trusted proxy itself.
+    Unlike get_client_ip, a client cannot choose its own key by sending X-Forwarded-For.
+    """
+    trusted = tuple(trusted)
+    peer = request.client.host if request.client else None
+    if not peer or not trusted or not _is_trusted(peer, trusted):
+        return peer
+    hops = [h.strip() for h in request.headers.get("x-forwarded-for", "").split(",") if h.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted(hop, trusted):
+            return normalize_ip(hop) or peer
+    return normalize_ip(hops[0]) if hops else peer
+
+
+def normalize_ip(value: str | None) -> str | None:
+    """Canonical IPv4/IPv6 string for INET storage, or None if missing/unparseable."""
+    if not value:
+        return None
+    try:
+        return str(ipaddress.ip_address(value.strip()))
+    except ValueError:
+        return None
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """If-None-Match evaluation (weak comparison, lists and '*' supported)."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    target = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == target for tag in if_none_match.split(","))
@@ -0,0 +1,73 @@
+"""
+Idempotency keys for the registration path (duplicate suppression on client retries).
+
+- Clients send an `Idempotency-Key` header (or `eventId` in the /Log/auth body);
+  StatisticsAPI forwards it to /Device/register as the same header.
+- DeviceRegistrationAPI answers replays from a bounded per-worker cache of recently
+  seen (userKey, key) pairs; misses fall through to the insert, where the partial
+  unique index ux_device_registrations_idempotency (migration 7) turns a duplicate
+  into ON CONFLICT DO NOTHING. Either way the replay gets the original result.
+- Keys are scoped per userKey, which also keeps them on one shard.
+
+Env:
+  IDEMPOTENCY_CACHE_SIZE    = int, recent keys per worker (default 10000)
+  IDEMPOTENCY_CACHE_SECONDS = float, how long a key stays cached (default 600)
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+
+from common.config import get_env
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+
+def clean_key(value: str | None) -> str | None:
+    """Stripped key, or None when absent; ValueError when too long or not printable ASCII."""
+    if value is None:
+        return None
+    key = value.strip()
+    if not key:
+        return None
+    if len(key) > MAX_KEY_LENGTH or not key.isascii() or not key.isprintable():
+        raise ValueError("invalid idempotency key")
+    return key
+
+
+class RecentKeys:
+    """Bounded LRU of (userKey, key) -> original response body, with a TTL."""
+
+    def __init__(self, max_size: int = 10_000, ttl: float = 600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: OrderedDict[tuple[str, str], tuple[float, dict]] = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "RecentKeys":
+        return cls(
+            max_size=int(get_env("IDEMPOTENCY_CACHE_SIZE", "10000")),
+            ttl=float(get_env("IDEMPOTENCY_CACHE_SECONDS", "600")),
+        )
+
+    def get(self, user_key: str, key: str) -> dict | None:
+        entry = self._entries.get((user_key, key))
+        if entry is None:
+            return None
+        if time.monotonic() - entry[0] > self.ttl:
+            del self._entries[(user_key, key)]
+            return None
+        self._entries.move_to_end((user_key, key))
+        return entry[1]
+
+    def put(self, user_key: str, key: str, result: dict) -> None:
+        self._entries[(user_key, key)] = (time.monotonic(), result)
+        self._entries.move_to_end((user_key, key))
+        if len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,256 @@
+"""
+Live per-device-type registration deltas (PostgreSQL LISTEN/NOTIFY -> subscribers).
+
+- Migration 4 adds a statement-level INSERT trigger that NOTIFYs one aggregated
+  {device_type: n} payload per statement on channel 'device_registrations'.
+- StatsBroadcaster holds ONE asyncpg LISTEN connection per worker and shard (opened
+  lazily on the first subscriber, reconnected with backoff) and merges notifications
+  into a pending delta, flushed to all subscribers every `interval` seconds.
+  Stream subscribers and CountCache lookups both keep it running; once neither has
+  used it for `idle_seconds`, the connections and tasks are stopped until the next use.
+- Each Subscriber keeps a merged Counter instead of a queue, so a slow client only
+  ever receives bigger deltas, never an unbounded backlog.
+- The same notifications bump per-device-type versions, which CountCache uses to
+  serve /Log/auth/statistics counts (and their ETags) without a COUNT query until
+  the next insert of that device type.
+
+Env:
+  STATS_STREAM_INTERVAL_MS     = int, coalescing interval (default 1000)
+  STATS_STREAM_MAX_SUBSCRIBERS = int, per worker (default 1000)
+  STATS_LISTEN_IDLE_SECONDS    = float, stop LISTEN after this long unused (default 60)
+  STATS_COUNT_CACHE_SECONDS    = float, max age of a cached count (default 60; 0 disables)
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter
+
+from common.config import get_env
+from common.device_types import normalize_device_type
+
+logger = logging.getLogger("live_stats")
+
+CHANNEL = "device_registrations"
+
+
+class Subscriber:
+    def __init__(self, device_type: str | None = None):
+        self.device_type = device_type
+        self.pending: Counter[str] = Counter()
+        self.ready = asyncio.Event()
+
+    def push(self, delta: Counter[str]) -> None:
+        if self.device_type is not None:
+            if self.device_type not in delta:
+                return
+            delta = Counter({self.device_type: delta[self.device_type]})
+        self.pending.update(delta)
+        self.ready.set()
+
+    def take(self) -> dict[str, int]:
+        delta = dict(self.pending)
+        self.pending.clear()
+        self.ready.clear()
+        return delta
+
+
+class StatsBroadcaster:
+    def __init__(
+        self,
+        dsns: str | list[str],
+        *,
+        interval: float = 1.0,
+        max_subscribers: int = 1000,
+        idle_seconds: float = 60.0,
+    ):
+        # asyncpg expects postgresql://...; one DSN per shard
+        dsns = [dsns] if isinstance(dsns, str) else dsns
+        self.dsns = [dsn.replace("postgresql+asyncpg://", "postgresql://") for dsn in dsns]
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self.idle_seconds = idle_seconds
+        self._last_used = 0.0
+        self.subscribers: set[Subscriber] = set()
+        self._pending: Counter[str] = Counter()
+        self._tasks: list[asyncio.Task] = []
+        # Per-device-type notification counters; `epoch` changes whenever notifications
+        # may have been missed (a LISTEN not connected), invalidating everything derived.
+        self.versions: Counter[str] = Counter()
+        self.epoch = 0
+        self._connected: set[str] = set()
+
+    @property
+    def listening(self) -> bool:
+        """True while every shard's LISTEN connection is up."""
+        return len(self._connected) == len(self.dsns)
+
+    @classmethod
+    def from_env(cls, dsns: str | list[str]) -> "StatsBroadcaster":
+        return cls(
+            dsns,
+            interval=int(get_env("STATS_STREAM_INTERVAL_MS", "1000")) / 1000.0,
+            max_subscribers=int(get_env("STATS_STREAM_MAX_SUBSCRIBERS", "1000")),
+            idle_seconds=float(get_env("STATS_LISTEN_IDLE_SECONDS", "60")),
+        )
+
+    @property
+    def full(self) -> bool:
+        return len(self.subscribers) >= self.max_subscribers
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    def start(self) -> None:
+        """Mark the broadcaster as in use and start the LISTEN tasks (one per shard) if needed."""
+        self._last_used = time.monotonic()
+        if not self._tasks or any(t.done() for t in self._tasks):
+            for t in self._tasks:
+                t.cancel()
+            self._tasks = [asyncio.create_task(self._run(dsn)) for dsn in self.dsns]
+            self._tasks.append(asyncio.create_task(self._flush_loop()))
+
+    def version(self, device_type: str) -> tuple[int, int]:
+        return self.epoch, self.versions[device_type]
+
+    def subscribe(self, device_type: str | None = None) -> Subscriber | None:
+        """Register a subscriber (None when the per-worker cap is reached)."""
+        if self.full:
+            return None
+        self.start()
+        sub = Subscriber(device_type)
+        self.subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self.subscribers.discard(sub)
+        self._last_used = time.monotonic()
+
+    def _idle(self) -> bool:
+        return not self.subscribers and time.monotonic() - self._last_used >= self.idle_seconds
+
+    def _stop(self) -> list[asyncio.Task]:
+        tasks, self._tasks = self._tasks, []
+        current = asyncio.current_task()
+        for t in tasks:
+            if t is not current:
+                t.cancel()
+        return tasks
+
+    async def close(self) -> None:
+        await asyncio.gather(*self._stop(), return_exceptions=True)
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        try:
+            counts = json.loads(payload)["counts"]
+            for device_type, n in counts.items():
+                name = normalize_device_type(device_type).value
+                self._pending[name] += int(n)
+                self.versions[name] += 1
+        except Exception:
+            logger.warning("Ignoring malformed notification payload: %r", payload)
+            self.epoch += 1  # unknown change: invalidate cached counts
+
+    def _flush(self) -> None:
+        if not self._pending:
+            return
+        delta, self._pending = self._pending, Counter()
+        for sub in self.subscribers:
+            sub.push(delta)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            self._flush()
+            if self._idle():
+                # Cancelled LISTEN tasks close their connections; `listening` turns False,
+                # so cached counts stop being served until the next start()
+                logger.info("LISTEN %s unused for %.0fs; stopping", CHANNEL, self.idle_seconds)
+                self._pending.clear()
+                self._stop()
+                return
+
+    async def _run(self, dsn: str) -> None:
+        attempt = 0
+        while True:
+            conn = None
+            try:
+                import asyncpg  # only workers that serve a stream or cache counts need it
+                conn = await asyncpg.connect(dsn=dsn, timeout=5)
+                await conn.add_listener(CHANNEL, self._on_notify)
+                logger.info("LISTEN %s started", CHANNEL)
+                self.epoch += 1
+                self._connected.add(dsn)
+                attempt = 0
+                while not conn.is_closed():
+                    await asyncio.sleep(self.interval)
+                logger.warning("LISTEN connection closed; reconnecting")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("LISTEN connection failed: %s", e)
+            finally:
+                self._connected.discard(dsn)
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+            attempt += 1
+            await asyncio.sleep(random.uniform(0, min(30.0, 0.5 * 2 ** attempt)))
+
+
+class CountCache:
+    """
+    Per-worker device-type counts, valid until the next NOTIFY for that device type,
+    a LISTEN reconnect, or `max_age` seconds (safety net for changes that don't
+    NOTIFY, e.g. DELETEs or loads with triggers disabled).
+    """
+
+    def __init__(self, broadcaster: StatsBroadcaster, *, max_age: float = 60.0):
+        self.broadcaster = broadcaster
+        self.max_age = max_age
+        self._counts: dict[str, tuple[tuple[int, int], float, int]] = {}
+
+    @classmethod
+    def from_env(cls, broadcaster: StatsBroadcaster) -> "CountCache":
+        return cls(broadcaster, max_age=float(get_env("STATS_COUNT_CACHE_SECONDS", "60")))
+
+    def token(self, device_type: str) -> tuple[int, int] | None:
+        """Snapshot to take BEFORE running the COUNT; None when caching is not possible."""
+        if self.max_age <= 0:
+            return None
+        self.broadcaster.start()
+        return self.broadcaster.version(device_type) if self.broadcaster.listening else None
+
+    def get(self, device_type: str) -> int | None:
+        entry = self._counts.get(device_type)
+        if entry is None:
+            return None
+        self.broadcaster.start()  # hits are uses too: keeps LISTEN from idling out under them
+        if (
+            not self.broadcaster.listening
+            or entry[0] != self.broadcaster.version(device_type)
+            or time.monotonic() - entry[1] > self.max_age
+        ):
+            return None
+        return entry[2]
+
+    def put(self, device_type: str, token: tuple[int, int] | None, count: int) -> None:
+        # Only cache if no notification for this type arrived while the COUNT ran
+        if token is not None and self.broadcaster.listening and token == self.broadcaster.version(device_type):
+            self._counts[device_type] = (token, time.monotonic(), count)
+
+
+async def sse_events(sub: Subscriber, is_disconnected, keepalive: float = 15.0):
+    """Server-Sent Events for one subscriber: `event: delta` messages and keepalive comments."""
+    yield "retry: 3000\n\n"
+    while not await is_disconnected():
+        try:
+            await asyncio.wait_for(sub.ready.wait(), timeout=keepalive)
+        except asyncio.TimeoutError:
+            yield ": keepalive\n\n"
+            continue
+        yield f"event: delta\ndata: {json.dumps(sub.take())}\n\n"
@@ -0,0 +1,354 @@
+"""
+Ordered, versioned schema migrations.
+
+- Each migration has a unique, strictly increasing integer version.
+- Applied versions are recorded in public.schema_version.
+- Statements are executed one by one (asyncpg does not accept multi-statement strings).
+- Never edit a migration that has been released; append a new one instead.
+- Migrations are expand-only. The previous release keeps serving on the new schema during
+  a rolling deploy, so nothing it reads or writes may be dropped, renamed or retyped.
+  Add new columns next to the old ones, write both, and backfill existing rows in batches
+  (common.tools.backfill). Once the backfill is done and no pod of an earlier release
+  remains, WRITE_LEGACY_COLUMNS=0 (common.config) stops writing and reading the old
+  columns, so rows stop growing. Contract steps (DROP COLUMN, ALTER ... TYPE, SET NOT NULL) ship
+  in a later release, after no pod of the old release remains and the backfill is done,
+  as migrations marked contract=True (anything else is rejected at import).
+- Each migration is applied and recorded in its own transaction. Indexes on existing tables
+  are built with CREATE INDEX CONCURRENTLY in migrations marked transactional=False, which
+  run outside any transaction so registrations keep inserting during the build.
+"""
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+
+SCHEMA_VERSION_TABLE = "public.schema_version"
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    statements: tuple[str, ...]
+    # Set on the (later-release) migrations that drop or retype what an older release used
+    contract: bool = False
+    # False: every statement is a CREATE [UNIQUE] INDEX CONCURRENTLY IF NOT EXISTS, run in
+    # autocommit (see apply_concurrently); a plain CREATE INDEX would block writes for the build
+    transactional: bool = True
+
+
+# Statements that break the previous release while it still runs (see module docstring)
+_CONTRACT_STATEMENT = re.compile(
+    r"\bDROP\s+(COLUMN|TABLE|VIEW)\b|\bALTER\s+COLUMN\s+\w+\s+(SET\s+DATA\s+)?TYPE\b"
+    r"|\bSET\s+NOT\s+NULL\b|\bRENAME\b",
+    re.IGNORECASE,
+)
+_CONCURRENT_INDEX = re.compile(
+    r"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(?P<name>\w+)\s+ON\s+public\.",
+    re.IGNORECASE,
+)
+
+
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(
+        version=1,
+        description="baseline device_registrations table",
+        # Mirrors what METADATA.create_all produced, so databases created by the
+        # old bootstrap are adopted as-is (IF NOT EXISTS everywhere).
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS public.device_registrations (
+                id SERIAL PRIMARY KEY,
+                user_key VARCHAR(255) NOT NULL,
+                device_type VARCHAR(50) NOT NULL,
+                user_agent VARCHAR(1024),
+                client_ip VARCHAR(45),
+                created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+            )
+            """,
+            "CREATE INDEX IF NOT EXISTS ix_device_registrations_id ON public.device_registrations (id)",
+            "CREATE INDEX IF NOT EXISTS ix_device_registrations_user_key ON public.device_registrations (user_key)",
+            "CREATE INDEX IF NOT EXISTS ix_device_registrations_device_type ON public.device_registrations (device_type)",
+            "CREATE INDEX IF NOT EXISTS ix_device_registrations_created_at ON public.device_registrations (created_at)",
+        ),
+    ),
+    Migration(
+        version=2,
+        description="dictionary-encode user_agent into user_agents",
+        # Expand only: user_agent stays (the previous release still writes it) and new rows
+        # carry both. Old rows are filled by `common.tools.backfill` in batches; the
+        # column is dropped in a later release, once no pod of this one remains.
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS public.user_agents (
+                id SERIAL PRIMARY KEY,
+                user_agent VARCHAR(1024) NOT NULL UNIQUE
+            )
+            """,
+            # Nullable, no default: a catalog-only change, no table rewrite or scan
+            "ALTER TABLE public.device_registrations ADD COLUMN user_agent_id INTEGER REFERENCES public.user_agents (id)",
+        ),
+    ),
+    Migration(
+        version=3,
+        description="device_type_code SMALLINT and client_inet INET columns",
+        # Expand only, like v2: the previous release keeps writing device_type/client_ip as
+        # strings, so the typed encodings are new nullable columns written next to them.
+        # Old rows are filled by `common.tools.backfill`; reads switch over and the string
+        # columns are dropped in a later release. Their index is v9 (built CONCURRENTLY).
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS public.device_types (
+                code SMALLINT PRIMARY KEY,
+                name VARCHAR(50) NOT NULL UNIQUE
+            )
+            """,
+            """
+            INSERT INTO public.device_types (code, name) VALUES
+                (0, 'Unknown'), (1, 'Android'), (2, 'iOS'), (3, 'Windows'), (4, 'macOS'),
+                (5, 'Linux'), (6, 'BSD'), (7, 'Desktop'), (8, 'Laptop'), (9, 'Tablet'),
+                (10, 'Phone'), (11, 'SmartTV'), (12, 'Wearable'), (13, 'Bot')
+            ON CONFLICT (code) DO NOTHING
+            """,
+            # Nullable, no default: catalog-only changes, no table rewrite or scan
+            "ALTER TABLE public.device_registrations ADD COLUMN device_type_code SMALLINT REFERENCES public.device_types (code)",
+            "ALTER TABLE public.device_registrations ADD COLUMN client_inet INET",
+        ),
+    ),
+    Migration(
+        version=4,
+        description="NOTIFY per-statement device_type deltas for live statistics",
+        statements=(
+            # One aggregated notification per INSERT statement (COPY and multi-row inserts
+            # included). clock_timestamp() keeps payloads unique: Postgres folds identical
+            # notifications within one transaction.
+            """
+            CREATE OR REPLACE FUNCTION public.notify_device_registrations() RETURNS trigger AS $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM new_rows) THEN
+                    PERFORM pg_notify('device_registrations', (
+                        SELECT json_build_object('ts', clock_timestamp(), 'counts', json_object_agg(device_type, n))::text
+                        FROM (SELECT device_type, COUNT(*) AS n FROM new_rows GROUP BY device_type) s
+                    ));
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+            """
+            CREATE TRIGGER trg_device_registrations_notify
+                AFTER INSERT ON public.device_registrations
+                REFERENCING NEW TABLE AS new_rows
+                FOR EACH STATEMENT EXECUTE FUNCTION public.notify_device_registrations()
+            """,
+        ),
+    ),
+    Migration(
+        version=5,
+        description="heavy-hitter Count-Min sketch buckets",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS public.heavy_hitter_buckets (
+                bucket_start TIMESTAMP WITH TIME ZONE PRIMARY KEY,
+                width INTEGER NOT NULL,
+                depth INTEGER NOT NULL,
+                counters BYTEA NOT NULL,
+                candidates JSONB NOT NULL DEFAULT '{}'
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=6,
+        description="bulk import checkpoints",
+        statements=(
+            """
+            CREATE TABLE IF NOT EXISTS public.import_checkpoints (
+                source VARCHAR(512) NOT NULL,
+                batch_no INTEGER NOT NULL,
+                rows INTEGER NOT NULL,
+                imported_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+                PRIMARY KEY (source, batch_no)
+            )
+            """,
+        ),
+    ),
+    Migration(
+        version=7,
+        description="idempotency keys on device_registrations",
+        statements=(
+            "ALTER TABLE public.device_registrations ADD COLUMN IF NOT EXISTS idempotency_key VARCHAR(255)",
+        ),
+    ),
+    Migration(
+        version=8,
+        description="unique index on (user_key, idempotency_key)",
+        # Databases that applied v7 before this index moved here already have it (valid),
+        # so IF NOT EXISTS makes this a no-op for them.
+        statements=(
+            # Partial: rows without a key (the vast majority) cost nothing in the index
+            """
+            CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ux_device_registrations_idempotency
+            ON public.device_registrations (user_key, idempotency_key)
+            WHERE idempotency_key IS NOT NULL
+            """,
+        ),
+        transactional=False,
+    ),
+    Migration(
+        version=9,
+        description="(device_type_code, client_inet) index for subnet statistics",
+        statements=(
+            # Partial: only rows with an address are aggregated; backs the per-deviceType
+            # filter and lets the unfiltered aggregation read the index instead of the heap
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_device_registrations_device_type_code_client_inet
+            ON public.device_registrations (device_type_code, client_inet)
+            WHERE client_inet IS NOT NULL
+            """,
+        ),
+        transactional=False,
+    ),
+    Migration(
+        version=10,
+        description="device_type_code index",
+        # Counts by device_type_code once WRITE_LEGACY_COLUMNS=0 (new rows have no device_type)
+        statements=(
+            """
+            CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_device_registrations_device_type_code
+            ON public.device_registrations (device_type_code)
+            """,
+        ),
+        transactional=False,
+    ),
+    Migration(
+        version=11,
+        description="device_type nullable; NOTIFY falls back to device_type_code",
+        # Lets WRITE_LEGACY_COLUMNS=0 leave device_type NULL. Relaxing a constraint is
+        # catalog-only and the previous release always writes device_type, so it is unaffected.
+        statements=(
+            "ALTER TABLE public.device_registrations ALTER COLUMN device_type DROP NOT NULL",
+            """
+            CREATE OR REPLACE FUNCTION public.notify_device_registrations() RETURNS trigger AS $$
+            BEGIN
+                IF EXISTS (SELECT 1 FROM new_rows) THEN
+                    PERFORM pg_notify('device_registrations', (
+                        SELECT json_build_object('ts', clock_timestamp(), 'counts', json_object_agg(device_type, n))::text
+                        FROM (
+                            SELECT COALESCE(r.device_type, t.name, 'Unknown') AS device_type, COUNT(*) AS n
+                            FROM new_rows r LEFT JOIN public.device_types t ON t.code = r.device_type_code
+                            GROUP BY 1
+                        ) s
+                    ));
+                END IF;
+                RETURN NULL;
+            END
+            $$ LANGUAGE plpgsql
+            """,
+        ),
+    ),
+)
+
+LATEST_VERSION: int = MIGRATIONS[-1].version
+
+
+async def current_version(conn) -> int:
+    """Return the applied schema version (0 when the version table does not exist yet)."""
+    res = await conn.execute(text(f"SELECT to_regclass('{SCHEMA_VERSION_TABLE}')"))
+    if res.scalar() is None:
+        return 0
+    res = await conn.execute(text(f"SELECT COALESCE(MAX(version), 0) FROM {SCHEMA_VERSION_TABLE}"))
+    return int(res.scalar() or 0)
+
+
+async def ensure_version_table(conn) -> None:
+    await conn.execute(text(
+        f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA_VERSION_TABLE} (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        """
+    ))
+
+
+def pending(version: int) -> list[Migration]:
+    """Migrations newer than `version`, in apply order."""
+    return [m for m in MIGRATIONS if m.version > version]
+
+
+async def apply(conn, migration: Migration) -> None:
+    """Run one migration's statements and record it (caller owns the transaction)."""
+    for stmt in migration.statements:
+        await conn.execute(text(stmt))
+    await _record(conn, migration)
+
+
+async def apply_concurrently(conn, migration: Migration) -> None:
+    """
+    Build a transactional=False migration's indexes, then record it. `conn` must be in
+    autocommit mode. A failed or cancelled build leaves an INVALID index behind, which
+    IF NOT EXISTS would then skip: it is dropped and rebuilt. The version is recorded
+    only once every index is valid.
+    """
+    for stmt in migration.statements:
+        name = _CONCURRENT_INDEX.match(stmt).group("name")
+        if await index_valid(conn, name) is False:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS public.{name}"))
+        await conn.execute(text(stmt))
+        if not await index_valid(conn, name):
+            raise RuntimeError(f"Index public.{name} is not valid after migration {migration.version}")
+    await _record(conn, migration)
+
+
+async def index_valid(conn, name: str) -> bool | None:
+    """pg_index.indisvalid of public.<name>, None when the index does not exist."""
+    res = await conn.execute(
+        text("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(:n)").bindparams(n=f"public.{name}")
+    )
+    return res.scalar()
+
+
+async def _record(conn, migration: Migration) -> None:
+    await conn.execute(
+        text(f"INSERT INTO {SCHEMA_VERSION_TABLE} (version, description) VALUES (:v, :d)")
+        .bindparams(v=migration.version, d=migration.description)
+    )
+
+
+def _check_ordering() -> None:
+    versions = [m.version for m in MIGRATIONS]
+    if versions != sorted(set(versions)):
+        raise RuntimeError(f"Migrations must have unique, increasing versions: {versions}")
+
+
+def _check_expand_only() -> None:
+    for m in MIGRATIONS:
+        if m.contract:
+            continue
+        for stmt in m.statements:
+            if _CONTRACT_STATEMENT.search(stmt):
+                raise RuntimeError(
+                    f"Migration {m.version} drops, renames or retypes a column; ship it in a later "
+                    f"release as a separate contract=True migration: {' '.join(stmt.split())[:120]}"
+                )
+
+
+def _check_concurrent() -> None:
+    for m in MIGRATIONS:
+        for stmt in m.statements:
+            if m.transactional == bool(_CONCURRENT_INDEX.match(stmt)):
+                raise RuntimeError(
+                    f"Migration {m.version}: transactional=False migrations hold only, and all of them, the "
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS public.<name> statements: {' '.join(stmt.split())[:120]}"
+                )
+
+
+_check_ordering()
+_check_expand_only()
+_check_concurrent()
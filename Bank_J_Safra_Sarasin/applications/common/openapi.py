@@ -0,0 +1,33 @@
+"""
+Serve the exported OpenAPI schema from disk instead of generating it at runtime.
+
+The files are produced by common.tools.generate_openapi (kept in OpenAPI/ and copied
+next to each service in the image). Without the file, the schema is generated as usual.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+from pathlib import Path
+
+from fastapi import FastAPI
+
+logger = logging.getLogger("openapi")
+
+
+def use_prebuilt_openapi(app: FastAPI, path: str | Path) -> None:
+    """Replace app.openapi with a loader for `path`, read on the first /openapi.json request."""
+    path = Path(path)
+
+    def openapi() -> dict:
+        if app.openapi_schema is None:
+            try:
+                app.openapi_schema = json.loads(path.read_text(encoding="utf-8"))
+            except FileNotFoundError:
+                logger.info("No prebuilt OpenAPI at %s; generating at runtime", path)
+                # Unbound call: FastAPI's own generator (also used by generate_openapi)
+                return FastAPI.openapi(app)
+        return app.openapi_schema
+
+    app.openapi = openapi
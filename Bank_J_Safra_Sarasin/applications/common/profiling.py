@@ -0,0 +1,223 @@
+"""
+Sampling request profiler (ASGI middleware) with an on-demand admin endpoint.
+
+- A request is profiled with probability PROFILE_SAMPLE_RATE, or always while a
+  time-boxed window started via POST /admin/profile is open.
+- While profiled requests are in flight, a daemon thread samples the event-loop
+  thread's stack every PROFILE_INTERVAL_MS (sys._current_frames). In between it
+  blocks on an Event, so it costs nothing while no profiled request runs. A sample counts
+  only if the stack passes through a profiled request, and is attributed to that
+  request's route template (read from its ASGI scope).
+- Stacks are aggregated per route and dumped in collapsed format
+  ("route;frame;frame... count"), ready for flamegraph.pl / speedscope.
+- Off (rate 0, no window): one float comparison per request and no thread.
+
+Profiles are per worker: the dump comes from whichever worker served GET /admin/profile.
+
+Env:
+  PROFILE_SAMPLE_RATE         = float 0..1, fraction of requests profiled (default 0)
+  PROFILE_INTERVAL_MS         = float, sampling interval (default 5)
+  PROFILE_MAX_WINDOW_SECONDS  = int, cap for on-demand windows (default 300)
+  PROFILE_MAX_STACKS          = int, distinct stacks kept (default 10000)
+"""
+
+from __future__ import annotations
+
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from common.admin import require_admin_token
+
+
+def _label(code) -> str:
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}:{code.co_firstlineno}"
+
+
+def _route_of(scope: dict) -> str:
+    # Route template, not the raw path: keeps per-route aggregation bounded
+    path = getattr(scope.get("route"), "path", None) or "(unmatched)"
+    return f"{scope.get('method', '')} {path}".strip()
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        *,
+        sample_rate: float = 0.0,
+        interval: float = 0.005,
+        max_window: float = 300.0,
+        max_stacks: int = 10_000,
+    ):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_window = max_window
+        self.max_stacks = max_stacks
+        self.window_until = 0.0
+        self.stacks: Counter[tuple[str, ...]] = Counter()
+        self.requests: Counter[str] = Counter()
+        self.dropped = 0
+        self._active = 0
+        self._loop_thread: int | None = None
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()  # set while profiled requests are in flight
+
+    @classmethod
+    def from_env(cls) -> "SamplingProfiler":
+        return cls(
+            sample_rate=float(os.getenv("PROFILE_SAMPLE_RATE", "0")),
+            interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000.0,
+            max_window=float(os.getenv("PROFILE_MAX_WINDOW_SECONDS", "300")),
+            max_stacks=int(os.getenv("PROFILE_MAX_STACKS", "10000")),
+        )
+
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 or time.monotonic() < self.window_until
+
+    def should_profile(self) -> bool:
+        if time.monotonic() < self.window_until:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start_window(self, seconds: float) -> float:
+        seconds = max(0.0, min(seconds, self.max_window))
+        self.window_until = time.monotonic() + seconds
+        return seconds
+
+    def reset(self) -> None:
+        with self._lock:
+            self.stacks.clear()
+            self.requests.clear()
+            self.dropped = 0
+
+    def collapsed(self, route: str | None = None) -> str:
+        with self._lock:
+            items = list(self.stacks.items())
+        lines = [
+            f"{';'.join(stack)} {n}"
+            for stack, n in sorted(items, key=lambda kv: kv[1], reverse=True)
+            if route is None or stack[0] == route
+        ]
+        return "\n".join(lines) + ("\n" if lines else "")
+
+    def summary(self) -> dict:
+        with self._lock:
+            samples: Counter[str] = Counter()
+            for stack, n in self.stacks.items():
+                samples[stack[0]] += n
+            return {
+                "enabled": self.enabled(),
+                "sampleRate": self.sample_rate,
+                "windowRemainingSeconds": round(max(0.0, self.window_until - time.monotonic()), 1),
+                "intervalMs": self.interval * 1000,
+                "droppedSamples": self.dropped,
+                "routes": {
+                    r: {"requests": self.requests[r], "samples": samples[r]}
+                    for r in sorted(set(self.requests) | set(samples))
+                },
+            }
+
+    # --- request side (event loop thread) ---
+
+    def _enter(self) -> None:
+        self._loop_thread = threading.get_ident()
+        with self._lock:
+            self._active += 1
+            self._wake.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="profiler", daemon=True)
+                self._thread.start()
+
+    def _exit(self, scope: dict) -> None:
+        with self._lock:
+            self._active -= 1
+            self.requests[_route_of(scope)] += 1
+
+    # --- sampler thread ---
+
+    def _sample_loop(self) -> None:
+        while True:
+            if not self._active:
+                # Cleared under the lock, so an _enter() racing with this cannot be missed
+                with self._lock:
+                    if not self._active:
+                        self._wake.clear()
+                self._wake.wait()
+                continue
+            time.sleep(self.interval)
+            frame = sys._current_frames().get(self._loop_thread)
+            stack: list[str] = []
+            while frame is not None and frame.f_code is not _PROFILED_CALL:
+                stack.append(_label(frame.f_code))
+                frame = frame.f_back
+            if frame is None:
+                continue  # loop idle or running something else
+            scope = frame.f_locals.get("scope") or {}
+            key = (_route_of(scope), *reversed(stack))
+            with self._lock:
+                if key in self.stacks or len(self.stacks) < self.max_stacks:
+                    self.stacks[key] += 1
+                else:
+                    self.dropped += 1
+
+
+class ProfilingMiddleware:
+    """Pure ASGI; profiles sampled HTTP requests with the given SamplingProfiler."""
+
+    def __init__(self, app, profiler: SamplingProfiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.profiler.should_profile():
+            await self.app(scope, receive, send)
+            return
+        await _profiled_call(self, scope, receive, send)
+
+
+async def _profiled_call(mw: ProfilingMiddleware, scope, receive, send):
+    # The sampler recognizes this frame on the stack and reads `scope` from it
+    mw.profiler._enter()
+    try:
+        await mw.app(scope, receive, send)
+    finally:
+        mw.profiler._exit(scope)
+
+
+_PROFILED_CALL = _profiled_call.__code__
+
+
+def profiler_router(profiler: SamplingProfiler) -> APIRouter:
+    """Admin endpoints (X-Admin-Token) to run a profiling window and fetch the dump."""
+    router = APIRouter(prefix="/admin/profile", dependencies=[Depends(require_admin_token)])
+
+    @router.post("")
+    async def start_profile(seconds: float = Query(30, gt=0), reset: bool = Query(True)):
+        """Profile every request on this worker for `seconds` (capped)."""
+        if reset:
+            profiler.reset()
+        granted = profiler.start_window(seconds)
+        return {"statusCode": 200, "message": "profiling", "seconds": granted}
+
+    @router.get("", response_class=PlainTextResponse)
+    async def get_profile(route: str | None = Query(None), format: str = Query("collapsed", pattern="^(collapsed|json)$")):
+        """Collapsed stacks (flamegraph input) or a per-route JSON summary."""
+        if format == "json":
+            return JSONResponse(profiler.summary())
+        return profiler.collapsed(route)
+
+    @router.delete("")
+    async def reset_profile():
+        profiler.window_until = 0.0
+        profiler.reset()
+        return {"statusCode": 200, "message": "reset"}
+
+    return router
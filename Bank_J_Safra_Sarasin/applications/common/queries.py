@@ -0,0 +1,90 @@
+"""
+SQL of the services' hot queries, shared with the diagnostics tools
+(common.tools.db_healthcheck, common.tools.benchmark) so they plan and time exactly
+what production runs, bound parameters included.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.sql.dml import Insert
+from sqlalchemy.sql.elements import TextClause
+
+from common.config import write_legacy_columns
+from common.db import DeviceRegistration
+from common.device_types import DeviceType, device_type_code
+
+# GET /Log/auth/statistics/subnets defaults
+DEFAULT_PREFIX_V4 = 24
+DEFAULT_PREFIX_V6 = 48
+DEFAULT_SUBNET_LIMIT = 20
+
+# WRITE_LEGACY_COLUMNS (common.config.write_legacy_columns): "0" once the backfill is done
+WRITE_LEGACY_COLUMNS = write_legacy_columns()
+
+
+def device_type_count(device_type: DeviceType) -> TextClause:
+    """COUNT(*) of one device type, parameter bound."""
+    if WRITE_LEGACY_COLUMNS:
+        # Old rows may lack device_type_code until the backfill has run
+        return text(
+            "SELECT COUNT(*) FROM public.device_registrations WHERE device_type = :dt"
+        ).bindparams(dt=device_type.value)
+    # New rows have no device_type; served by ix_device_registrations_device_type_code (v10)
+    return text(
+        "SELECT COUNT(*) FROM public.device_registrations WHERE device_type_code = :code"
+    ).bindparams(code=device_type_code(device_type))
+
+
+def subnet_counts(by_device_type: bool) -> TextClause:
+    """Top subnets; binds :p4, :p6, :lim and (by_device_type) :dt, a device type code."""
+    # Served by the partial (device_type_code, client_inet) index (migration v9)
+    where = "client_inet IS NOT NULL" + (" AND device_type_code = :dt" if by_device_type else "")
+    return text(
+        "SELECT network(set_masklen(client_inet, CASE WHEN family(client_inet) = 4 THEN CAST(:p4 AS integer) ELSE CAST(:p6 AS integer) END))::text AS subnet, "
+        "COUNT(*) AS count "
+        f"FROM public.device_registrations WHERE {where} "
+        "GROUP BY 1 ORDER BY 2 DESC, 1 LIMIT :lim"
+    )
+
+
+def registration_values(
+    *,
+    user_key: str,
+    device_type: DeviceType,
+    user_agent: str | None,
+    user_agent_id: int | None,
+    client_ip: str | None,
+    idempotency_key: str | None,
+) -> dict[str, Any]:
+    """Column values of one registration; the legacy strings only with WRITE_LEGACY_COLUMNS."""
+    legacy = WRITE_LEGACY_COLUMNS
+    return {
+        "user_key": user_key,
+        "device_type": device_type.value if legacy else None,
+        "device_type_code": device_type_code(device_type),
+        "user_agent": user_agent if legacy else None,
+        "user_agent_id": user_agent_id,
+        "client_ip": client_ip if legacy else None,
+        "client_inet": client_ip,
+        "idempotency_key": idempotency_key,
+    }
+
+
+def registration_insert(values: dict[str, Any]) -> Insert:
+    """
+    INSERT of one registration. A (user_key, idempotency_key) already stored hits the
+    partial unique index: nothing is inserted and RETURNING yields no row.
+    """
+    return (
+        pg_insert(DeviceRegistration)
+        .values(**values)
+        .on_conflict_do_nothing(
+            index_elements=["user_key", "idempotency_key"],
+            index_where=text("idempotency_key IS NOT NULL"),
+        )
+        .returning(DeviceRegistration.id)
+    )
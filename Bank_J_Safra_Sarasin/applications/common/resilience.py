@@ -0,0 +1,195 @@
+"""
+Resilience helpers for service-to-service calls (per worker, in-memory).
+
+- CircuitBreaker: failure-rate threshold over a rolling window of calls,
+  fast failure while open, limited half-open probing before closing again.
+  Every allow() that returned True must be followed by record() or, when the call
+  ended without an outcome (cancelled), release(); otherwise half-open slots leak.
+- retry_async: bounded retries with full-jitter exponential backoff and an optional
+  overall deadline; the caller decides which failures are safe to retry.
+- render_metrics: Prometheus text exposition of breaker state for alerting.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable
+from typing import TypeVar
+
+from common.config import get_env
+
+logger = logging.getLogger("resilience")
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(RuntimeError):
+    """Raised instead of calling the dependency while the breaker is open."""
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        *,
+        failure_rate: float = 0.5,
+        min_calls: int = 10,
+        window: int = 20,
+        open_seconds: float = 10.0,
+        half_open_calls: int = 1,
+    ):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.state = CLOSED
+        self._outcomes: deque[bool] = deque(maxlen=window)  # True = failure
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        # counters for metrics
+        self.calls_total = 0
+        self.failures_total = 0
+        self.rejected_total = 0
+        self.opened_total = 0
+
+    @classmethod
+    def from_env(cls, name: str, prefix: str = "CB_") -> "CircuitBreaker":
+        return cls(
+            name,
+            failure_rate=float(get_env(f"{prefix}FAILURE_RATE", "0.5")),
+            min_calls=int(get_env(f"{prefix}MIN_CALLS", "10")),
+            window=int(get_env(f"{prefix}WINDOW", "20")),
+            open_seconds=float(get_env(f"{prefix}OPEN_SECONDS", "10")),
+            half_open_calls=int(get_env(f"{prefix}HALF_OPEN_CALLS", "1")),
+        )
+
+    def _transition(self, state: str) -> None:
+        if state == self.state:
+            return
+        logger.warning("Circuit '%s': %s -> %s", self.name, self.state, state)
+        self.state = state
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+            self.opened_total += 1
+        elif state == HALF_OPEN:
+            self._probes_in_flight = 0
+            self._probe_successes = 0
+        else:
+            self._outcomes.clear()
+
+    def allow(self) -> bool:
+        """Whether a call may go through now (reserves a probe slot when half-open)."""
+        if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+            self._transition(HALF_OPEN)
+        if self.state == OPEN:
+            self.rejected_total += 1
+            return False
+        if self.state == HALF_OPEN:
+            if self._probes_in_flight >= self.half_open_calls:
+                self.rejected_total += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+
+    def release(self) -> None:
+        """Give back a slot from allow() without an outcome (e.g. the caller was cancelled)."""
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+
+    def record(self, failed: bool) -> None:
+        self.calls_total += 1
+        if failed:
+            self.failures_total += 1
+        if self.state == HALF_OPEN:
+            self._probes_in_flight = max(0, self._probes_in_flight - 1)
+            if failed:
+                self._transition(OPEN)
+            else:
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_calls:
+                    self._transition(CLOSED)
+            return
+        self._outcomes.append(failed)
+        if len(self._outcomes) >= self.min_calls:
+            rate = sum(self._outcomes) / len(self._outcomes)
+            if rate >= self.failure_rate:
+                self._transition(OPEN)
+
+    def snapshot(self) -> dict:
+        return {
+            "name": self.name,
+            "state": self.state,
+            "calls_total": self.calls_total,
+            "failures_total": self.failures_total,
+            "rejected_total": self.rejected_total,
+            "opened_total": self.opened_total,
+        }
+
+
+async def retry_async(
+    fn: Callable[[], Awaitable[T]],
+    *,
+    should_retry: Callable[[BaseException | None, T | None], bool],
+    attempts: int = 3,
+    base_delay: float = 0.05,
+    max_delay: float = 0.5,
+    deadline: float | None = None,
+) -> T:
+    """
+    Call fn up to `attempts` times. After each try, should_retry(exc, result) decides whether
+    another attempt is safe; sleeps a full-jitter backoff in between. Returns the last
+    result or re-raises the last exception.
+    `deadline` (a time.monotonic() value) bounds the whole sequence: no retry starts after it,
+    backoff never sleeps past it, and an attempt still running at the deadline is cancelled
+    (asyncio.TimeoutError).
+    """
+    for attempt in range(1, attempts + 1):
+        exc: BaseException | None = None
+        result: T | None = None
+        try:
+            if deadline is None:
+                result = await fn()
+            else:
+                result = await asyncio.wait_for(fn(), max(0.0, deadline - time.monotonic()))
+        except Exception as e:
+            exc = e
+        out_of_time = deadline is not None and time.monotonic() >= deadline
+        if attempt == attempts or out_of_time or not should_retry(exc, result):
+            if exc is not None:
+                raise exc
+            return result  # type: ignore[return-value]
+        delay = random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+        if deadline is not None:
+            delay = min(delay, max(0.0, deadline - time.monotonic()))
+        await asyncio.sleep(delay)
+    raise AssertionError("unreachable")
+
+
+def render_metrics(breakers: list[CircuitBreaker]) -> str:
+    """Prometheus text format for the given breakers."""
+    lines = [
+        "# HELP circuit_breaker_state 0=closed, 1=half_open, 2=open",
+        "# TYPE circuit_breaker_state gauge",
+    ]
+    lines += [f'circuit_breaker_state{{name="{b.name}"}} {_STATE_VALUE[b.state]}' for b in breakers]
+    for field, help_text in (
+        ("calls_total", "Calls that reached the dependency"),
+        ("failures_total", "Calls counted as failures"),
+        ("rejected_total", "Calls short-circuited by the breaker"),
+        ("opened_total", "Transitions to open"),
+    ):
+        lines.append(f"# HELP circuit_breaker_{field} {help_text}")
+        lines.append(f"# TYPE circuit_breaker_{field} counter")
+        lines += [f'circuit_breaker_{field}{{name="{b.name}"}} {getattr(b, field)}' for b in breakers]
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,195 @@
+"""
+Batched backfill of the columns added by expand-only migrations (see common.migrations).
+
+- Run it once the rollout has finished, i.e. every pod writes the new columns too.
+  Rows written before that are filled here:
+    * user_agent_id     from user_agent (get-or-create in user_agents)
+    * device_type_code  from device_type (device_types; unknown names become 0, 'Unknown')
+    * client_inet       from client_ip (strings that are not an address stay NULL)
+- Walks device_registrations in id ranges (--batch-size ids), one short transaction per
+  batch and step; it only touches rows whose new column is still NULL, so it can be
+  stopped and re-run at any time. --pause-ms throttles it between batches.
+- Every shard is processed (DATABASE_SHARD_URLS / DATABASE_URL, or repeated --url).
+- --check only counts rows still to backfill; non-zero exit code while any remain.
+  It must pass on every shard before WRITE_LEGACY_COLUMNS=0 (common.config) and before
+  the release that drops the old columns.
+
+Examples:
+  python -m common.tools.backfill --check
+  python -m common.tools.backfill --batch-size 20000 --pause-ms 50
+  python -m common.tools.backfill --url postgresql://db-0/devicesdb --url postgresql://db-1/devicesdb
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass
+
+import asyncpg
+
+from common.config import database_urls
+
+logger = logging.getLogger("backfill")
+
+
+@dataclass(frozen=True)
+class Step:
+    name: str
+    # Run in order in one transaction per batch, with $1/$2 = [lo, hi) id range
+    statements: tuple[str, ...]
+    # Rows this step still has to fill (whole table)
+    remaining: str
+
+
+# Per connection: unparseable client_ip strings (clientIp was free text) become NULL instead of failing
+_SESSION_SETUP = """
+CREATE FUNCTION pg_temp.try_inet(v text) RETURNS inet AS $$
+BEGIN
+    RETURN v::inet;
+EXCEPTION WHEN others THEN
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql IMMUTABLE
+"""
+
+STEPS: tuple[Step, ...] = (
+    Step(
+        name="user_agent_id",
+        statements=(
+            # Sorted, so concurrent get-or-creates (the API's) take row locks in the same order
+            """
+            INSERT INTO public.user_agents (user_agent)
+            SELECT DISTINCT user_agent FROM public.device_registrations
+            WHERE id >= $1 AND id < $2 AND user_agent_id IS NULL AND user_agent <> ''
+            ORDER BY 1
+            ON CONFLICT (user_agent) DO NOTHING
+            """,
+            """
+            UPDATE public.device_registrations d SET user_agent_id = u.id
+            FROM public.user_agents u
+            WHERE d.id >= $1 AND d.id < $2 AND d.user_agent_id IS NULL AND u.user_agent = d.user_agent
+            """,
+        ),
+        remaining=(
+            "SELECT COUNT(*) FROM public.device_registrations "
+            "WHERE user_agent_id IS NULL AND user_agent <> ''"
+        ),
+    ),
+    Step(
+        name="device_type_code",
+        statements=(
+            """
+            UPDATE public.device_registrations d
+            SET device_type_code = COALESCE((SELECT t.code FROM public.device_types t WHERE t.name = d.device_type), 0)
+            WHERE d.id >= $1 AND d.id < $2 AND d.device_type_code IS NULL
+            """,
+        ),
+        remaining="SELECT COUNT(*) FROM public.device_registrations WHERE device_type_code IS NULL",
+    ),
+    Step(
+        name="client_inet",
+        statements=(
+            """
+            UPDATE public.device_registrations SET client_inet = pg_temp.try_inet(client_ip)
+            WHERE id >= $1 AND id < $2 AND client_inet IS NULL AND pg_temp.try_inet(client_ip) IS NOT NULL
+            """,
+        ),
+        remaining=(
+            "SELECT COUNT(*) FROM public.device_registrations "
+            "WHERE client_inet IS NULL AND pg_temp.try_inet(client_ip) IS NOT NULL"
+        ),
+    ),
+)
+
+
+def _updated(status: str) -> int:
+    # asyncpg returns the command tag, e.g. "UPDATE 1234"
+    return int(status.rsplit(" ", 1)[-1]) if status.startswith("UPDATE") else 0
+
+
+async def _connect(dsn: str) -> asyncpg.Connection:
+    conn = await asyncpg.connect(dsn=dsn, timeout=10)
+    await conn.execute(_SESSION_SETUP)
+    return conn
+
+
+async def remaining(dsn: str) -> dict[str, int]:
+    conn = await _connect(dsn)
+    try:
+        return {step.name: await conn.fetchval(step.remaining) for step in STEPS}
+    finally:
+        await conn.close()
+
+
+async def backfill_shard(shard: int, dsn: str, *, batch_size: int, pause: float) -> Counter[str]:
+    """Fill every step's column on one shard; returns updated rows per step."""
+    updated: Counter[str] = Counter()
+    conn = await _connect(dsn)
+    try:
+        lo_id, hi_id = await conn.fetchrow("SELECT COALESCE(min(id), 0), COALESCE(max(id), -1) FROM public.device_registrations")
+        for lo in range(lo_id, hi_id + 1, batch_size):
+            for step in STEPS:
+                async with conn.transaction():
+                    for stmt in step.statements:
+                        status = await conn.execute(stmt, lo, lo + batch_size)
+                updated[step.name] += _updated(status)
+            if (lo - lo_id) // batch_size % 100 == 0:
+                logger.info("Shard %d: ids up to %d of %d, %s", shard, lo + batch_size - 1, hi_id, dict(updated))
+            if pause:
+                await asyncio.sleep(pause)
+    finally:
+        await conn.close()
+    return updated
+
+
+async def run(dsns: list[str], *, batch_size: int, pause: float) -> dict:
+    start = time.monotonic()
+    results = await asyncio.gather(*(
+        backfill_shard(shard, dsn, batch_size=batch_size, pause=pause) for shard, dsn in enumerate(dsns)
+    ))
+    return {
+        "shards": len(dsns),
+        "updated": [dict(r) for r in results],
+        "remaining": [await remaining(dsn) for dsn in dsns],
+        "seconds": round(time.monotonic() - start, 2),
+    }
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Backfill columns added by expand-only migrations, in batches.")
+    parser.add_argument("--url", action="append", help="Shard URL, repeatable (default DATABASE_SHARD_URLS / DATABASE_URL)")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Ids per batch and transaction")
+    parser.add_argument("--pause-ms", type=int, default=0, help="Sleep between batches (throttling)")
+    parser.add_argument("--check", action="store_true", help="Only count rows still to backfill; exit 1 if any")
+    args = parser.parse_args()
+
+    try:
+        urls = args.url or database_urls()
+    except RuntimeError:
+        print("DATABASE_URL not provided.", file=sys.stderr)
+        return 2
+    # asyncpg expects postgresql://...
+    dsns = [url.replace("postgresql+asyncpg://", "postgresql://") for url in urls]
+
+    try:
+        if args.check:
+            counts = [asyncio.run(remaining(dsn)) for dsn in dsns]
+            print(json.dumps({"remaining": counts}))
+            return 1 if any(n for c in counts for n in c.values()) else 0
+        summary = asyncio.run(run(dsns, batch_size=args.batch_size, pause=args.pause_ms / 1000.0))
+    except Exception:
+        logger.exception("Backfill failed; re-run the same command to continue")
+        return 1
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,383 @@
+"""
+Synthetic data generator and query-plan benchmark for device_registrations at scale.
+
+generate  -- COPY realistic synthetic registrations into a (local!) Postgres:
+             Zipf-skewed device types, userKeys and User-Agents (a few thousand distinct,
+             dictionary-encoded), clustered client subnets, created_at spread over --days.
+             Parallel worker processes, each with its own connection.
+run       -- time the app's query set (db_healthcheck.HOT_QUERIES) under several index /
+             storage configurations. Each configuration's DDL is applied, the table is
+             VACUUM ANALYZEd, queries are timed, and the DDL is reverted. Each timed run
+             gets fresh parameters (a new insert key) and writes run in a savepoint that is
+             rolled back, so every INSERT is a real one. A configuration without teardown
+             (e.g. CLUSTER) runs last. Prints a JSON report plus a comparison table
+             against the first configuration.
+
+Examples:
+  python -m common.tools.benchmark generate --url postgresql://postgres@localhost/bench --rows 100000000 --jobs 8
+  python -m common.tools.benchmark run --url postgresql://postgres@localhost/bench \\
+      --configs baseline,brin_created_at,no_subnet_index --iterations 20 > bench.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import random
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import asyncpg
+
+from common.device_types import DEVICE_TYPE_CODES, DeviceType, normalize_device_type
+from common.tools.db_healthcheck import HOT_QUERIES
+
+logger = logging.getLogger("benchmark")
+
+COLUMNS = (
+    "user_key", "device_type", "device_type_code", "user_agent", "user_agent_id",
+    "client_ip", "client_inet", "created_at",
+)
+
+# Rough real-world mix; everything else shares the tail.
+DEVICE_WEIGHTS: dict[DeviceType, float] = {
+    DeviceType.Android: 45, DeviceType.iOS: 28, DeviceType.Windows: 12, DeviceType.macOS: 6,
+    DeviceType.Linux: 2.5, DeviceType.Tablet: 1.5, DeviceType.Phone: 1.2, DeviceType.Desktop: 0.8,
+    DeviceType.Laptop: 0.6, DeviceType.SmartTV: 0.5, DeviceType.Wearable: 0.3, DeviceType.BSD: 0.05,
+    DeviceType.Bot: 0.8, DeviceType.Unknown: 0.75,
+}
+
+# name -> (setup DDL, teardown DDL); setup runs before timing, teardown restores the schema.
+CONFIGS: dict[str, tuple[list[str], list[str]]] = {
+    "baseline": ([], []),
+    # What the subnet statistics cost without their index (migration v9)
+    "no_subnet_index": (
+        ["DROP INDEX IF EXISTS public.ix_device_registrations_device_type_code_client_inet"],
+        ["CREATE INDEX IF NOT EXISTS ix_device_registrations_device_type_code_client_inet "
+         "ON public.device_registrations (device_type_code, client_inet) WHERE client_inet IS NOT NULL"],
+    ),
+    "brin_created_at": (
+        ["DROP INDEX IF EXISTS public.ix_device_registrations_created_at",
+         "CREATE INDEX bench_brin_created_at ON public.device_registrations USING brin (created_at)"],
+        ["DROP INDEX IF EXISTS public.bench_brin_created_at",
+         "CREATE INDEX IF NOT EXISTS ix_device_registrations_created_at ON public.device_registrations (created_at)"],
+    ),
+    "no_redundant_id_index": (
+        ["DROP INDEX IF EXISTS public.ix_device_registrations_id"],
+        ["CREATE INDEX IF NOT EXISTS ix_device_registrations_id ON public.device_registrations (id)"],
+    ),
+    "clustered_by_device_type": (
+        ["CLUSTER public.device_registrations USING ix_device_registrations_device_type"],
+        [],  # heap order can't be undone: cmd_run runs it after every other config
+    ),
+}
+
+
+def _zipf_cum_weights(n: int, s: float = 1.1) -> list[float]:
+    return list(itertools.accumulate(1.0 / (i ** s) for i in range(1, n + 1)))
+
+
+def _zipf_index(rng: random.Random, n: int, s: float) -> int:
+    """
+    Zipf-like rank in [0, n) by inverting the continuous power-law CDF on [1, n + 1):
+    O(1) memory, unlike a cumulative weight table (millions of userKeys per process).
+    """
+    u = rng.random()
+    if s == 1.0:
+        x = (n + 1) ** u
+    else:
+        a = 1.0 - s
+        x = (1.0 + u * ((n + 1) ** a - 1.0)) ** (1.0 / a)
+    return min(n - 1, int(x) - 1)
+
+
+def _positive_int(value: str) -> int:
+    n = int(value)
+    if n < 1:
+        raise argparse.ArgumentTypeError(f"must be >= 1, got {n}")
+    return n
+
+
+def _dsn(url: str) -> str:
+    return url.replace("postgresql+asyncpg://", "postgresql://")
+
+
+# ---------------- generate ----------------
+
+async def _prepare_user_agents(dsn: str, count: int) -> list[tuple[str, int]]:
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        uas = [f"Mozilla/5.0 (synthetic {i}) AppleWebKit/537.36 Chrome/{100 + i % 30}.0" for i in range(count)]
+        await conn.execute(
+            "INSERT INTO public.user_agents (user_agent) SELECT unnest($1::text[]) ON CONFLICT (user_agent) DO NOTHING",
+            uas,
+        )
+        rows = await conn.fetch("SELECT user_agent, id FROM public.user_agents WHERE user_agent = ANY($1::text[])", uas)
+        ids = dict(rows)
+        return [(ua, ids[ua]) for ua in uas]  # keep popularity order
+    finally:
+        await conn.close()
+
+
+def _generate_part(dsn: str, rows: int, seed: int, opts: dict) -> int:
+    """Worker process: generate and COPY `rows` rows; returns rows written."""
+    return asyncio.run(_generate_part_async(dsn, rows, seed, opts))
+
+
+async def _generate_part_async(dsn: str, rows: int, seed: int, opts: dict) -> int:
+    rng = random.Random(seed)
+    device_types = [(dt.value, DEVICE_TYPE_CODES[dt]) for dt in DEVICE_WEIGHTS]
+    dt_cum = list(itertools.accumulate(DEVICE_WEIGHTS.values()))
+    users = opts["users"]  # userKeys are generated from their rank, never held in memory
+    uas = opts["user_agents"]
+    ua_cum = _zipf_cum_weights(len(uas), 1.2)
+    # Clients cluster in a few thousand /24s
+    subnets = [f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}" for _ in range(opts["subnets"])]
+    subnet_cum = _zipf_cum_weights(len(subnets), 1.0)
+    end = datetime.now(timezone.utc)
+    span = opts["days"] * 86400.0
+
+    conn = await asyncpg.connect(dsn=dsn)
+    try:
+        if opts["no_triggers"]:
+            # Skips the NOTIFY trigger and FK checks (superuser only; local benchmark DBs)
+            await conn.execute("SET session_replication_role = replica")
+        written = 0
+        while written < rows:
+            n = min(opts["batch_size"], rows - written)
+            ips = [f"{s}.{rng.randint(1, 254)}" for s in rng.choices(subnets, cum_weights=subnet_cum, k=n)]
+            records = list(zip(
+                (f"user-{_zipf_index(rng, users, 0.8):09d}" for _ in range(n)),
+                *zip(*rng.choices(device_types, cum_weights=dt_cum, k=n)),  # device_type, device_type_code
+                *zip(*rng.choices(uas, cum_weights=ua_cum, k=n)),  # user_agent, user_agent_id
+                ips,  # client_ip
+                ips,  # client_inet
+                (end - timedelta(seconds=rng.random() * span) for _ in range(n)),
+            ))
+            await conn.copy_records_to_table(
+                "device_registrations", schema_name="public", columns=COLUMNS, records=records
+            )
+            written += n
+        return written
+    finally:
+        await conn.close()
+
+
+def cmd_generate(args: argparse.Namespace) -> int:
+    dsn = _dsn(args.url)
+    uas = asyncio.run(_prepare_user_agents(dsn, args.user_agents))
+    opts = {
+        "users": args.users or max(1, args.rows // 20),
+        "user_agents": uas,
+        "subnets": args.subnets,
+        "days": args.days,
+        "batch_size": args.batch_size,
+        "no_triggers": args.no_triggers,
+    }
+    per_job = [args.rows // args.jobs + (1 if i < args.rows % args.jobs else 0) for i in range(args.jobs)]
+    start = time.monotonic()
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(_generate_part, dsn, n, args.seed + i, opts) for i, n in enumerate(per_job) if n]
+        total = sum(f.result() for f in futures)
+    elapsed = time.monotonic() - start
+
+    async def _analyze() -> None:
+        conn = await asyncpg.connect(dsn=dsn)
+        try:
+            await conn.execute("VACUUM ANALYZE public.device_registrations")
+        finally:
+            await conn.close()
+
+    asyncio.run(_analyze())
+    print(json.dumps({
+        "rows": total,
+        "seconds": round(elapsed, 1),
+        "rows_per_second": round(total / elapsed, 1) if elapsed else None,
+        "users": opts["users"],
+        "user_agents": len(uas),
+        "subnets": args.subnets,
+        "days": args.days,
+    }))
+    return 0
+
+
+# ---------------- run ----------------
+
+def _plan_summary(plan: dict) -> dict:
+    root = plan["Plan"]
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node.get("Node Type") + (f" on {node['Index Name']}" if node.get("Index Name") else ""))
+        stack.extend(node.get("Plans", []))
+    return {
+        "nodes": nodes,
+        "shared_hit": root.get("Shared Hit Blocks"),
+        "shared_read": root.get("Shared Read Blocks"),
+    }
+
+
+async def _time_query(
+    conn: asyncpg.Connection, build: Callable[[], tuple[str, tuple]], iterations: int
+) -> dict:
+    """Plan and time one hot query; `build` returns (sql, args), fresh args on every call."""
+    sql, _ = build()
+    is_write = sql.lstrip().upper().startswith("INSERT")
+
+    async def execute(stmt: str) -> tuple[float, list]:
+        # A write runs in its own savepoint and is rolled back, so the next run inserts
+        # again instead of hitting ON CONFLICT DO NOTHING (or measuring a growing table)
+        _, run_args = build()
+        savepoint = conn.transaction() if is_write else None
+        if savepoint:
+            await savepoint.start()
+        try:
+            t0 = time.perf_counter()
+            rows = await conn.fetch(stmt, *run_args)
+            return (time.perf_counter() - t0) * 1000, rows
+        finally:
+            if savepoint:
+                await savepoint.rollback()
+
+    tr = conn.transaction()
+    await tr.start()
+    try:
+        _, rows = await execute(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}")
+        raw = rows[0][0]
+        plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+        await execute(sql)  # warm-up
+        timings = [(await execute(sql))[0] for _ in range(iterations)]
+    finally:
+        # Writes are always rolled back; reads don't care
+        await tr.rollback()
+    timings.sort()
+    return {
+        "p50_ms": round(statistics.median(timings), 3),
+        "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "write": is_write,
+        "plan": _plan_summary(plan),
+    }
+
+
+async def run_benchmark(dsn: str, config_names: list[str], configs: dict, iterations: int, device_type: str) -> dict:
+    device_type = normalize_device_type(device_type).value
+    conn = await asyncpg.connect(dsn=dsn, timeout=10)
+    report: dict = {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "rows_estimate": await conn.fetchval(
+            "SELECT reltuples::bigint FROM pg_class WHERE oid = 'public.device_registrations'::regclass"
+        ),
+        "device_type": device_type,
+        "configs": {},
+    }
+    try:
+        for name in config_names:
+            setup, teardown = configs[name]
+            logger.info("Config %s: applying %d statement(s)", name, len(setup))
+            try:
+                t0 = time.monotonic()
+                for stmt in setup:
+                    await conn.execute(stmt)
+                await conn.execute("VACUUM ANALYZE public.device_registrations")
+                entry = {
+                    "setup_seconds": round(time.monotonic() - t0, 2),
+                    "table_bytes": await conn.fetchval("SELECT pg_relation_size('public.device_registrations')"),
+                    "indexes_bytes": await conn.fetchval("SELECT pg_indexes_size('public.device_registrations')"),
+                    "queries": {},
+                }
+                for qname, build in HOT_QUERIES.items():
+                    entry["queries"][qname] = await _time_query(conn, lambda b=build: b(device_type), iterations)
+                report["configs"][name] = entry
+            finally:
+                for stmt in teardown:
+                    await conn.execute(stmt)
+    finally:
+        await conn.close()
+    return report
+
+
+def comparison_table(report: dict) -> str:
+    names = list(report["configs"])
+    if not names:
+        return ""
+    base = report["configs"][names[0]]["queries"]
+    lines = [f"{'query':<26}" + "".join(f"{n[:24]:>26}" for n in names)]
+    for qname in base:
+        cells = []
+        for n in names:
+            q = report["configs"][n]["queries"][qname]
+            ratio = q["p50_ms"] / base[qname]["p50_ms"] if base[qname]["p50_ms"] else 0
+            cells.append(f"{q['p50_ms']:>14.3f}ms ({ratio:4.2f}x)")
+        lines.append(f"{qname:<26}" + "".join(f"{c:>26}" for c in cells))
+    lines.append(f"{'indexes size (MiB)':<26}" + "".join(
+        f"{report['configs'][n]['indexes_bytes'] / 2**20:>26.1f}" for n in names))
+    return "\n".join(lines)
+
+
+def cmd_run(args: argparse.Namespace) -> int:
+    configs = dict(CONFIGS)
+    if args.config_file:
+        extra = json.loads(Path(args.config_file).read_text(encoding="utf-8"))
+        configs.update({k: (v.get("setup", []), v.get("teardown", [])) for k, v in extra.items()})
+    names = [n.strip() for n in args.configs.split(",") if n.strip()]
+    unknown = [n for n in names if n not in configs]
+    if unknown:
+        print(f"Unknown config(s): {unknown}; available: {sorted(configs)}", file=sys.stderr)
+        return 2
+    # A setup without teardown changes the table for every config timed after it
+    irreversible = [n for n in names if configs[n][0] and not configs[n][1]]
+    if len(irreversible) > 1:
+        print(f"Configs without teardown {irreversible} would skew each other; run them separately", file=sys.stderr)
+        return 2
+    names = [n for n in names if n not in irreversible] + irreversible
+
+    report = asyncio.run(run_benchmark(_dsn(args.url), names, configs, args.iterations, args.device_type))
+    print(json.dumps(report, indent=2, default=str))
+    print(comparison_table(report), file=sys.stderr)
+    return 0
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Synthetic data generator and query benchmark.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="COPY synthetic registrations into a local Postgres")
+    # --url is mandatory on purpose: never pick up a production DATABASE_URL from the env
+    gen.add_argument("--url", required=True, help="Benchmark database URL (postgresql://...)")
+    gen.add_argument("--rows", type=_positive_int, required=True)
+    gen.add_argument("--users", type=_positive_int, help="Distinct userKeys (default rows/20)")
+    gen.add_argument("--user-agents", type=_positive_int, default=3000, help="Distinct User-Agents")
+    gen.add_argument("--subnets", type=_positive_int, default=5000, help="Distinct client /24 subnets")
+    gen.add_argument("--days", type=_positive_int, default=365, help="created_at spread")
+    gen.add_argument("--jobs", type=_positive_int, default=4, help="Parallel processes/connections")
+    gen.add_argument("--batch-size", type=_positive_int, default=50_000, help="Rows per COPY")
+    gen.add_argument("--seed", type=int, default=42)
+    gen.add_argument("--no-triggers", action="store_true",
+                     help="SET session_replication_role = replica (superuser; skips NOTIFY trigger and FK checks)")
+    gen.set_defaults(func=cmd_generate)
+
+    run = sub.add_parser("run", help="Time the app's queries under index/storage configurations")
+    run.add_argument("--url", required=True, help="Benchmark database URL (postgresql://...)")
+    run.add_argument("--configs", default="baseline", help=f"Comma-separated, from: {', '.join(CONFIGS)}")
+    run.add_argument("--config-file", help="JSON {name: {setup: [...], teardown: [...]}} with extra configs")
+    run.add_argument("--iterations", type=_positive_int, default=10)
+    run.add_argument("--device-type", default="Android", help="deviceType used by the queries")
+    run.set_defaults(func=cmd_run)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,326 @@
+"""
+Offline bulk import of historical login events (CSV / NDJSON, optionally .gz).
+
+- Streams each file record by record (constant memory; bounded batch queue).
+- Normalizes deviceType (normalize_device_type), clientIp (normalize_ip) and
+  dictionary-encodes userAgent (bulk get-or-create, common.user_agents).
+- Loads batches with COPY over several parallel asyncpg connections.
+- Resumable: every batch's checkpoint row is written in the same transaction as its
+  COPY, so a re-run skips exactly the batches that committed (keep --batch-size).
+- Sharded (DATABASE_SHARD_URLS or repeated --url): each batch is split by
+  shard_index(userKey) and every shard gets its part plus its own checkpoint row,
+  so resuming works per shard.
+- Bad records (malformed NDJSON lines, missing or non-text userKey, unparseable
+  createdAt) are counted as rejected and skipped; they never abort the import.
+- Logs progress and throughput periodically and prints a JSON summary.
+
+Fields (CSV header / NDJSON keys): userKey, deviceType, userAgent, clientIp,
+createdAt (ISO 8601; 'timestamp' also accepted). Missing createdAt = import time.
+
+Examples:
+  python -m common.tools.bulk_import logins-2019.csv.gz logins-2020.ndjson --jobs 4
+  python -m common.tools.bulk_import logins.csv --batch-size 20000 --source-id legacy-2019
+  python -m common.tools.bulk_import logins.csv --url postgresql://db-0/devicesdb --url postgresql://db-1/devicesdb
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import sys
+import time
+from collections.abc import Iterator
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+import asyncpg
+
+from common import queries
+from common.config import database_urls
+from common.db import ShardSet, shard_index
+from common.device_types import device_type_code, normalize_device_type
+from common.http_utils import normalize_ip
+from common.user_agents import MAX_USER_AGENT_LENGTH, UserAgentCache, resolve_user_agents
+
+logger = logging.getLogger("bulk_import")
+
+COLUMNS = (
+    "user_key", "device_type", "device_type_code", "user_agent", "user_agent_id",
+    "client_ip", "client_inet", "created_at",
+)
+_ALIASES = {"timestamp": "createdAt"}
+
+
+@dataclass
+class Stats:
+    rows: int = 0
+    rejected: int = 0
+    batches: int = 0
+    skipped_batches: int = 0
+    started: float = 0.0
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.rows / elapsed if elapsed > 0 else 0.0
+
+
+def _open_text(path: Path) -> io.TextIOBase:
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", encoding="utf-8", newline="")
+    return path.open("r", encoding="utf-8", newline="")
+
+
+def read_records(path: Path) -> Iterator[dict | None]:
+    """Yield raw records one by one from a CSV or NDJSON file (None for a malformed line)."""
+    stem = path.name[:-3] if path.name.endswith(".gz") else path.name
+    with _open_text(path) as fh:
+        if stem.endswith((".ndjson", ".jsonl", ".json")):
+            for line_no, line in enumerate(fh, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning("%s:%d: malformed JSON (%s); skipped", path.name, line_no, e.msg)
+                    yield None
+        else:
+            yield from csv.DictReader(fh)
+
+
+def _text(value) -> str | None:
+    """Stripped string for text (and integer) fields, None for anything else."""
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        value = str(value)
+    return value.strip() if isinstance(value, str) else None
+
+
+def _parse_ts(value) -> datetime | None:
+    if not value:
+        return None
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc)
+    ts = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    return ts if ts.tzinfo else ts.replace(tzinfo=timezone.utc)
+
+
+def normalize_record(raw, now: datetime) -> tuple | None:
+    """(user_key, device_type, device_type_code, user_agent, client_ip, created_at) or None when invalid."""
+    if not isinstance(raw, dict):
+        return None  # malformed line, or JSON that is not an object
+    rec = {_ALIASES.get(k, k): v for k, v in raw.items()}
+    user_key = _text(rec.get("userKey"))
+    if not user_key or len(user_key) > 255:
+        return None
+    created_at = rec.get("createdAt")
+    if isinstance(created_at, bool):
+        return None
+    try:
+        created_at = _parse_ts(created_at) or now
+    except (ValueError, OverflowError, OSError):
+        return None
+    device_type = normalize_device_type(_text(rec.get("deviceType")) or "")
+    user_agent = rec.get("userAgent")
+    return (
+        user_key,
+        device_type.value,
+        device_type_code(device_type),
+        user_agent if isinstance(user_agent, str) and user_agent else None,
+        normalize_ip(_text(rec.get("clientIp"))),
+        created_at,
+    )
+
+
+def batches(path: Path, size: int, stats: Stats) -> Iterator[tuple[int, list[tuple]]]:
+    """Deterministic (batch_no, normalized rows) for a file; batch_no is stable across runs."""
+    now = datetime.now(timezone.utc)
+    batch: list[tuple] = []
+    batch_no = 0
+    for raw in read_records(path):
+        row = normalize_record(raw, now)
+        if row is None:
+            stats.rejected += 1
+            continue
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch_no, batch
+            batch_no += 1
+            batch = []
+    if batch:
+        yield batch_no, batch
+
+
+async def _load_batch(conn: asyncpg.Connection, session_factory, ua_cache, source: str, batch_no: int, rows: list[tuple]) -> None:
+    ua_ids = await resolve_user_agents(session_factory, (r[3] for r in rows), ua_cache)
+    legacy = queries.WRITE_LEGACY_COLUMNS  # else device_type, user_agent and client_ip stay NULL
+    records = [
+        (r[0], r[1] if legacy else None, r[2], r[3][:MAX_USER_AGENT_LENGTH] if r[3] and legacy else None,
+         ua_ids.get(r[3][:MAX_USER_AGENT_LENGTH]) if r[3] else None, r[4] if legacy else None, r[4], r[5])
+        for r in rows
+    ]
+    async with conn.transaction():
+        # Checkpoint first: a concurrent duplicate run fails here instead of double-loading
+        await conn.execute(
+            "INSERT INTO public.import_checkpoints (source, batch_no, rows) VALUES ($1, $2, $3)",
+            source, batch_no, len(records),
+        )
+        if records:
+            await conn.copy_records_to_table(
+                "device_registrations", schema_name="public", columns=COLUMNS, records=records
+            )
+
+
+async def import_file(
+    path: Path,
+    *,
+    shards: ShardSet,
+    source: str,
+    batch_size: int,
+    jobs: int,
+    ua_caches: list[UserAgentCache],
+    progress_every: float,
+) -> Stats:
+    stats = Stats(started=time.monotonic())
+    dsns = [url.replace("postgresql+asyncpg://", "postgresql://") for url in shards.urls]
+    # One connection per job and shard
+    conns = [[await asyncpg.connect(dsn=dsn, timeout=10) for dsn in dsns] for _ in range(jobs)]
+    try:
+        # Per shard: batches whose part already committed there
+        done = [
+            {r["batch_no"] for r in await c.fetch("SELECT batch_no FROM public.import_checkpoints WHERE source = $1", source)}
+            for c in conns[0]
+        ]
+        if any(done):
+            logger.info("%s: resuming, %s batch(es) already imported per shard", source, [len(d) for d in done])
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=jobs * 2)
+
+        async def consumer(job_conns: list[asyncpg.Connection]) -> None:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                batch_no, rows = item
+                parts: list[list[tuple]] = [[] for _ in dsns]
+                for row in rows:
+                    parts[shard_index(row[0], len(dsns))].append(row)
+                for shard, part in enumerate(parts):
+                    if batch_no in done[shard]:
+                        continue
+                    await _load_batch(
+                        job_conns[shard], shards.sessionmakers[shard], ua_caches[shard], source, batch_no, part
+                    )
+                    stats.rows += len(part)
+                stats.batches += 1
+
+        workers = [asyncio.create_task(consumer(c)) for c in conns]
+        last_report = time.monotonic()
+        try:
+            for batch_no, rows in batches(path, batch_size, stats):
+                if all(batch_no in d for d in done):
+                    stats.skipped_batches += 1
+                    continue
+                # put() waits while all consumers are busy -> constant memory.
+                # Also wake up if a consumer died, so a failure can't leave us blocked on a full queue.
+                put = asyncio.ensure_future(queue.put((batch_no, rows)))
+                await asyncio.wait({put, *workers}, return_when=asyncio.FIRST_COMPLETED)
+                if not put.done() or any(w.done() for w in workers):
+                    put.cancel()
+                    break
+                if time.monotonic() - last_report >= progress_every:
+                    last_report = time.monotonic()
+                    logger.info("%s: %d rows, %.0f rows/s, %d rejected", source, stats.rows, stats.rate(), stats.rejected)
+            failed = [w for w in workers if w.done()]
+            if failed:
+                for w in workers:
+                    w.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                failed[0].result()  # re-raise the consumer's error
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            raise
+    finally:
+        for job_conns in conns:
+            for c in job_conns:
+                await c.close()
+    return stats
+
+
+async def run(args: argparse.Namespace, urls: list[str]) -> dict:
+    # SQLAlchemy engines (UA get-or-create) need the asyncpg dialect
+    shards = ShardSet([url.replace("postgresql://", "postgresql+asyncpg://", 1) for url in urls])
+    ua_caches = [UserAgentCache(args.ua_cache_size) for _ in urls]
+    summary: dict = {"shards": len(urls), "files": []}
+    try:
+        for name in args.files:
+            path = Path(name)
+            source = args.source_id or f"{path.name}:{path.stat().st_size}:{args.batch_size}"
+            stats = await import_file(
+                path,
+                shards=shards,
+                source=source,
+                batch_size=args.batch_size,
+                jobs=args.jobs,
+                ua_caches=ua_caches,
+                progress_every=args.progress_every,
+            )
+            entry = {
+                "file": str(path),
+                "source": source,
+                "rows": stats.rows,
+                "rejected": stats.rejected,
+                "batches": stats.batches,
+                "skipped_batches": stats.skipped_batches,
+                "seconds": round(time.monotonic() - stats.started, 2),
+                "rows_per_second": round(stats.rate(), 1),
+            }
+            logger.info("%s: done %s", source, entry)
+            summary["files"].append(entry)
+    finally:
+        await shards.dispose()
+    return summary
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Bulk import historical login events with COPY.")
+    parser.add_argument("files", nargs="+", help="CSV / NDJSON files (optionally .gz)")
+    parser.add_argument("--url", action="append", help="Shard URL, repeatable, in shard order (default DATABASE_SHARD_URLS / DATABASE_URL)")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Rows per COPY batch (keep it when resuming)")
+    parser.add_argument("--jobs", type=int, default=4, help="Parallel loaders (one connection per shard each)")
+    parser.add_argument("--source-id", help="Checkpoint key (default: file name + size + batch size)")
+    parser.add_argument("--ua-cache-size", type=int, default=65_536, help="Cached distinct User-Agents")
+    parser.add_argument("--progress-every", type=float, default=5.0, help="Seconds between progress logs")
+    args = parser.parse_args()
+
+    try:
+        urls = args.url or database_urls()
+    except RuntimeError:
+        print("DATABASE_URL not provided.", file=sys.stderr)
+        return 2
+    if args.source_id and len(args.files) > 1:
+        parser.error("--source-id only makes sense with a single file")
+
+    try:
+        summary = asyncio.run(run(args, urls))
+    except Exception:
+        logger.exception("Import failed; re-run the same command to resume")
+        return 1
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,34 +1,39 @@
 """
-Database bootstrap (idempotent) for initial schema creation.
+Database bootstrap: versioned schema migrations.
 
-- Safe to call multiple times (uses PostgreSQL advisory lock).
-- Creates the required tables based on SQLAlchemy models.
-- Intended to run at app startup (FastAPI lifespan) in each service.
+- Worker startup calls `bootstrap()`, which is a single schema-version check.
+  When the schema is already current, no lock is taken and no DDL runs.
+- Pending migrations are applied by `migrate()` under a global advisory lock,
+  normally from the one-shot `common.tools.db_migrate` command (init container / Job).
+- Migrations themselves live in common.migrations.
 
 Env:
-  DB_BOOTSTRAP           = "1" (default) to enable, "0" to skip
+  DB_BOOTSTRAP           = "0" (default): workers only check the version and report
+                           not-started (/startupz re-checks) until db_migrate has run.
+                           "1" lets a worker apply pending migrations itself (single-process
+                           local runs only; DDL then competes with live traffic)
   DB_BOOTSTRAP_LOCK_KEY  = int, advisory lock key (same across services)
-
-Note:
-- We import the model(s) so metadata is populated.
-- Uses Base.metadata.create_all via DeviceRegistration.__table__.metadata
 """
 
 from __future__ import annotations
 import os
 import logging
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import AsyncEngine
+from common import migrations
 
-# Ensure models are imported so tables are registered in metadata:
-from common.db import DeviceRegistration  # noqa: F401
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine
 
 logger = logging.getLogger("db_bootstrap")
 
-# Pick up metadata from any mapped table (all share the same MetaData)
-METADATA = DeviceRegistration.__table__.metadata
+
+def _lock_key(lock_key: Optional[int]) -> int:
+    if lock_key is not None:
+        return lock_key
+    # One fixed key for all services/processes. Customize via env if needed.
+    return int(os.getenv("DB_BOOTSTRAP_LOCK_KEY", "726381"))
 
 
 async def _acquire_advisory_lock(conn, lock_key: int) -> None:
@@ -39,32 +44,74 @@ async def _release_advisory_lock(conn, lock_key: int) -> None:
     await conn.execute(text("SELECT pg_advisory_unlock(:k)").bindparams(k=lock_key))
 
 
-async def bootstrap(engine: AsyncEngine, *, lock_key: Optional[int] = None) -> bool:
+async def schema_version(engine: AsyncEngine) -> int:
+    """Return the currently applied schema version (0 for an empty database)."""
+    async with engine.connect() as conn:
+        return await migrations.current_version(conn)
+
+
+async def migrate(engine: AsyncEngine, *, lock_key: Optional[int] = None) -> int:
     """
-    Create missing tables inside a global advisory lock to avoid races.
-    Returns True on success, False on failure.
+    Apply all pending migrations under the advisory lock, each in its own transaction
+    (transactional=False ones in autocommit, see common.migrations.apply_concurrently).
+    Returns the schema version after migrating. Raises on failure; the failing migration
+    is not recorded, the ones before it stay applied.
     """
-    if os.getenv("DB_BOOTSTRAP", "1") not in {"1", "true", "TRUE", "yes", "on"}:
-        logger.info("DB bootstrap disabled by DB_BOOTSTRAP env.")
-        return True
+    lk = _lock_key(lock_key)
+    async with engine.connect() as lock_conn:
+        # Optional: ensure 'public' schema exists
+        await lock_conn.execute(text("CREATE SCHEMA IF NOT EXISTS public"))
+        # Serialize migrations across all workers/services/jobs. Session-level lock: it outlives
+        # the commit, and this connection then sits idle outside any transaction, which
+        # CREATE INDEX CONCURRENTLY needs (it waits for every open transaction to finish).
+        await _acquire_advisory_lock(lock_conn, lk)
+        await lock_conn.commit()
+        try:
+            async with engine.begin() as conn:
+                await migrations.ensure_version_table(conn)
+                # Re-read under the lock: someone else may have migrated meanwhile
+                version = await migrations.current_version(conn)
+            for m in migrations.pending(version):
+                logger.info("Applying migration %d: %s", m.version, m.description)
+                if m.transactional:
+                    async with engine.begin() as conn:
+                        await migrations.apply(conn, m)
+                else:
+                    async with engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+                        await migrations.apply_concurrently(conn, m)
+                version = m.version
+        finally:
+            await _release_advisory_lock(lock_conn, lk)
+            await lock_conn.commit()
+    return version
 
-    lk = lock_key
-    if lk is None:
-        # One fixed key for all services/processes. Customize via env if needed.
-        lk = int(os.getenv("DB_BOOTSTRAP_LOCK_KEY", "726381"))
 
+async def bootstrap(engine: AsyncEngine, *, lock_key: Optional[int] = None) -> bool:
+    """
+    Startup check: True when the schema is at (or ahead of) the version this code expects.
+    Takes the advisory lock only when migrations are pending and DB_BOOTSTRAP allows applying them.
+    Returns True on success, False on failure.
+    """
     try:
-        async with engine.begin() as conn:
-            # Optional: ensure 'public' schema exists
-            await conn.execute(text("CREATE SCHEMA IF NOT EXISTS public"))
-            # Serialize CREATEs across all workers/services
-            await _acquire_advisory_lock(conn, lk)
-            try:
-                # create_all checks existence; within the lock it’s race-free
-                await conn.run_sync(METADATA.create_all)
-            finally:
-                await _release_advisory_lock(conn, lk)
-        logger.info("DB bootstrap complete.")
+        version = await schema_version(engine)
+        if version >= migrations.LATEST_VERSION:
+            if version > migrations.LATEST_VERSION:
+                # Rolling deploy: a newer release migrated. Migrations are expand-only (see
+                # common.migrations), so this release's reads and writes still work.
+                logger.info("DB schema v%d is newer than expected v%d.", version, migrations.LATEST_VERSION)
+            else:
+                logger.info("DB schema is current (v%d).", version)
+            return True
+
+        if os.getenv("DB_BOOTSTRAP", "0") not in {"1", "true", "TRUE", "yes", "on"}:
+            logger.error(
+                "DB schema v%d is behind expected v%d; run `python -m common.tools.db_migrate`.",
+                version, migrations.LATEST_VERSION,
+            )
+            return False
+
+        version = await migrate(engine, lock_key=lock_key)
+        logger.info("DB bootstrap complete (schema v%d).", version)
         return True
     except Exception:
         logger.exception("DB bootstrap failed")
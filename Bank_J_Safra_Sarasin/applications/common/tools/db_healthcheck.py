@@ -1,20 +1,77 @@
 """
-Async DB healthcheck using asyncpg.
+Async DB healthcheck and performance diagnostics using asyncpg.
 
 - Reads DATABASE_URL from env or --url
 - Executes 'SELECT 1' to confirm connectivity
 - Non-zero exit code on failure (useful for CI/healthchecks)
+- --diagnose prints a JSON report instead (compare runs with any JSON diff):
+    * EXPLAIN (ANALYZE, BUFFERS) of the app's hot queries: the services' own SQL
+      (common.queries) with bound parameters; the INSERT uses a fresh key and is rolled back
+    * index usage, size and dead-tuple bloat of device_registrations
+    * tables with sequential scans, cache hit ratios
+    * top statements from pg_stat_statements when the extension is installed
+
+Examples:
+  python -m common.tools.db_healthcheck
+  python -m common.tools.db_healthcheck --diagnose --device-type Android > diag-$(date +%s).json
 """
 
 from __future__ import annotations
 
 import argparse
 import asyncio
+import json
 import os
 import sys
+import uuid
+from datetime import datetime, timezone
+from collections.abc import Callable
+from typing import Any
 
 import asyncpg
 
+from common import queries
+from common.device_types import DeviceType, device_type_code, normalize_device_type
+
+TABLE = "device_registrations"
+
+
+def asyncpg_query(stmt, **params: Any) -> tuple[str, tuple[Any, ...]]:
+    """SQL and positional args of a SQLAlchemy statement, as the services' asyncpg driver sends them."""
+    from sqlalchemy.dialects.postgresql.asyncpg import dialect
+
+    if params:
+        stmt = stmt.bindparams(**params)
+    compiled = stmt.compile(dialect=dialect())
+    return compiled.string, tuple(compiled.params[name] for name in compiled.positiontup)
+
+
+def _registration_insert(dt: str) -> tuple[str, tuple[Any, ...]]:
+    # A fresh key every call: a fixed one hits ON CONFLICT DO NOTHING after the first run
+    key = f"diagnose-{uuid.uuid4().hex}"
+    return asyncpg_query(queries.registration_insert(queries.registration_values(
+        user_key=key, device_type=DeviceType(dt), user_agent=None, user_agent_id=None,
+        client_ip="127.0.0.1", idempotency_key=key,
+    )))
+
+
+# The queries the services actually run on their request/probe paths
+# (name -> builder taking the canonical device type name, returning (sql, args)).
+HOT_QUERIES: dict[str, Callable[[str], tuple[str, tuple[Any, ...]]]] = {
+    "statistics_count": lambda dt: asyncpg_query(queries.device_type_count(DeviceType(dt))),
+    "statistics_subnets": lambda dt: asyncpg_query(
+        queries.subnet_counts(by_device_type=True), dt=device_type_code(dt),
+        p4=queries.DEFAULT_PREFIX_V4, p6=queries.DEFAULT_PREFIX_V6, lim=queries.DEFAULT_SUBNET_LIMIT,
+    ),
+    "user_agent_lookup": lambda dt: (
+        "SELECT id FROM public.user_agents WHERE user_agent = $1", ("db_healthcheck/diagnose",),
+    ),
+    "registration_insert": _registration_insert,
+    "readiness_select_1": lambda dt: ("SELECT 1", ()),
+    "readiness_table_check": lambda dt: ("SELECT to_regclass('public.device_registrations')", ()),
+    "startup_schema_version": lambda dt: ("SELECT COALESCE(MAX(version), 0) FROM public.schema_version", ()),
+}
+
 
 async def check(url: str) -> bool:
     conn = None
@@ -32,9 +89,119 @@ async def check(url: str) -> bool:
                 pass
 
 
+async def _rows(conn: asyncpg.Connection, sql: str, *args: Any) -> list[dict]:
+    return [dict(r) for r in await conn.fetch(sql, *args)]
+
+
+async def explain_hot_queries(conn: asyncpg.Connection, device_type: str) -> dict:
+    plans: dict[str, Any] = {}
+    device_type = normalize_device_type(device_type).value
+    for name, build in HOT_QUERIES.items():
+        sql, args = build(device_type)
+        tr = conn.transaction()
+        await tr.start()
+        try:
+            raw = await conn.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {sql}", *args)
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]
+            plans[name] = {
+                "execution_time_ms": plan.get("Execution Time"),
+                "planning_time_ms": plan.get("Planning Time"),
+                "node": plan["Plan"].get("Node Type"),
+                "plan": plan["Plan"],
+            }
+        except Exception as e:
+            plans[name] = {"error": str(e)}
+        finally:
+            # EXPLAIN ANALYZE executes the statement; never keep the diagnostic INSERT
+            await tr.rollback()
+    return plans
+
+
+async def table_report(conn: asyncpg.Connection) -> dict:
+    stats = await _rows(conn, """
+        SELECT seq_scan, seq_tup_read, idx_scan, n_live_tup, n_dead_tup,
+               CASE WHEN n_live_tup + n_dead_tup > 0
+                    THEN round(n_dead_tup::numeric / (n_live_tup + n_dead_tup), 4)::float8 END AS dead_tuple_ratio,
+               last_vacuum, last_autovacuum, last_analyze, last_autoanalyze,
+               pg_relation_size(relid) AS table_bytes,
+               pg_total_relation_size(relid) AS total_bytes
+        FROM pg_stat_user_tables WHERE schemaname = 'public' AND relname = $1
+    """, TABLE)
+    indexes = await _rows(conn, """
+        SELECT indexrelname AS index, idx_scan, idx_tup_read, idx_tup_fetch,
+               pg_relation_size(indexrelid) AS bytes
+        FROM pg_stat_user_indexes WHERE schemaname = 'public' AND relname = $1
+        ORDER BY idx_scan ASC
+    """, TABLE)
+    cache = await _rows(conn, """
+        SELECT heap_blks_hit, heap_blks_read, idx_blks_hit, idx_blks_read,
+               round(heap_blks_hit::numeric / NULLIF(heap_blks_hit + heap_blks_read, 0), 4)::float8 AS heap_hit_ratio,
+               round(idx_blks_hit::numeric / NULLIF(idx_blks_hit + idx_blks_read, 0), 4)::float8 AS idx_hit_ratio
+        FROM pg_statio_user_tables WHERE schemaname = 'public' AND relname = $1
+    """, TABLE)
+    return {
+        "stats": stats[0] if stats else None,
+        "indexes": indexes,
+        "unused_indexes": [i["index"] for i in indexes if not i["idx_scan"]],
+        "cache": cache[0] if cache else None,
+    }
+
+
+async def database_report(conn: asyncpg.Connection) -> dict:
+    cache = await _rows(conn, """
+        SELECT blks_hit, blks_read,
+               round(blks_hit::numeric / NULLIF(blks_hit + blks_read, 0), 4)::float8 AS hit_ratio
+        FROM pg_stat_database WHERE datname = current_database()
+    """)
+    seq_scans = await _rows(conn, """
+        SELECT schemaname || '.' || relname AS table, seq_scan, seq_tup_read, idx_scan, n_live_tup
+        FROM pg_stat_user_tables WHERE seq_scan > 0
+        ORDER BY seq_tup_read DESC LIMIT 10
+    """)
+    return {"cache": cache[0] if cache else None, "seq_scans": seq_scans}
+
+
+async def top_statements(conn: asyncpg.Connection, limit: int = 10) -> list[dict] | None:
+    """Top statements by total time, or None when pg_stat_statements is unavailable."""
+    installed = await conn.fetchval("SELECT 1 FROM pg_extension WHERE extname = 'pg_stat_statements'")
+    if not installed:
+        return None
+    try:
+        return await _rows(conn, """
+            SELECT queryid::text, query, calls, rows,
+                   round(total_exec_time::numeric, 3)::float8 AS total_ms,
+                   round(mean_exec_time::numeric, 3)::float8 AS mean_ms,
+                   shared_blks_hit, shared_blks_read
+            FROM pg_stat_statements
+            WHERE dbid = (SELECT oid FROM pg_database WHERE datname = current_database())
+            ORDER BY total_exec_time DESC LIMIT $1
+        """, limit)
+    except Exception:
+        # e.g. not in shared_preload_libraries
+        return None
+
+
+async def diagnose(url: str, device_type: str = "Android") -> dict:
+    conn = await asyncpg.connect(dsn=url, timeout=5)
+    try:
+        return {
+            "generated_at": datetime.now(timezone.utc).isoformat(),
+            "server_version": await conn.fetchval("SHOW server_version"),
+            "device_type": device_type,
+            "hot_queries": await explain_hot_queries(conn, device_type),
+            "table": await table_report(conn),
+            "database": await database_report(conn),
+            "pg_stat_statements": await top_statements(conn),
+        }
+    finally:
+        await conn.close()
+
+
 def main() -> int:
     parser = argparse.ArgumentParser(description="PostgreSQL healthcheck (asyncpg).")
     parser.add_argument("--url", help="DATABASE_URL (postgresql://... or postgresql+asyncpg://...)")
+    parser.add_argument("--diagnose", action="store_true", help="Print a JSON performance report")
+    parser.add_argument("--device-type", default="Android", help="deviceType used in hot-query EXPLAINs")
     args = parser.parse_args()
 
     url = args.url or os.getenv("DATABASE_URL")
@@ -45,6 +212,15 @@ def main() -> int:
     # Allow both sync and async dialects; asyncpg.connect expects postgresql://...
     url = url.replace("postgresql+asyncpg://", "postgresql://")
 
+    if args.diagnose:
+        try:
+            report = asyncio.run(diagnose(url, args.device_type))
+        except Exception as e:
+            print(f"DB_FAIL: {e}", file=sys.stderr)
+            return 1
+        print(json.dumps(report, indent=2, default=str))
+        return 0
+
     ok = asyncio.run(check(url))
     print("DB_OK" if ok else "DB_FAIL")
     return 0 if ok else 1
@@ -0,0 +1,74 @@
+"""
+One-shot schema migration command (init container / Kubernetes Job / CI).
+
+- Reads DATABASE_SHARD_URLS / DATABASE_URL from env or --url (repeatable, one per shard)
+- Applies pending migrations from common.migrations under the bootstrap advisory lock,
+  shard by shard
+- --check only reports the version; non-zero exit code when migrations are pending on any shard
+
+Examples:
+  python -m common.tools.db_migrate
+  python -m common.tools.db_migrate --check
+  python -m common.tools.db_migrate --url postgresql://db-0/devicesdb --url postgresql://db-1/devicesdb
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import sys
+
+from common import migrations
+from common.config import database_urls
+from common.db import create_engine
+from common.tools.db_bootstrap import migrate, schema_version
+
+logger = logging.getLogger("db_migrate")
+
+
+async def run(url: str, check_only: bool, shard: int = 0) -> int:
+    engine = create_engine(url)
+    try:
+        version = await schema_version(engine)
+        logger.info("Shard %d schema version: v%d (expected v%d)", shard, version, migrations.LATEST_VERSION)
+        if check_only:
+            return 0 if version >= migrations.LATEST_VERSION else 1
+        if version >= migrations.LATEST_VERSION:
+            logger.info("Shard %d: nothing to migrate.", shard)
+            return 0
+        version = await migrate(engine)
+        logger.info("Shard %d: migrated to v%d.", shard, version)
+        return 0
+    finally:
+        await engine.dispose()
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Apply versioned schema migrations.")
+    parser.add_argument("--url", action="append", help="Shard URL, repeatable (postgresql://... or postgresql+asyncpg://...)")
+    parser.add_argument("--check", action="store_true", help="Only check; exit 1 if migrations are pending")
+    args = parser.parse_args()
+
+    try:
+        urls = args.url or database_urls()
+    except RuntimeError:
+        print("DATABASE_URL not provided.", file=sys.stderr)
+        return 2
+
+    rc = 0
+    for shard, url in enumerate(urls):
+        # SQLAlchemy async engine needs the asyncpg dialect
+        if url.startswith("postgresql://"):
+            url = url.replace("postgresql://", "postgresql+asyncpg://", 1)
+        try:
+            rc = max(rc, asyncio.run(run(url, args.check, shard)))
+        except Exception:
+            logger.exception("Migration failed on shard %d", shard)
+            return 1
+    return rc
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -1,9 +1,13 @@
 """
 Generic, safe OpenAPI exporter for any FastAPI app.
 
-Usage examples (run from repo root):
-  python -m common.tools.generate_openapi --app statistics_api.main:app --out statistics_api/openapi.json
-  python -m common.tools.generate_openapi --app device_registration_api.main:app --out device_registration_api/openapi.json
+The apps serve these files from disk (common.openapi); re-export after API changes
+and use --check in CI to catch a stale export.
+
+Usage examples (run from applications/):
+  python -m common.tools.generate_openapi --app statistics_api.main:app --out ../OpenAPI/statistics_api.json
+  python -m common.tools.generate_openapi --app device_registration_api.main:app --out ../OpenAPI/device_registration_api.json
+  python -m common.tools.generate_openapi --app statistics_api.main:app --out ../OpenAPI/statistics_api.json --check
 """
 
 from __future__ import annotations
@@ -87,6 +91,7 @@ def main() -> int:
     parser.add_argument("--app", required=True, help="App spec as 'module:attr' (e.g., statistics_api.main:app)")
     parser.add_argument("--out", required=True, help="Output path to openapi.json")
     parser.add_argument("--indent", type=int, default=2, help="JSON indentation (default: 2)")
+    parser.add_argument("--check", action="store_true", help="Do not write; exit 1 if --out is missing or stale")
     args = parser.parse_args()
 
     out_path = Path(args.out)
@@ -98,12 +103,21 @@ def main() -> int:
         return 1
 
     try:
-        spec_dict = app.openapi()
+        # Unbound FastAPI.openapi: always generate from the routes, never the prebuilt file
+        spec_dict = type(app).openapi(app)
         content = json.dumps(spec_dict, indent=args.indent, ensure_ascii=False)
     except Exception:
         logger.exception("Failed generating OpenAPI via app.openapi()")
         return 1
 
+    if args.check:
+        current = out_path.read_text(encoding="utf-8") if out_path.exists() else None
+        if current != content:
+            logger.error("%s is stale; re-export it", out_path)
+            return 1
+        logger.info("%s is up-to-date.", out_path)
+        return 0
+
     try:
         write_if_changed(out_path, content, logger)
         return 0
@@ -0,0 +1,95 @@
+"""
+Import-time report and budget check (cold-start regressions).
+
+- Imports each module in a fresh interpreter with `python -X importtime`, --repeat
+  times, and keeps the fastest run (least disturbed by the machine).
+- Reports the total and the heaviest top-level packages (cumulative time) as JSON.
+- --budget-ms fails (exit 1) when a module's import time exceeds the budget.
+
+Examples:
+  python -m common.tools.import_time statistics_api.main device_registration_api.main
+  python -m common.tools.import_time statistics_api.main --budget-ms 1200 --repeat 5
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import re
+import subprocess
+import sys
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def measure(module: str) -> tuple[float, dict[str, float]]:
+    """(total ms, cumulative ms per top-level package) for one cold import of `module`."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=False,
+    )
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+    own = module.split(".")[0]
+    total = 0.0
+    packages: dict[str, float] = {}
+    subtree: list[tuple[int, str, float]] = []
+    # importtime prints children before their parent; depth 1 = imported by the -c statement
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        cumulative, depth, name = int(m.group(2)) / 1000, len(m.group(3)), m.group(4)
+        if depth > 1:
+            subtree.append((depth, name, cumulative))
+            continue
+        if name.split(".")[0] == own:
+            total += cumulative
+            # Outermost (shallowest) entry of each package carries its full cost
+            shallowest: dict[str, tuple[int, float]] = {}
+            for d, n, c in subtree:
+                top = n.split(".")[0]
+                if top != own and (top not in shallowest or d < shallowest[top][0]):
+                    shallowest[top] = (d, c)
+            for top, (_d, c) in shallowest.items():
+                packages[top] = packages.get(top, 0.0) + c
+        subtree = []  # interpreter startup (site, encodings...) is not the module's cost
+    return total, packages
+
+
+def report(module: str, repeat: int, top: int) -> dict:
+    runs = [measure(module) for _ in range(repeat)]
+    total, packages = min(runs, key=lambda r: r[0])
+    heaviest = sorted(packages.items(), key=lambda kv: kv[1], reverse=True)
+    return {
+        "module": module,
+        "import_ms": round(total, 1),
+        "runs_ms": [round(r[0], 1) for r in runs],
+        "heaviest": {k: round(v, 1) for k, v in heaviest[:top]},
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure cold import time of modules (with an optional budget).")
+    parser.add_argument("modules", nargs="+", help="Modules to import, e.g. statistics_api.main")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per module (fastest wins)")
+    parser.add_argument("--top", type=int, default=10, help="Heaviest packages to list")
+    parser.add_argument("--budget-ms", type=float, help="Fail when any module takes longer to import")
+    args = parser.parse_args()
+
+    try:
+        results = [report(m, max(1, args.repeat), args.top) for m in args.modules]
+    except RuntimeError as e:
+        print(str(e), file=sys.stderr)
+        return 2
+
+    over = [r["module"] for r in results if args.budget_ms is not None and r["import_ms"] > args.budget_ms]
+    print(json.dumps({"budget_ms": args.budget_ms, "over_budget": over, "modules": results}, indent=2))
+    if over:
+        print(f"OVER BUDGET: {', '.join(over)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
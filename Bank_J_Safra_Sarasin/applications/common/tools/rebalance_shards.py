@@ -0,0 +1,189 @@
+"""
+Rebalance device_registrations after adding shards (DATABASE_SHARD_URLS grew).
+
+- Give the NEW shard list, in order (shards are append-only: common.db.shard_index is a
+  jump consistent hash, so only rows whose owner is one of the new shards move).
+- Migrate the new shard(s) first (db_migrate), then deploy the apps with the new list so
+  new registrations already land on their owner, then run this tool.
+- Each source shard is scanned in fixed id ranges (--batch-size ids per batch). Rows
+  owned elsewhere are COPYed to their target together with a checkpoint row in
+  import_checkpoints (same transaction), then deleted from the source.
+- Re-runnable: a batch already checkpointed on a target is not copied again, only
+  deleted from the source; a row-count mismatch aborts instead of guessing.
+- User-Agent ids are per shard: UAs are re-resolved on the target (get-or-create).
+
+While it runs, moved rows may briefly be counted on both shards, and the live
+statistics stream reports them as new registrations on the target.
+
+Examples:
+  python -m common.tools.rebalance_shards --url postgresql://db-0/devicesdb \\
+      --url postgresql://db-1/devicesdb --url postgresql://db-2/devicesdb --dry-run
+  python -m common.tools.rebalance_shards --batch-size 50000   # uses DATABASE_SHARD_URLS
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from collections import Counter
+
+import asyncpg
+
+from common.config import database_urls
+from common.db import ShardSet, shard_index
+from common.user_agents import MAX_USER_AGENT_LENGTH, UserAgentCache, resolve_user_agents
+
+logger = logging.getLogger("rebalance_shards")
+
+COLUMNS = (
+    "user_key", "device_type", "device_type_code", "user_agent", "user_agent_id",
+    "client_ip", "client_inet", "created_at", "idempotency_key",
+)
+# Typed columns not yet backfilled are copied as NULL; common.tools.backfill fills them on the target
+_SELECT_RANGE = (
+    "SELECT r.id, r.user_key, r.device_type, r.device_type_code, COALESCE(r.user_agent, ua.user_agent) AS user_agent, "
+    "r.client_ip, r.client_inet, r.created_at, r.idempotency_key "
+    "FROM public.device_registrations r LEFT JOIN public.user_agents ua ON ua.id = r.user_agent_id "
+    "WHERE r.id >= $1 AND r.id < $2"
+)
+
+
+class RebalanceError(RuntimeError):
+    pass
+
+
+async def _copy_part(conn: asyncpg.Connection, session_factory, ua_cache, source: str, batch_no: int, rows: list) -> None:
+    ua_ids = await resolve_user_agents(session_factory, (r["user_agent"] for r in rows), ua_cache)
+    records = [
+        (r["user_key"], r["device_type"], r["device_type_code"], r["user_agent"],
+         ua_ids.get(r["user_agent"][:MAX_USER_AGENT_LENGTH]) if r["user_agent"] else None,
+         r["client_ip"], r["client_inet"], r["created_at"], r["idempotency_key"])
+        for r in rows
+    ]
+    async with conn.transaction():
+        await conn.execute(
+            "INSERT INTO public.import_checkpoints (source, batch_no, rows) VALUES ($1, $2, $3)",
+            source, batch_no, len(records),
+        )
+        await conn.copy_records_to_table(
+            "device_registrations", schema_name="public", columns=COLUMNS, records=records
+        )
+
+
+async def rebalance_shard(
+    src: int,
+    shards: ShardSet,
+    dsns: list[str],
+    *,
+    batch_size: int,
+    dry_run: bool,
+    ua_caches: list[UserAgentCache],
+) -> Counter[str]:
+    """Move rows of shard `src` that belong elsewhere; returns moved counts per 'src->dst'."""
+    n = len(dsns)
+    moved: Counter[str] = Counter()
+    # Checkpoint key includes the shard count: growing again later starts fresh batches
+    source = f"rebalance:{src}:{n}"
+    src_conn = await asyncpg.connect(dsn=dsns[src], timeout=10)
+    dst_conns: dict[int, asyncpg.Connection] = {}
+    try:
+        max_id = await src_conn.fetchval("SELECT max(id) FROM public.device_registrations") or 0
+        done: dict[int, dict[int, int]] = {}
+        for batch_no in range(max_id // batch_size + 1):
+            lo = batch_no * batch_size
+            parts: dict[int, list] = {}
+            for row in await src_conn.fetch(_SELECT_RANGE, lo, lo + batch_size):
+                dst = shard_index(row["user_key"], n)
+                if dst != src:
+                    parts.setdefault(dst, []).append(row)
+            if not parts:
+                continue
+            if dry_run:
+                for dst, part in parts.items():
+                    moved[f"{src}->{dst}"] += len(part)
+                continue
+
+            for dst, part in parts.items():
+                if dst not in dst_conns:
+                    dst_conns[dst] = await asyncpg.connect(dsn=dsns[dst], timeout=10)
+                    done[dst] = dict(await dst_conns[dst].fetch(
+                        "SELECT batch_no, rows FROM public.import_checkpoints WHERE source = $1", source
+                    ))
+                if batch_no in done[dst]:
+                    if done[dst][batch_no] != len(part):
+                        raise RebalanceError(
+                            f"shard {src} batch {batch_no}: {len(part)} rows for shard {dst}, "
+                            f"but {done[dst][batch_no]} were checkpointed; resolve manually"
+                        )
+                    continue  # copied by an earlier run; only the delete is missing
+                await _copy_part(dst_conns[dst], shards.sessionmakers[dst], ua_caches[dst], source, batch_no, part)
+                done[dst][batch_no] = len(part)
+                moved[f"{src}->{dst}"] += len(part)
+
+            ids = [r["id"] for part in parts.values() for r in part]
+            await src_conn.execute("DELETE FROM public.device_registrations WHERE id = ANY($1::int[])", ids)
+            logger.info("Shard %d: batch %d/%d moved %d row(s)", src, batch_no, max_id // batch_size, len(ids))
+    finally:
+        await src_conn.close()
+        for c in dst_conns.values():
+            await c.close()
+    return moved
+
+
+async def run(urls: list[str], *, batch_size: int, dry_run: bool) -> dict:
+    dsns = [u.replace("postgresql+asyncpg://", "postgresql://") for u in urls]
+    shards = ShardSet([u.replace("postgresql://", "postgresql+asyncpg://", 1) for u in urls])
+    ua_caches = [UserAgentCache(65_536) for _ in urls]
+    start = time.monotonic()
+    try:
+        # Sources in parallel; each source is sequential (bounded memory, ordered checkpoints)
+        results = await asyncio.gather(*(
+            rebalance_shard(src, shards, dsns, batch_size=batch_size, dry_run=dry_run, ua_caches=ua_caches)
+            for src in range(len(urls))
+        ))
+    finally:
+        await shards.dispose()
+    total: Counter[str] = Counter()
+    for r in results:
+        total.update(r)
+    return {
+        "shards": len(urls),
+        "dry_run": dry_run,
+        "moved": dict(sorted(total.items())),
+        "rows": sum(total.values()),
+        "seconds": round(time.monotonic() - start, 2),
+    }
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s %(message)s")
+    parser = argparse.ArgumentParser(description="Move registrations to their owning shard after adding shards.")
+    parser.add_argument("--url", action="append", help="Shard URL, repeatable, NEW list in shard order (default DATABASE_SHARD_URLS)")
+    parser.add_argument("--batch-size", type=int, default=10_000, help="Source ids per batch (keep it when resuming)")
+    parser.add_argument("--dry-run", action="store_true", help="Only count rows that would move")
+    args = parser.parse_args()
+
+    try:
+        urls = args.url or database_urls()
+    except RuntimeError:
+        print("DATABASE_URL not provided.", file=sys.stderr)
+        return 2
+    if len(urls) < 2:
+        print("Nothing to rebalance with a single shard.", file=sys.stderr)
+        return 2
+
+    try:
+        summary = asyncio.run(run(urls, batch_size=args.batch_size, dry_run=args.dry_run))
+    except Exception:
+        logger.exception("Rebalance failed; re-run the same command to resume")
+        return 1
+    print(json.dumps(summary))
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
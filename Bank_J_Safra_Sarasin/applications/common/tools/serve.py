@@ -0,0 +1,172 @@
+"""
+Container-aware gunicorn launcher for the FastAPI services.
+
+- Sizes the worker count from the cgroup CPU quota (v2 cpu.max or v1 cfs quota),
+  capped by the cgroup memory limit, instead of a hard-coded `--workers 4`.
+- Preloads the app in the master so workers share imported code via copy-on-write.
+  Safe because the apps build their database engines in lifespan, i.e. per worker
+  after the fork; nothing opened at import time is shared across workers.
+- Runs the stock UvicornWorker: loop="auto"/http="auto" already pick uvloop and
+  httptools when installed (both are in the Pipfiles).
+- Prints every decision at startup.
+
+Examples:
+  python -m common.tools.serve statistics_api.main:app --bind 0.0.0.0:8000
+  python -m common.tools.serve device_registration_api.main:app --bind 0.0.0.0:8001 --dry-run
+
+Env:
+  WEB_CONCURRENCY     = int, explicit worker count (skips detection)
+  WEB_MAX_WORKERS     = int, upper bound for detected workers (default 8)
+  WEB_WORKER_MEMORY   = MiB budgeted per worker for the memory cap (default 160)
+  WEB_PRELOAD         = "1" (default) to preload the app in the master, "0" to disable
+  WEB_TIMEOUT         = worker timeout in seconds (default 30)
+  WEB_KEEPALIVE       = keep-alive seconds (default 5)
+  WEB_MAX_REQUESTS    = recycle a worker after N requests (default 0 = never), with WEB_MAX_REQUESTS_JITTER
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import os
+from pathlib import Path
+from typing import Optional
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+# cgroup v1 reports "no limit" as a huge page-aligned number
+_V1_UNLIMITED = 1 << 60
+
+
+def _read(path: Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit(root: Path = CGROUP_ROOT) -> Optional[float]:
+    """CPU limit in cores from the cgroup quota, or None when unlimited/unknown."""
+    # cgroup v2: "<quota> <period>" or "max <period>"
+    raw = _read(root / "cpu.max")
+    if raw:
+        quota, _, period = raw.partition(" ")
+        if quota != "max" and period:
+            return int(quota) / int(period)
+        return None
+    # cgroup v1
+    quota_s = _read(root / "cpu" / "cpu.cfs_quota_us") or _read(root / "cpu,cpuacct" / "cpu.cfs_quota_us")
+    period_s = _read(root / "cpu" / "cpu.cfs_period_us") or _read(root / "cpu,cpuacct" / "cpu.cfs_period_us")
+    if quota_s and period_s and int(quota_s) > 0:
+        return int(quota_s) / int(period_s)
+    return None
+
+
+def cgroup_memory_limit(root: Path = CGROUP_ROOT) -> Optional[int]:
+    """Memory limit in bytes, or None when unlimited/unknown."""
+    raw = _read(root / "memory.max")
+    if raw:
+        return None if raw == "max" else int(raw)
+    raw = _read(root / "memory" / "memory.limit_in_bytes")
+    if raw and int(raw) < _V1_UNLIMITED:
+        return int(raw)
+    return None
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on (affinity-aware)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def pick_workers(cpu_limit: Optional[float], mem_limit: Optional[int]) -> tuple[int, str]:
+    """Return (workers, reason). Async workers are CPU-bound, so one per (rounded-up) core."""
+    explicit = os.getenv("WEB_CONCURRENCY")
+    if explicit:
+        return max(1, int(explicit)), "WEB_CONCURRENCY"
+
+    cores = min(cpu_limit, available_cpus()) if cpu_limit is not None else available_cpus()
+    workers = max(1, math.ceil(cores))
+    reason = f"cpu={cores:.2f}"
+
+    if mem_limit is not None:
+        per_worker = int(os.getenv("WEB_WORKER_MEMORY", "160")) * 1024 * 1024
+        by_mem = max(1, mem_limit // per_worker)
+        if by_mem < workers:
+            workers = by_mem
+            reason += f", capped by memory={mem_limit // (1024 * 1024)}Mi"
+
+    max_workers = int(os.getenv("WEB_MAX_WORKERS", "8"))
+    if workers > max_workers:
+        workers = max_workers
+        reason += f", capped by WEB_MAX_WORKERS={max_workers}"
+    return workers, reason
+
+
+def build_options(bind: str) -> tuple[dict, dict]:
+    """Return (gunicorn options, decisions for the startup report)."""
+    cpu_limit = cgroup_cpu_limit()
+    mem_limit = cgroup_memory_limit()
+    workers, reason = pick_workers(cpu_limit, mem_limit)
+    preload = os.getenv("WEB_PRELOAD", "1") in {"1", "true", "TRUE", "yes", "on"}
+
+    options = {
+        "bind": bind,
+        "workers": workers,
+        "worker_class": "uvicorn.workers.UvicornWorker",
+        "preload_app": preload,
+        "timeout": int(os.getenv("WEB_TIMEOUT", "30")),
+        "keepalive": int(os.getenv("WEB_KEEPALIVE", "5")),
+        # Optional worker recycling; jitter keeps workers from restarting together
+        "max_requests": int(os.getenv("WEB_MAX_REQUESTS", "0")),
+        "max_requests_jitter": int(os.getenv("WEB_MAX_REQUESTS_JITTER", "0")),
+        "accesslog": "-",
+        "errorlog": "-",
+    }
+    decisions = {
+        "cpu_limit": cpu_limit,
+        "memory_limit_mi": mem_limit // (1024 * 1024) if mem_limit is not None else None,
+        "available_cpus": available_cpus(),
+        "workers": workers,
+        "workers_reason": reason,
+        "preload": preload,
+        "bind": bind,
+    }
+    return options, decisions
+
+
+def run(app_spec: str, options: dict) -> None:
+    from gunicorn.app.base import BaseApplication
+    from gunicorn.util import import_app
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return import_app(app_spec)
+
+    _Application().run()
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run a FastAPI app under gunicorn, sized for its container.")
+    parser.add_argument("app", help="App spec as 'module:attr' (e.g., statistics_api.main:app)")
+    parser.add_argument("--bind", default=os.getenv("WEB_BIND", "0.0.0.0:8000"), help="host:port to bind")
+    parser.add_argument("--dry-run", action="store_true", help="Print decisions and exit")
+    args = parser.parse_args()
+
+    options, decisions = build_options(args.bind)
+    print("serve: " + json.dumps({"app": args.app, **decisions}), flush=True)
+    if args.dry_run:
+        return 0
+
+    run(args.app, options)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
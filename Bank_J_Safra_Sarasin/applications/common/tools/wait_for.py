@@ -1,5 +1,10 @@
 """
-Generic 'wait-for' utility for TCP or HTTP readiness.
+Generic 'wait-for' utility for TCP, HTTP and PostgreSQL readiness.
+
+- Accepts any number of targets and waits for all of them concurrently.
+- Polls with exponential backoff and jitter (no fixed 1 s sleep).
+- --postgres does a real readiness check: connect + SELECT 1 (db_healthcheck.check).
+- Prints a JSON timing report (one entry per target), then READY or TIMEOUT.
 
 Examples:
   # Wait for TCP port
@@ -7,58 +12,148 @@ Examples:
 
   # Wait for HTTP 2xx/3xx
   python -m common.tools.wait_for --http http://statistics_api:8000/healthz --timeout 30
+
+  # Several targets at once
+  python -m common.tools.wait_for --postgres "$DATABASE_URL" \\
+      --http http://device-registration-api:8001/readyz --timeout 60
 """
 
 from __future__ import annotations
 
 import argparse
-import socket
+import asyncio
+import json
+import random
 import time
 import urllib.request
+from collections.abc import Awaitable, Callable
+from urllib.parse import urlsplit
 
+Target = tuple[str, str, Callable[[], Awaitable[bool]]]
 
-def wait_tcp(host: str, port: int, timeout: int) -> bool:
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        try:
-            with socket.create_connection((host, port), timeout=3):
-                return True
-        except OSError:
-            time.sleep(1)
-    return False
 
+async def _probe_tcp(host: str, port: int) -> bool:
+    try:
+        _reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout=3)
+    except (OSError, asyncio.TimeoutError):
+        return False
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return True
 
-def wait_http(url: str, timeout: int) -> bool:
-    deadline = time.time() + timeout
-    while time.time() < deadline:
-        try:
-            with urllib.request.urlopen(url, timeout=5) as resp:
-                if 200 <= resp.status < 400:
-                    return True
-        except Exception:
-            time.sleep(1)
-    return False
 
+def _probe_http_sync(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as resp:
+            return 200 <= resp.status < 400
+    except Exception:
+        return False
 
-def main() -> int:
-    parser = argparse.ArgumentParser(description="Wait for TCP or HTTP service readiness.")
-    group = parser.add_mutually_exclusive_group(required=True)
-    group.add_argument("--tcp", help="host:port")
-    group.add_argument("--http", help="http(s)://...")
-    parser.add_argument("--timeout", type=int, default=30, help="Timeout in seconds")
-    args = parser.parse_args()
 
-    if args.tcp:
-        host, _, port_s = args.tcp.partition(":")
+async def _probe_http(url: str) -> bool:
+    return await asyncio.to_thread(_probe_http_sync, url)
+
+
+async def _probe_postgres(url: str) -> bool:
+    # Lazy import: asyncpg is only needed for --postgres targets
+    from common.tools.db_healthcheck import check
+    return await check(url.replace("postgresql+asyncpg://", "postgresql://"))
+
+
+def postgres_label(dsn: str) -> str:
+    """host:port/dbname of a DSN; never the userinfo or the query string (password=, sslkey=...)."""
+    parts = urlsplit(dsn)
+    host = parts.hostname or ""
+    if ":" in host:
+        host = f"[{host}]"
+    try:
+        port = parts.port
+    except ValueError:
+        port = None
+    return f"{host}{f':{port}' if port else ''}{parts.path}"
+
+
+def parse_targets(tcp: list[str], http: list[str], postgres: list[str]) -> list[Target]:
+    """(kind, label, probe) per target; ValueError for a tcp spec without a valid port."""
+    targets: list[Target] = []
+    for spec in tcp:
+        host, _, port_s = spec.rpartition(":")
         try:
             port = int(port_s)
         except ValueError:
-            print("Invalid port.")
-            return 2
-        ok = wait_tcp(host, port, args.timeout)
-    else:
-        ok = wait_http(args.http, args.timeout)
+            raise ValueError(f"Invalid port in '{spec}'.") from None
+        targets.append(("tcp", spec, lambda h=host, p=port: _probe_tcp(h, p)))
+    for url in http:
+        targets.append(("http", url, lambda u=url: _probe_http(u)))
+    for dsn in postgres:
+        targets.append(("postgres", postgres_label(dsn), lambda d=dsn: _probe_postgres(d)))
+    return targets
+
+
+async def wait_target(
+    kind: str,
+    target: str,
+    probe: Callable[[], Awaitable[bool]],
+    timeout: float,
+    *,
+    base_delay: float = 0.1,
+    max_delay: float = 2.0,
+) -> dict:
+    """Poll `probe` until it succeeds or `timeout` elapses; return a timing report entry."""
+    start = time.monotonic()
+    deadline = start + timeout
+    attempts = 0
+    ready = False
+    while True:
+        attempts += 1
+        ready = await probe()
+        now = time.monotonic()
+        if ready or now >= deadline:
+            break
+        # Exponential backoff with jitter, never sleeping past the deadline
+        delay = min(max_delay, base_delay * (2 ** (attempts - 1)))
+        await asyncio.sleep(min(random.uniform(delay / 2, delay), deadline - now))
+    return {
+        "kind": kind,
+        "target": target,
+        "ready": ready,
+        "attempts": attempts,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+    }
+
+
+async def wait_all(targets: list[Target], timeout: float) -> list[dict]:
+    return list(await asyncio.gather(*(wait_target(k, t, p, timeout) for k, t, p in targets)))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Wait for TCP, HTTP or PostgreSQL readiness (concurrently).")
+    parser.add_argument("--tcp", action="append", default=[], help="host:port (repeatable)")
+    parser.add_argument("--http", action="append", default=[], help="http(s)://... (repeatable)")
+    parser.add_argument("--postgres", action="append", default=[], help="postgresql://... DSN (repeatable)")
+    parser.add_argument("--timeout", type=int, default=30, help="Timeout in seconds (per run)")
+    args = parser.parse_args()
+
+    try:
+        targets = parse_targets(args.tcp, args.http, args.postgres)
+    except ValueError as e:
+        print(e)
+        return 2
+    if not targets:
+        parser.error("at least one of --tcp, --http or --postgres is required")
+
+    start = time.monotonic()
+    report = asyncio.run(wait_all(targets, args.timeout))
+    ok = all(entry["ready"] for entry in report)
 
+    print(json.dumps({
+        "ready": ok,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        "targets": report,
+    }))
     print("READY" if ok else "TIMEOUT")
     return 0 if ok else 1
 
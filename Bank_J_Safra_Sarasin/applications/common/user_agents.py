@@ -0,0 +1,113 @@
+"""
+User-Agent dictionary encoding (user_agents table) with a per-worker cache.
+
+- resolve_user_agent / resolve_user_agents map UA strings to user_agents.id.
+- Hits are served from a bounded LRU cache; misses are bulk get-or-created in
+  their own short, committed transaction so cached ids always exist in the DB
+  (even if the caller's transaction later rolls back).
+- Ids are per database: with several shards, use user_agent_cache(shard) so each
+  shard's ids are cached separately.
+
+Env:
+  USER_AGENT_CACHE_SIZE = int, cached UA strings per worker (default 4096)
+"""
+
+from __future__ import annotations
+
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import TYPE_CHECKING
+
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from common.config import get_env
+from common.db import UserAgent, session_scope
+
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+MAX_USER_AGENT_LENGTH = 1024
+
+
+class UserAgentCache:
+    """Bounded LRU of UA string -> id."""
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._ids: OrderedDict[str, int] = OrderedDict()
+
+    def get(self, ua: str) -> int | None:
+        ua_id = self._ids.get(ua)
+        if ua_id is not None:
+            self._ids.move_to_end(ua)
+        return ua_id
+
+    def put(self, ua: str, ua_id: int) -> None:
+        self._ids[ua] = ua_id
+        self._ids.move_to_end(ua)
+        if len(self._ids) > self.max_size:
+            self._ids.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+USER_AGENT_CACHE = UserAgentCache(int(get_env("USER_AGENT_CACHE_SIZE", "4096")))
+_SHARD_CACHES: dict[int, UserAgentCache] = {0: USER_AGENT_CACHE}
+
+
+def user_agent_cache(shard: int) -> UserAgentCache:
+    """Per-shard cache (shard 0 is USER_AGENT_CACHE)."""
+    cache = _SHARD_CACHES.get(shard)
+    if cache is None:
+        cache = _SHARD_CACHES[shard] = UserAgentCache(USER_AGENT_CACHE.max_size)
+    return cache
+
+
+async def resolve_user_agents(
+    session_factory: async_sessionmaker[AsyncSession],
+    user_agents: Iterable[str | None],
+    cache: UserAgentCache = USER_AGENT_CACHE,
+) -> dict[str, int]:
+    """Bulk get-or-create ids for the given UA strings (None/empty are skipped)."""
+    result: dict[str, int] = {}
+    missing: set[str] = set()
+    for ua in user_agents:
+        if not ua:
+            continue
+        ua = ua[:MAX_USER_AGENT_LENGTH]
+        ua_id = cache.get(ua)
+        if ua_id is None:
+            missing.add(ua)
+        else:
+            result[ua] = ua_id
+
+    if missing:
+        # Sorted so concurrent bulk inserts take row locks in the same order (no deadlocks)
+        ordered = sorted(missing)
+        async with session_scope(session_factory) as session:
+            await session.execute(
+                pg_insert(UserAgent)
+                .values([{"user_agent": ua} for ua in ordered])
+                .on_conflict_do_nothing(index_elements=[UserAgent.user_agent])
+            )
+            rows = await session.execute(
+                select(UserAgent.user_agent, UserAgent.id).where(UserAgent.user_agent.in_(ordered))
+            )
+            fetched = dict(rows.tuples().all())
+        for ua, ua_id in fetched.items():
+            cache.put(ua, ua_id)
+        result.update(fetched)
+    return result
+
+
+async def resolve_user_agent(
+    session_factory: async_sessionmaker[AsyncSession],
+    user_agent: str | None,
+    cache: UserAgentCache = USER_AGENT_CACHE,
+) -> int | None:
+    """Id for one UA string, or None when there is no UA."""
+    if not user_agent:
+        return None
+    ids = await resolve_user_agents(session_factory, [user_agent], cache)
+    return ids.get(user_agent[:MAX_USER_AGENT_LENGTH])
@@ -1,63 +1,95 @@
 from __future__ import annotations
 
-from fastapi import FastAPI, Request, Depends
+from fastapi import FastAPI, Request
 from fastapi.responses import JSONResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field, field_validator
-from typing import Annotated, Optional
+from typing import TYPE_CHECKING, Optional
 import os
+from pathlib import Path
 
+import asyncio
 from contextlib import asynccontextmanager
 from sqlalchemy import text
-from sqlalchemy.ext.asyncio import AsyncSession
 
-from collections.abc import AsyncGenerator
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
-from common.config import database_url
-from common.db import create_engine, make_sessionmaker, session_scope, DeviceRegistration
+from common.admission import AdmissionControlMiddleware, admission_options_from_env
+from common.config import database_urls
+from common.db import ShardSet, shards_of, session_scope
 from common.device_types import DeviceType, normalize_device_type
 from common.errors import make_validation_handler_for_device
-from common.http_utils import get_client_ip
+from common.heavy_hitters import HeavyHitterTracker
+from common.http_utils import get_client_ip, normalize_ip
+from common.idempotency import IDEMPOTENCY_HEADER, REPLAY_HEADER, RecentKeys, clean_key
 from common.logging_utils import setup_logging
-from common.tools.db_bootstrap import bootstrap as db_bootstrap
+from common.openapi import use_prebuilt_openapi
+from common.profiling import ProfilingMiddleware, SamplingProfiler, profiler_router
+from common.queries import registration_insert, registration_values
+from common.user_agents import resolve_user_agent, user_agent_cache
 
 logger = setup_logging("DeviceRegistrationAPI")
 
 # --- Database (async SQLAlchemy 2.x) ---
-DB_URL = database_url(default="postgresql+asyncpg://postgres:postgres@db:5432/devicesdb")
-engine = create_engine(DB_URL, echo=False)
-SessionLocal = make_sessionmaker(engine)
+# DATABASE_SHARD_URLS (comma-separated) or a single DATABASE_URL; rows go to shard_index(userKey)
+DB_URLS = database_urls(default="postgresql+asyncpg://postgres:postgres@db:5432/devicesdb")
+# Engines are built in lifespan (app.state.shards), keeping module import (every worker start) cheap
+# Per-worker userKey sketch, merged into the DB (primary shard) by a background flusher
+heavy_hitters = HeavyHitterTracker.from_env()
+# Recently seen (userKey, Idempotency-Key) pairs: replays skip the DB entirely
+recent_keys = RecentKeys.from_env()
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    """FastAPI dependency that yields an AsyncSession and closes it."""
-    async with SessionLocal() as session:
-        yield session
+async def _startup_probe(engine: AsyncEngine) -> bool:
+    from common.tools.db_bootstrap import bootstrap as db_bootstrap  # startup only
 
-# --- Lifespan: mark startup completion once basic init passes ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    app.state.startup_complete = False
+    # 1) Ensure DB is reachable quickly
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+    # 2) Schema version check (migrates under advisory lock only if behind)
+    return await db_bootstrap(engine)
+
+async def _check_startup() -> bool:
     try:
-        # 1) Ensure DB is reachable quickly
-        async with engine.connect() as conn:
-            await conn.execute(text("SELECT 1"))
-
-        # 2) Bootstrap schema (idempotent, advisory lock)
-        ok = await db_bootstrap(engine)
-        if not ok:
-            # keep startupz=503; readiness will also fail
-            app.state.startup_complete = False
-        else:
-            app.state.startup_complete = True
+        results = await asyncio.gather(*(_startup_probe(e) for e in shards_of(app).engines))
+        # any shard behind/unreachable keeps startupz=503; readiness will also fail
+        app.state.startup_complete = all(results)
     except Exception as e:
         logger.warning("Startup DB probe failed: %s", e)
         app.state.startup_complete = False
+    return app.state.startup_complete
+
+# --- Lifespan: mark startup completion once basic init passes (on every shard) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.startup_complete = False
+    app.state.shards = shards = ShardSet(DB_URLS)
+    await _check_startup()
+    flusher = asyncio.create_task(heavy_hitters.run_flusher(shards.primary))
     yield
+    flusher.cancel()
+    try:
+        await flusher
+    except asyncio.CancelledError:
+        pass
+    await shards.dispose()
 
 # Then create app with lifespan:
 app = FastAPI(title="DeviceRegistrationAPI",
               version=os.getenv("API_VERSION", "0.0.1"),
               lifespan=lifespan)
+# Schema exported by common.tools.generate_openapi (OpenAPI/device_registration_api.json in the image)
+use_prebuilt_openapi(app, os.getenv("OPENAPI_PATH", Path(__file__).with_name("openapi.json")))
+
+# Load shedding: bounded in-flight + queue per worker; probes are exempt
+app.add_middleware(AdmissionControlMiddleware, **admission_options_from_env())
+
+# Sampling profiler (off unless PROFILE_SAMPLE_RATE > 0 or a window is started via /admin/profile).
+# Requests waiting in the admission queue are not executing, so they add no samples.
+profiler = SamplingProfiler.from_env()
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+app.include_router(profiler_router(profiler))
 
 # --- Models (Pydantic) ---
 class DeviceRegisterRequest(BaseModel):
@@ -90,22 +122,28 @@ async def livez():
 @app.get("/startupz")
 async def startupz():
     """Startup: only OK when startup initialization has completed."""
-    ok = bool(getattr(app.state, "startup_complete", False))
+    # Re-checked until it passes, e.g. while the db_migrate job is still running
+    ok = bool(getattr(app.state, "startup_complete", False)) or await _check_startup()
     return JSONResponse(status_code=200 if ok else 503,
                         content={"status": "ok" if ok else "starting"})
 
-@app.get("/readyz")
-async def readyz(session: Annotated[AsyncSession, Depends(get_session)]):
-    """
-    Readiness: database must be reachable and required schema must exist.
-    """
-    try:
+async def _shard_ready(session_factory: async_sessionmaker[AsyncSession]) -> bool:
+    """Raises when the DB is unreachable; False when the schema is missing."""
+    async with session_factory() as session:
         # 1) DB connectivity
         await session.execute(text("SELECT 1"))
 
         # 2) Schema/table presence (bootstrap creates it; here we verify)
         res = await session.execute(text("SELECT to_regclass('public.device_registrations')"))
-        table_ok = bool(res.scalar())
+        return bool(res.scalar())
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: every shard's database must be reachable and required schema must exist.
+    """
+    try:
+        table_ok = all(await shards_of(app).fan_out(_shard_ready))
 
         if not table_ok:
             return JSONResponse(
@@ -119,9 +157,9 @@ async def readyz(session: Annotated[AsyncSession, Depends(get_session)]):
         return JSONResponse(status_code=503, content={"status": "fail"})
 
 @app.get("/healthz")
-async def healthz(session: Annotated[AsyncSession, Depends(get_session)]):
+async def healthz():
     """Back-compat alias -> readiness."""
-    return await readyz(session)  # reuse the same logic
+    return await readyz()  # reuse the same logic
 
 # --- Endpoints ---
 @app.post("/Device/register")
@@ -129,26 +167,52 @@ async def register_device(payload: DeviceRegisterRequest, request: Request):
     """
     Insert an event into the database. Accepts optional metadata (userAgent, clientIp).
     Unknown device types are normalized to 'Unknown'.
+    With an Idempotency-Key header, a replay of the same (userKey, key) returns the
+    original result without inserting again.
     """
+    try:
+        idempotency_key = clean_key(request.headers.get(IDEMPOTENCY_HEADER))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"statusCode": 400})
+    if idempotency_key is not None:
+        original = recent_keys.get(payload.userKey, idempotency_key)
+        if original is not None:
+            return JSONResponse(content=original, headers={REPLAY_HEADER: "true"})
+
     normalized: DeviceType = normalize_device_type(payload.deviceType)
 
-    # Prefer explicit clientIp passed by caller, otherwise derive from request
-    client_ip = payload.clientIp or get_client_ip(request)
+    # Prefer explicit clientIp passed by caller, otherwise derive from request.
+    # Also stored as INET: anything unparseable is dropped rather than failing the event.
+    client_ip = normalize_ip(payload.clientIp or get_client_ip(request))
 
-    # Persist
-    async with session_scope(SessionLocal) as session:
+    # Persist on the userKey's shard
+    shards = shards_of(app)
+    shard = shards.index_for(payload.userKey)
+    session_factory = shards.sessionmakers[shard]
+    async with session_scope(session_factory) as session:
         try:
-            session.add(
-                DeviceRegistration(
-                    user_key=payload.userKey,
-                    device_type=normalized.value,
-                    user_agent=payload.userAgent,
-                    client_ip=client_ip,
-                )
-            )
+            # UA is dictionary-encoded (ids are per shard); repeated UAs are served from the per-worker cache
+            user_agent_id = await resolve_user_agent(session_factory, payload.userAgent, user_agent_cache(shard))
+            # A key already stored by another worker/pod (or before a restart) hits the
+            # partial unique index: nothing is inserted and the replay gets the same answer
+            res = await session.execute(registration_insert(registration_values(
+                user_key=payload.userKey,
+                device_type=normalized,
+                user_agent=payload.userAgent,
+                user_agent_id=user_agent_id,
+                client_ip=client_ip,
+                idempotency_key=idempotency_key,
+            )))
+            inserted = res.first() is not None
             # commit is handled by session_scope
         except Exception:
             logger.exception("Database insert failed")
             return JSONResponse(status_code=400, content={"statusCode": 400})
 
-    return {"statusCode": 200}
+    result = {"statusCode": 200}
+    if idempotency_key is not None:
+        recent_keys.put(payload.userKey, idempotency_key, result)
+    if not inserted:
+        return JSONResponse(content=result, headers={REPLAY_HEADER: "true"})
+    heavy_hitters.record(payload.userKey)
+    return result
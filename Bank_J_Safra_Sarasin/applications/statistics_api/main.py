@@ -1,62 +1,161 @@
 from __future__ import annotations
 
 from fastapi import FastAPI, Depends, Request, Query
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.exceptions import RequestValidationError
 from pydantic import BaseModel, Field, field_validator
-from typing import Annotated
 from contextlib import asynccontextmanager
+from collections import Counter
+import asyncio
 import httpx
 import os
+import time
+from pathlib import Path
+from typing import TYPE_CHECKING
 
-from sqlalchemy import select, func, text
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
 
-from collections.abc import AsyncGenerator
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker
 
-from common.config import database_url, device_api_url
-from common.db import create_engine, make_sessionmaker, DeviceRegistration
-from common.device_types import DeviceType, normalize_device_type
+from common.admin import require_admin_token
+from common.admission import PROBE_PATHS, AdmissionControlMiddleware, admission_options_from_env
+from common.config import database_urls, device_api_url
+from common.db import ShardSet, shards_of
+from common.device_types import DeviceType, device_type_code, normalize_device_type
 from common.errors import make_validation_handler_for_statistics
-from common.http_utils import get_client_ip
+from common.heavy_hitters import query_top
+from common.http_utils import etag_matches, get_client_ip, trusted_client_ip, trusted_proxies_from_env
+from common.idempotency import IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, clean_key
+from common.live_stats import CountCache, StatsBroadcaster, sse_events
 from common.logging_utils import setup_logging
-from common.tools.db_bootstrap import bootstrap as db_bootstrap
+from common.openapi import use_prebuilt_openapi
+from common.profiling import ProfilingMiddleware, SamplingProfiler, profiler_router
+from common.queries import (
+    DEFAULT_PREFIX_V4, DEFAULT_PREFIX_V6, DEFAULT_SUBNET_LIMIT, device_type_count, subnet_counts,
+)
+from common.resilience import CircuitBreaker, CircuitOpenError, render_metrics, retry_async
 
 logger = setup_logging("StatisticsAPI")
 
 # --- Database (async SQLAlchemy 2.x) ---
-DB_URL = database_url(default="postgresql+asyncpg://postgres:postgres@db:5432/devicesdb")
-engine = create_engine(DB_URL, echo=False)
-SessionLocal = make_sessionmaker(engine)
+# DATABASE_SHARD_URLS (comma-separated) or a single DATABASE_URL; statistics fan out to every shard
+DB_URLS = database_urls(default="postgresql+asyncpg://postgres:postgres@db:5432/devicesdb")
+# Engines are built in lifespan (app.state.shards), keeping module import (every worker start) cheap
+# One LISTEN connection per worker and shard, opened on first use (stream or count cache), closed when idle
+broadcaster = StatsBroadcaster.from_env(DB_URLS)
+# Counts stay cached until a NOTIFY for their device type; backs ETag/304 on /Log/auth/statistics
+count_cache = CountCache.from_env(broadcaster)
+STATS_CACHE_CONTROL = f"public, max-age={int(os.getenv('STATS_CACHE_MAX_AGE', '5'))}"
+# Per-shard LIMIT multiplier for the subnet top list when sharded
+SUBNET_OVERFETCH = int(os.getenv("SUBNET_OVERFETCH", "4"))
+
+# --- Upstream (DeviceRegistrationAPI) protection ---
+registration_breaker = CircuitBreaker.from_env("device_registration")
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", "2"))
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT_SECONDS", "5"))
+# Total budget for one /Log/auth upstream call, retries and backoff included
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE_SECONDS", "6"))
+# Failures where the request never reached the handler, so retrying cannot double-insert
+_RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# With an Idempotency-Key a duplicate insert is suppressed upstream, so these become safe too
+_RETRYABLE_WITH_KEY = _RETRYABLE_ERRORS + (httpx.ReadTimeout, httpx.RemoteProtocolError)
+# Our ingress/proxies; the client address resolved through them is forwarded upstream, so
+# DeviceRegistrationAPI can rate-limit per client rather than per StatisticsAPI pod
+TRUSTED_PROXIES = trusted_proxies_from_env()
+
+
+async def _post_registration(
+    url: str, payload: dict, headers: dict[str, str] | None = None, deadline: float | None = None
+) -> httpx.Response:
+    """
+    One breaker-guarded POST; 5xx and transport errors count as failures. The read timeout
+    shrinks to what is left before `deadline`, so a hung upstream still counts as a failure.
+    """
+    if not registration_breaker.allow():
+        raise CircuitOpenError("device_registration circuit is open")
+    failed: bool | None = None
+    try:
+        read_timeout = UPSTREAM_TIMEOUT
+        if deadline is not None:
+            read_timeout = max(0.0, min(read_timeout, deadline - time.monotonic()))
+        async with httpx.AsyncClient(timeout=httpx.Timeout(read_timeout, connect=1.0)) as client:
+            resp = await client.post(url, json=payload, headers=headers)
+        failed = resp.status_code >= 500
+    except Exception:
+        failed = True
+        raise
+    finally:
+        if failed is None:
+            # Cancelled (client gone, deadline): no outcome, but the half-open slot must come back
+            registration_breaker.release()
+        else:
+            registration_breaker.record(failed=failed)
+    return resp
 
-async def get_session() -> AsyncGenerator[AsyncSession, None]:
-    """Proper FastAPI dependency that opens and closes AsyncSession."""
-    async with SessionLocal() as session:
-        yield session
 
-# --- Lifespan: mark startup completion once basic init passes ---
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    app.state.startup_complete = False
+def _retry_safe(exc: BaseException | None, resp: httpx.Response | None, *, idempotent: bool = False) -> bool:
+    if exc is not None:
+        return isinstance(exc, _RETRYABLE_WITH_KEY if idempotent else _RETRYABLE_ERRORS)
+    # 503 + Retry-After is admission control shedding the request before it ran
+    return resp is not None and resp.status_code == 503 and "retry-after" in resp.headers
+
+
+async def _startup_probe(engine: AsyncEngine) -> bool:
+    from common.tools.db_bootstrap import bootstrap as db_bootstrap  # startup only
+
+    async with engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+    return await db_bootstrap(engine)
+
+
+async def _check_startup() -> bool:
     try:
-        async with engine.connect() as conn:
-            await conn.execute(text("SELECT 1"))
-        ok = await db_bootstrap(engine)
-        app.state.startup_complete = bool(ok)
+        results = await asyncio.gather(*(_startup_probe(e) for e in shards_of(app).engines))
+        # any shard behind/unreachable keeps startupz=503; readiness will also fail
+        app.state.startup_complete = all(results)
     except Exception as e:
         logger.warning("Startup DB probe failed: %s", e)
         app.state.startup_complete = False
+    return app.state.startup_complete
+
+
+# --- Lifespan: mark startup completion once basic init passes (on every shard) ---
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.startup_complete = False
+    app.state.shards = shards = ShardSet(DB_URLS)
+    await _check_startup()
     yield
+    await broadcaster.close()
+    await shards.dispose()
 
 app = FastAPI(title="StatisticsAPI",
               version=os.getenv("API_VERSION", "1.0.0"),
               lifespan=lifespan)
+# Schema exported by common.tools.generate_openapi (OpenAPI/statistics_api.json in the image)
+use_prebuilt_openapi(app, os.getenv("OPENAPI_PATH", Path(__file__).with_name("openapi.json")))
+
+# Load shedding: bounded in-flight + queue per worker; probes and long-lived streams are exempt
+app.add_middleware(
+    AdmissionControlMiddleware,
+    exempt_paths=PROBE_PATHS | {"/Log/auth/statistics/stream"},
+    **admission_options_from_env(),
+)
+
+# Sampling profiler (off unless PROFILE_SAMPLE_RATE > 0 or a window is started via /admin/profile).
+# Requests waiting in the admission queue are not executing, so they add no samples.
+profiler = SamplingProfiler.from_env()
+app.add_middleware(ProfilingMiddleware, profiler=profiler)
+app.include_router(profiler_router(profiler))
 
 # --- Models (Pydantic) ---
 
 class LoginEvent(BaseModel):
     userKey: str = Field(..., min_length=1, max_length=255)
     deviceType: str = Field(..., min_length=1, max_length=50)
+    # Client event id; used as the Idempotency-Key when the header is absent
+    eventId: str | None = Field(default=None, min_length=1, max_length=MAX_KEY_LENGTH)
 
     @field_validator("userKey")
     @classmethod
@@ -72,6 +171,27 @@ class StatisticsResponse(BaseModel):
     count: int
 
 
+class UserKeyCount(BaseModel):
+    userKey: str
+    count: int
+
+
+class TopUsersResponse(BaseModel):
+    windowMinutes: int
+    approximate: bool
+    users: list[UserKeyCount]
+
+
+class SubnetCount(BaseModel):
+    subnet: str
+    count: int
+
+
+class SubnetStatisticsResponse(BaseModel):
+    deviceType: str | None
+    subnets: list[SubnetCount]
+
+
 # --- Exception handlers (DRY via common) ---
 @app.exception_handler(RequestValidationError)
 async def _validation_handler(request: Request, exc: RequestValidationError):
@@ -85,8 +205,19 @@ async def _validation_handler(request: Request, exc: RequestValidationError):
 async def log_auth(event: LoginEvent, request: Request):
     """
     Receive a login event, enrich it (normalize device, UA/IP), forward to DeviceRegistrationAPI,
-    and respond with required schema.
+    and respond with required schema. An Idempotency-Key header (or eventId) is forwarded, so a
+    client retry after a timeout does not register the event twice.
     """
+    try:
+        idempotency_key = clean_key(request.headers.get(IDEMPOTENCY_HEADER) or event.eventId)
+    except ValueError:
+        return JSONResponse(status_code=400, content={"statusCode": 400, "message": "bad_request"})
+    headers = {}
+    if idempotency_key:
+        headers[IDEMPOTENCY_HEADER] = idempotency_key
+    client = trusted_client_ip(request, TRUSTED_PROXIES)
+    if client:
+        headers["X-Forwarded-For"] = client
     normalized: DeviceType = normalize_device_type(event.deviceType)
     payload = {
         "userKey": event.userKey,
@@ -98,8 +229,16 @@ async def log_auth(event: LoginEvent, request: Request):
 
     url = f"{device_api_url()}/Device/register"
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            resp = await client.post(url, json=payload)
+        deadline = time.monotonic() + UPSTREAM_DEADLINE
+        resp = await retry_async(
+            lambda: _post_registration(url, payload, headers, deadline),
+            should_retry=lambda exc, r: _retry_safe(exc, r, idempotent=idempotency_key is not None),
+            attempts=1 + UPSTREAM_RETRIES,
+            deadline=deadline,
+        )
+    except CircuitOpenError:
+        # Fast failure: don't tie up the worker while DeviceRegistrationAPI is down
+        return JSONResponse(status_code=400, content={"statusCode": 400, "message": "bad_request"})
     except Exception:
         logger.exception("Error calling DeviceRegistrationAPI")
         # Required contract: 400 with bad_request on failure
@@ -113,34 +252,148 @@ async def log_auth(event: LoginEvent, request: Request):
         return JSONResponse(status_code=400, content={"statusCode": 400, "message": "bad_request"})
 
 
+async def _count_device_type(session_factory: async_sessionmaker[AsyncSession], device_type: DeviceType) -> int:
+    async with session_factory() as session:
+        res = await session.execute(device_type_count(device_type))
+        # Bezpiecznie: COUNT(*) zawsze 1 wiersz; scalar() jest wystarczające, ale i tak rzutujemy
+        count = res.scalar()
+        return int(count if count is not None else 0)
+
+
 @app.get("/Log/auth/statistics", response_model=StatisticsResponse)
 async def get_statistics(
-    session: Annotated[AsyncSession, Depends(get_session)],
+    request: Request,
     deviceType: str = Query(..., min_length=1, max_length=50),
 ):
     """
     Return the count of registrations for a given deviceType (normalized).
-    Uses direct SQL COUNT for robustness. Never 400 for unknown device types:
-    they normalize to 'Unknown' and return 0 if not present.
+    Uses direct SQL COUNT for robustness (summed over all shards, queried concurrently).
+    Never 400 for unknown device types: they normalize to 'Unknown' and return 0 if not present.
+    Counts are cached per worker until the next insert of that deviceType; the ETag is
+    derived from the count, so If-None-Match gets a 304 from any worker or pod.
     """
     normalized: DeviceType = normalize_device_type(deviceType)
     try:
         # Dla pełnej czytelności logów
         logger.info("Statistics query: raw=%r -> normalized=%s", deviceType, normalized.value)
 
-        stmt = text("SELECT COUNT(*) FROM public.device_registrations WHERE device_type = :dt")
-        res = await session.execute(stmt, {"dt": normalized.value})
-
-        # Bezpiecznie: COUNT(*) zawsze 1 wiersz; scalar() jest wystarczające, ale i tak rzutujemy
-        count = res.scalar()
-        count_int = int(count if count is not None else 0)
-
-        return {"deviceType": normalized.value, "count": count_int}
+        count_int = count_cache.get(normalized.value)
+        if count_int is None:
+            token = count_cache.token(normalized.value)
+            count_int = sum(await shards_of(app).fan_out(lambda sm: _count_device_type(sm, normalized)))
+            count_cache.put(normalized.value, token, count_int)
     except Exception:
         # 400 tylko przy realnym błędzie zapytania/DB
         logger.exception("Statistics query failed (deviceType=%r, normalized=%s)", deviceType, normalized.value)
         return JSONResponse(status_code=400, content={"deviceType": normalized.value, "count": -1})
 
+    headers = {"ETag": f'"{device_type_code(normalized)}-{count_int}"', "Cache-Control": STATS_CACHE_CONTROL}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content={"deviceType": normalized.value, "count": count_int}, headers=headers)
+
+@app.get(
+    "/Log/auth/statistics/subnets",
+    response_model=SubnetStatisticsResponse,
+    dependencies=[Depends(require_admin_token)],
+)
+async def get_subnet_statistics(
+    deviceType: str | None = Query(None, min_length=1, max_length=50),
+    prefixV4: int = Query(DEFAULT_PREFIX_V4, ge=1, le=32),
+    prefixV6: int = Query(DEFAULT_PREFIX_V6, ge=1, le=128),
+    limit: int = Query(DEFAULT_SUBNET_LIMIT, ge=1, le=1000),
+):
+    """
+    Top client subnets by registration count (IPv4 grouped by /prefixV4, IPv6 by /prefixV6),
+    optionally for one deviceType (admin only: it aggregates every stored address). Reads
+    client_inet and device_type_code, so rows written by releases before they were added
+    only count once common.tools.backfill has filled them.
+    With several shards each returns an over-fetched top list that is merged here, so counts
+    near the cut-off can be slightly low (users, not subnets, are hashed to shards).
+    """
+    normalized = normalize_device_type(deviceType) if deviceType else None
+    stmt = subnet_counts(by_device_type=normalized is not None)
+    shards = shards_of(app)
+    per_shard = limit if len(shards) == 1 else limit * SUBNET_OVERFETCH
+    params = {"p4": prefixV4, "p6": prefixV6, "lim": per_shard}
+    if normalized:
+        params["dt"] = device_type_code(normalized)
+    dt_name = normalized.value if normalized else None
+
+    async def top_subnets(session_factory: async_sessionmaker[AsyncSession]) -> list:
+        async with session_factory() as session:
+            return (await session.execute(stmt, params)).all()
+
+    try:
+        merged: Counter[str] = Counter()
+        for rows in await shards.fan_out(top_subnets):
+            for row in rows:
+                merged[row.subnet] += int(row.count)
+        top = sorted(merged.items(), key=lambda kv: (-kv[1], kv[0]))[:limit]
+        subnets = [{"subnet": subnet, "count": count} for subnet, count in top]
+        return {"deviceType": dt_name, "subnets": subnets}
+    except Exception:
+        logger.exception("Subnet statistics query failed (deviceType=%r)", deviceType)
+        return JSONResponse(status_code=400, content={"deviceType": dt_name, "subnets": []})
+
+@app.get(
+    "/Log/auth/statistics/top-users",
+    response_model=TopUsersResponse,
+    dependencies=[Depends(require_admin_token)],
+)
+async def get_top_users(
+    windowMinutes: int = Query(60, ge=1, le=1440),
+    limit: int = Query(10, ge=1, le=100),
+):
+    """
+    Most active userKeys in the last windowMinutes (admin only). Count-Min sketch
+    estimates: never below the true count, possibly slightly above.
+    Counted in whole buckets (HEAVY_HITTER_BUCKET_SECONDS, 5 min by default), the current
+    one included, so the window may reach back up to one bucket further. Registrations
+    from the last few seconds (HEAVY_HITTER_FLUSH_SECONDS) may not be counted yet.
+    """
+    try:
+        users = await query_top(shards_of(app).primary, window_seconds=windowMinutes * 60, limit=limit)
+    except Exception:
+        logger.exception("Top users query failed")
+        return JSONResponse(status_code=400, content={"windowMinutes": windowMinutes, "approximate": True, "users": []})
+    return {"windowMinutes": windowMinutes, "approximate": True, "users": users}
+
+
+@app.get("/Log/auth/statistics/stream")
+async def stream_statistics(
+    request: Request,
+    deviceType: str | None = Query(None, min_length=1, max_length=50),
+):
+    """
+    Server-Sent Events stream of per-deviceType registration count deltas,
+    coalesced per interval (`event: delta`, data like {"Android": 3}).
+    Fed by LISTEN/NOTIFY, so viewers add no COUNT queries.
+    """
+    normalized = normalize_device_type(deviceType).value if deviceType else None
+    if broadcaster.full:
+        return JSONResponse(status_code=503, content={"statusCode": 503, "message": "overloaded"},
+                            headers={"Retry-After": "5"})
+
+    async def events():
+        # Subscribed only once the body is iterated: a client gone before that never
+        # starts the generator, and an unstarted generator's finally would never run
+        sub = broadcaster.subscribe(normalized)
+        if sub is None:
+            yield "retry: 5000\n\n"  # filled up meanwhile; the client reconnects later
+            return
+        try:
+            async for chunk in sse_events(sub, request.is_disconnected):
+                yield chunk
+        finally:
+            broadcaster.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ---------- Probes ----------
 @app.get("/livez")
 async def livez():
@@ -151,29 +404,39 @@ async def livez():
 @app.get("/startupz")
 async def startupz():
     """Startup: set when lifespan finished initial checks."""
-    ok = bool(getattr(app.state, "startup_complete", False))
+    # Re-checked until it passes, e.g. while the db_migrate job is still running
+    ok = bool(getattr(app.state, "startup_complete", False)) or await _check_startup()
     return JSONResponse(status_code=200 if ok else 503,
                         content={"status": "ok" if ok else "starting"})
 
 
-@app.get("/readyz")
-async def readyz(session: Annotated[AsyncSession, Depends(get_session)]):
-    """
-    Readiness: DB connectivity + schema + DeviceRegistrationAPI readiness.
-    """
+async def _shard_ready(session_factory: async_sessionmaker[AsyncSession]) -> tuple[bool, bool]:
+    """(db reachable, schema present) for one shard."""
     db_ok = False
     schema_ok = False
-    dep_ok = False
-
-    # 1) DB connectivity and schema presence
     try:
-        await session.execute(text("SELECT 1"))
-        db_ok = True
+        async with session_factory() as session:
+            await session.execute(text("SELECT 1"))
+            db_ok = True
 
-        res = await session.execute(text("SELECT to_regclass('public.device_registrations')"))
-        schema_ok = bool(res.scalar())
+            res = await session.execute(text("SELECT to_regclass('public.device_registrations')"))
+            schema_ok = bool(res.scalar())
     except Exception:
         logger.warning("Readiness DB/schema check failed", exc_info=True)
+    return db_ok, schema_ok
+
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness: DB connectivity + schema (every shard) + DeviceRegistrationAPI readiness.
+    """
+    dep_ok = False
+
+    # 1) DB connectivity and schema presence
+    checks = await shards_of(app).fan_out(_shard_ready)
+    db_ok = all(db for db, _ in checks)
+    schema_ok = all(schema for _, schema in checks)
 
     # 2) Dependency readiness (DeviceRegistrationAPI)
     try:
@@ -195,7 +458,13 @@ async def readyz(session: Annotated[AsyncSession, Depends(get_session)]):
     )
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus metrics for this worker (circuit breaker state)."""
+    return render_metrics([registration_breaker])
+
+
 @app.get("/healthz")
-async def healthz(session: Annotated[AsyncSession, Depends(get_session)]):
+async def healthz():
     """Back-compat alias -> readiness."""
-    return await readyz(session)
+    return await readyz()
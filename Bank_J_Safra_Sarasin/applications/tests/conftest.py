@@ -0,0 +1,31 @@
+"""
+Unit tests for the shared code under common/ (no database or network needed).
+
+Run from applications/:  python -m pytest -q tests
+"""
+
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+# Services import `common` as a top-level package (WORKDIR /app in the images)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+
+class FakeClock:
+    """Stand-in for time.monotonic that only moves when a test advances `now`."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(time, "monotonic", clock)
+    return clock
@@ -0,0 +1,75 @@
+import asyncio
+import json
+
+from common import admission
+from common.admission import AdmissionControlMiddleware, TokenBuckets
+from common.http_utils import parse_networks
+
+
+def test_token_bucket_burst_then_refill(clock):
+    buckets = TokenBuckets(rate=2.0, burst=2)
+    assert buckets.take("a") == 0.0
+    assert buckets.take("a") == 0.0
+    assert buckets.take("a") == 0.5
+    clock.now += 0.5
+    assert buckets.take("a") == 0.0
+    # Other keys have their own bucket
+    assert buckets.take("b") == 0.0
+
+
+def test_token_buckets_evict_oldest_key():
+    buckets = TokenBuckets(rate=1.0, burst=1, max_keys=2)
+    for key in ("a", "b", "c"):
+        buckets.take(key)
+    assert list(buckets._buckets) == ["b", "c"]
+
+
+async def _ok_app(scope, receive, send):
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+def _call(mw, peer: str, xff: str | None = None, path: str = "/Device/register") -> tuple[int, dict]:
+    headers = [(b"x-forwarded-for", xff.encode())] if xff else []
+    scope = {"type": "http", "path": path, "headers": headers, "client": (peer, 1234)}
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(mw(scope, None, send))
+    body = sent[1]["body"]
+    return sent[0]["status"], json.loads(body) if body else {}
+
+
+def test_rate_limit_keys_on_forwarded_client_from_trusted_proxy():
+    mw = AdmissionControlMiddleware(
+        _ok_app, client_rate=0.001, client_burst=1, trusted_proxies=parse_networks("10.0.0.0/8")
+    )
+    # Two users behind the same StatisticsAPI pod get separate buckets
+    assert _call(mw, "10.0.0.5", "198.51.100.1")[0] == 200
+    assert _call(mw, "10.0.0.5", "198.51.100.2")[0] == 200
+    status, body = _call(mw, "10.0.0.5", "198.51.100.1")
+    assert status == 429
+    assert body == {"statusCode": 429, "message": "too_many_requests"}
+
+
+def test_rate_limit_ignores_forwarded_header_from_untrusted_peer():
+    mw = AdmissionControlMiddleware(_ok_app, client_rate=0.001, client_burst=1)
+    assert _call(mw, "203.0.113.9", "198.51.100.1")[0] == 200
+    # Rotating X-Forwarded-For does not get a fresh bucket
+    assert _call(mw, "203.0.113.9", "198.51.100.2")[0] == 429
+
+
+def test_probes_are_exempt():
+    mw = AdmissionControlMiddleware(_ok_app, client_rate=0.001, client_burst=1)
+    for _ in range(3):
+        assert _call(mw, "203.0.113.9", path="/readyz")[0] == 200
+
+
+def test_options_from_env(monkeypatch):
+    monkeypatch.setenv("ADMISSION_CLIENT_RATE", "5")
+    monkeypatch.setenv("TRUSTED_PROXIES", "10.0.0.0/8")
+    options = admission.admission_options_from_env()
+    assert options["client_rate"] == 5.0
+    assert [str(n) for n in options["trusted_proxies"]] == ["10.0.0.0/8"]
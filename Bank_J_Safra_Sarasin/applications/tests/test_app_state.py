@@ -0,0 +1,56 @@
+import json
+from pathlib import Path
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from common.db import ShardSet, shards_of
+from common.openapi import use_prebuilt_openapi
+from device_registration_api import main as registration_main
+from statistics_api import main as statistics_main
+
+OPENAPI_DIR = Path(__file__).resolve().parents[2] / "OpenAPI"
+
+
+def test_shards_of_fails_clearly_without_lifespan():
+    app = FastAPI()
+    with pytest.raises(RuntimeError, match="lifespan"):
+        shards_of(app)
+    app.state.shards = ShardSet(["postgresql+asyncpg://u@db-0/devicesdb"])
+    assert shards_of(app) is app.state.shards
+
+
+@pytest.mark.parametrize("module", [registration_main, statistics_main])
+def test_apps_keep_shards_on_app_state(module):
+    assert not hasattr(module, "shards")
+    # Served without lifespan: startup reports "starting" instead of a NameError
+    response = TestClient(module.app).get("/startupz")
+    assert response.status_code == 503
+
+
+@pytest.mark.parametrize("module, name", [
+    (registration_main, "device_registration_api"),
+    (statistics_main, "statistics_api"),
+])
+def test_exported_openapi_is_current(module, name):
+    # Same check as the Dockerfiles' generate_openapi --check
+    exported = json.loads((OPENAPI_DIR / f"{name}.json").read_text(encoding="utf-8"))
+    assert exported == FastAPI.openapi(module.app)
+
+
+def test_prebuilt_openapi_is_served_from_disk(tmp_path):
+    app = FastAPI()
+    path = tmp_path / "openapi.json"
+    path.write_text('{"openapi": "3.1.0", "info": {"title": "prebuilt"}}', encoding="utf-8")
+    use_prebuilt_openapi(app, path)
+    assert app.openapi()["info"]["title"] == "prebuilt"
+
+
+def test_subnet_statistics_are_admin_only(monkeypatch):
+    client = TestClient(statistics_main.app)
+    monkeypatch.delenv("ADMIN_TOKEN", raising=False)
+    assert client.get("/Log/auth/statistics/subnets").status_code == 404
+    monkeypatch.setenv("ADMIN_TOKEN", "secret")
+    assert client.get("/Log/auth/statistics/subnets").status_code == 403
+    assert client.get("/Log/auth/statistics/subnets", headers={"X-Admin-Token": "nope"}).status_code == 403
@@ -0,0 +1,15 @@
+from common.tools import backfill
+
+
+def test_updated_row_count_from_command_tag():
+    assert backfill._updated("UPDATE 1234") == 1234
+    assert backfill._updated("UPDATE 0") == 0
+    assert backfill._updated("INSERT 0 5") == 0
+
+
+def test_steps_are_batched_and_only_touch_unfilled_rows():
+    assert len({step.name for step in backfill.STEPS}) == len(backfill.STEPS)
+    for step in backfill.STEPS:
+        for stmt in step.statements:
+            assert "$1" in stmt and "$2" in stmt, f"{step.name}: every statement must be bounded by the id range"
+        assert f"{step.name} IS NULL" in step.remaining
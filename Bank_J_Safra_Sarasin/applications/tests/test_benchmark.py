@@ -0,0 +1,97 @@
+import asyncio
+import json
+import random
+import sys
+from collections import Counter
+
+import pytest
+
+from common.tools import benchmark
+
+
+@pytest.mark.parametrize("n, s", [(1, 0.8), (10, 0.8), (1000, 1.0), (5000, 1.2)])
+def test_zipf_index_in_range(n, s):
+    rng = random.Random(7)
+    assert all(0 <= benchmark._zipf_index(rng, n, s) < n for _ in range(2000))
+
+
+def test_zipf_index_is_skewed_like_the_weight_table():
+    rng = random.Random(7)
+    n, draws = 1000, 50_000
+    counts = Counter(benchmark._zipf_index(rng, n, 0.8) for _ in range(draws))
+    table = benchmark._zipf_cum_weights(n, 0.8)
+    # Share of the 10 most popular ranks, lazy sampler vs exact table (within a few points)
+    assert abs(sum(counts[i] for i in range(10)) / draws - table[9] / table[-1]) < 0.03
+    assert counts[0] > counts[10] > counts[500]
+
+
+@pytest.mark.parametrize("argv", [
+    ["run", "--url", "postgresql://localhost/bench", "--iterations", "0"],
+    ["generate", "--url", "postgresql://localhost/bench", "--rows", "10", "--jobs", "0"],
+    ["generate", "--url", "postgresql://localhost/bench", "--rows", "-1"],
+    ["generate", "--url", "postgresql://localhost/bench", "--rows", "10", "--users", "0"],
+    ["generate", "--url", "postgresql://localhost/bench", "--rows", "10", "--days", "0"],
+])
+def test_rejects_non_positive_counts(monkeypatch, capsys, argv):
+    monkeypatch.setattr(sys, "argv", ["benchmark", *argv])
+    with pytest.raises(SystemExit) as exc:
+        benchmark.main()
+    assert exc.value.code == 2
+    assert "must be >= 1" in capsys.readouterr().err
+
+
+class FakeConnection:
+    def __init__(self):
+        self.log: list = []
+
+    def transaction(self):
+        conn = self
+
+        class Transaction:
+            async def start(self):
+                conn.log.append("begin")
+
+            async def rollback(self):
+                conn.log.append("rollback")
+        return Transaction()
+
+    async def fetch(self, sql, *args):
+        self.log.append(args)
+        if sql.startswith("EXPLAIN"):
+            return [(json.dumps([{"Plan": {"Node Type": "ModifyTable"}}]),)]
+        return []
+
+
+def test_every_timed_insert_is_a_real_insert():
+    keys = iter(range(100))
+    conn = FakeConnection()
+    build = lambda: ("INSERT INTO t (k) VALUES ($1) ON CONFLICT DO NOTHING", (next(keys),))  # noqa: E731
+    result = asyncio.run(benchmark._time_query(conn, build, iterations=3))
+    assert result["write"] is True
+    # One outer transaction around EXPLAIN, warm-up and 3 timed runs, each of them in its
+    # own rolled-back savepoint with a fresh key
+    assert conn.log[0] == "begin" and conn.log[-1] == "rollback"
+    runs = [conn.log[i:i + 3] for i in range(1, len(conn.log) - 1, 3)]
+    assert len(runs) == 5
+    assert all(run[0] == "begin" and run[2] == "rollback" for run in runs)
+    assert len({run[1] for run in runs}) == 5
+
+
+def test_config_without_teardown_runs_last(monkeypatch, capsys, tmp_path):
+    seen = []
+
+    async def fake_run(dsn, names, configs, iterations, device_type):
+        seen.append(names)
+        return {"configs": {}}
+
+    monkeypatch.setattr(benchmark, "run_benchmark", fake_run)
+    run = ["benchmark", "run", "--url", "postgresql://localhost/bench", "--configs"]
+    monkeypatch.setattr(sys, "argv", [*run, "baseline,clustered_by_device_type,brin_created_at"])
+    assert benchmark.main() == 0
+    assert seen == [["baseline", "brin_created_at", "clustered_by_device_type"]]
+
+    config_file = tmp_path / "configs.json"
+    config_file.write_text(json.dumps({"fillfactor_50": {"setup": ["VACUUM FULL t"]}}), encoding="utf-8")
+    monkeypatch.setattr(sys, "argv", [*run, "clustered_by_device_type,fillfactor_50", "--config-file", str(config_file)])
+    assert benchmark.main() == 2
+    assert "run them separately" in capsys.readouterr().err
@@ -0,0 +1,70 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from common.tools.bulk_import import Stats, batches, normalize_record
+
+NOW = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+def test_normalizes_fields():
+    row = normalize_record(
+        {"userKey": " alice ", "deviceType": "iphone", "userAgent": "UA/1", "clientIp": " 10.0.0.1 ",
+         "timestamp": "2023-05-01T10:00:00Z"},
+        NOW,
+    )
+    assert row == ("alice", "iOS", 2, "UA/1", "10.0.0.1", datetime(2023, 5, 1, 10, tzinfo=timezone.utc))
+
+
+def test_defaults_for_optional_fields():
+    assert normalize_record({"userKey": 12345}, NOW) == ("12345", "Unknown", 0, None, None, NOW)
+    assert normalize_record({"userKey": "bob", "deviceType": 7, "userAgent": ["x"], "clientIp": {}}, NOW) == (
+        "bob", "Unknown", 0, None, None, NOW,
+    )
+
+
+@pytest.mark.parametrize("raw", [
+    None,
+    ["not", "an", "object"],
+    "string",
+    {},
+    {"userKey": ""},
+    {"userKey": "   "},
+    {"userKey": None},
+    {"userKey": True},
+    {"userKey": {"id": 1}},
+    {"userKey": ["alice"]},
+    {"userKey": "x" * 256},
+    {"userKey": "alice", "createdAt": "yesterday"},
+    {"userKey": "alice", "createdAt": 1e20},
+    {"userKey": "alice", "createdAt": True},
+])
+def test_rejects_invalid_records(raw):
+    assert normalize_record(raw, NOW) is None
+
+
+def test_bad_lines_are_rejected_not_fatal(tmp_path):
+    path = tmp_path / "logins.ndjson"
+    path.write_text(
+        '{"userKey": "a", "deviceType": "android"}\n'
+        '{"userKey": "b", "deviceType": \n'
+        '\n'
+        '{"userKey": 42}\n'
+        '[1, 2]\n'
+        '{"userKey": {"nested": true}}\n'
+        '{"userKey": "c"}\n',
+        encoding="utf-8",
+    )
+    stats = Stats()
+    out = list(batches(path, 2, stats))
+    assert [(no, [r[0] for r in rows]) for no, rows in out] == [(0, ["a", "42"]), (1, ["c"])]
+    assert stats.rejected == 3
+
+
+def test_csv(tmp_path):
+    path = tmp_path / "logins.csv"
+    path.write_text("userKey,deviceType,clientIp\nalice,Windows,bad-ip\n,iOS,1.2.3.4\n", encoding="utf-8")
+    stats = Stats()
+    rows = [r for _, batch in batches(path, 10, stats) for r in batch]
+    assert [(r[0], r[1], r[4]) for r in rows] == [("alice", "Windows", None)]
+    assert stats.rejected == 1
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import sys
+
+from common import queries
+from common.tools import db_healthcheck
+
+
+class FakeTransaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    async def start(self):
+        pass
+
+    async def rollback(self):
+        self.conn.rollbacks += 1
+
+
+class FakeConnection:
+    """Answers what diagnose() asks; pg_stat_statements is not installed."""
+
+    def __init__(self):
+        self.explained: list[tuple[str, tuple]] = []
+        self.rollbacks = 0
+
+    def transaction(self):
+        return FakeTransaction(self)
+
+    async def fetchval(self, sql, *args):
+        if sql.startswith("EXPLAIN"):
+            self.explained.append((sql, args))
+            return json.dumps([{"Plan": {"Node Type": "Result"}, "Planning Time": 0.05, "Execution Time": 0.1}])
+        if sql == "SHOW server_version":
+            return "16.2"
+        return None
+
+    async def fetch(self, sql, *args):
+        return []
+
+    async def close(self):
+        pass
+
+
+def _fake_connect(monkeypatch) -> list[FakeConnection]:
+    conns = []
+
+    async def connect(dsn, timeout):
+        assert dsn.startswith("postgresql://")
+        conns.append(FakeConnection())
+        return conns[-1]
+
+    monkeypatch.setattr(db_healthcheck.asyncpg, "connect", connect)
+    return conns
+
+
+def test_diagnose_report(monkeypatch, capsys):
+    conns = _fake_connect(monkeypatch)
+    monkeypatch.setattr(sys, "argv", [
+        "db_healthcheck", "--diagnose", "--device-type", "iphone", "--url", "postgresql+asyncpg://u@db/devicesdb",
+    ])
+    assert db_healthcheck.main() == 0
+    report = json.loads(capsys.readouterr().out)
+    assert set(report) == {
+        "generated_at", "server_version", "device_type", "hot_queries", "table", "database", "pg_stat_statements",
+    }
+    assert report["server_version"] == "16.2"
+    assert list(report["hot_queries"]) == list(db_healthcheck.HOT_QUERIES)
+    for entry in report["hot_queries"].values():
+        assert entry == {"execution_time_ms": 0.1, "planning_time_ms": 0.05, "node": "Result",
+                         "plan": {"Node Type": "Result"}}
+    assert report["table"] == {"stats": None, "indexes": [], "unused_indexes": [], "cache": None}
+    assert report["pg_stat_statements"] is None
+    # Every EXPLAIN ANALYZE runs in a transaction that is rolled back
+    assert conns[0].rollbacks == len(db_healthcheck.HOT_QUERIES)
+
+
+def test_hot_queries_bind_like_the_app(monkeypatch):
+    conns = _fake_connect(monkeypatch)
+    for _ in range(2):
+        asyncio.run(db_healthcheck.diagnose("postgresql://u@db/devicesdb", "Android"))
+    plans = [dict(zip(db_healthcheck.HOT_QUERIES, conn.explained)) for conn in conns]
+
+    sql, args = plans[0]["statistics_subnets"]
+    # The endpoint's bound parameters, not literals baked into the SQL
+    assert "THEN CAST($1::INTEGER AS integer) ELSE CAST($2::INTEGER AS integer)" in sql
+    assert sql.endswith("device_type_code = $3::INTEGER GROUP BY 1 ORDER BY 2 DESC, 1 LIMIT $4::INTEGER")
+    assert args == (queries.DEFAULT_PREFIX_V4, queries.DEFAULT_PREFIX_V6, 1, queries.DEFAULT_SUBNET_LIMIT)
+
+    # A fixed key would make every run after the first an ON CONFLICT no-op
+    keys = [p["registration_insert"][1][0] for p in plans]
+    assert keys[0] != keys[1]
+    assert all(key.startswith("diagnose-") for key in keys)
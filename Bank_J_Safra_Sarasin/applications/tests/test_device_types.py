@@ -0,0 +1,33 @@
+import pytest
+
+from common import device_types
+from common.device_types import (
+    DEVICE_TYPE_CODES, DeviceType, device_type_code, device_type_from_code, normalize_device_type,
+)
+
+
+def test_codes_round_trip():
+    for dt in DeviceType:
+        assert device_type_from_code(device_type_code(dt)) is dt
+
+
+def test_unknown_code_and_raw_strings():
+    assert device_type_from_code(999) is DeviceType.Unknown
+    assert device_type_code("iphone") == DEVICE_TYPE_CODES[normalize_device_type("iphone")]
+
+
+def test_missing_code_raises(monkeypatch):
+    codes = dict(DEVICE_TYPE_CODES)
+    del codes[DeviceType.Bot]
+    monkeypatch.setattr(device_types, "DEVICE_TYPE_CODES", codes)
+    with pytest.raises(RuntimeError, match="Bot"):
+        device_types._check_codes()
+
+
+def test_duplicate_code_raises(monkeypatch):
+    monkeypatch.setattr(device_types, "DEVICE_TYPE_CODES", {**DEVICE_TYPE_CODES, DeviceType.Bot: 1})
+    monkeypatch.setattr(
+        device_types, "_CODE_TO_TYPE", {c: dt for dt, c in device_types.DEVICE_TYPE_CODES.items()}
+    )
+    with pytest.raises(RuntimeError):
+        device_types._check_codes()
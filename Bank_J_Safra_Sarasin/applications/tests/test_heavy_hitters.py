@@ -0,0 +1,93 @@
+import asyncio
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+from common.heavy_hitters import CountMinSketch, HeavyHitterTracker, _Bucket, estimate_top, window_start
+
+
+def test_sketch_never_undercounts():
+    rng = random.Random(1)
+    sketch = CountMinSketch(width=64, depth=4)
+    truth = Counter(f"user-{rng.randint(0, 500)}" for _ in range(5000))
+    for key, n in truth.items():
+        sketch.add(key, n)
+    for key, n in truth.items():
+        assert sketch.estimate(key) >= n
+    assert sketch.estimate("never-seen") >= 0
+
+
+def test_sketch_is_exact_without_collisions():
+    sketch = CountMinSketch(width=2048, depth=4)
+    assert sketch.add("a") == 1
+    assert sketch.add("a", 4) == 5
+    assert sketch.estimate("a") == 5
+
+
+def test_merge_equals_adding_everything_to_one_sketch():
+    a, b, both = (CountMinSketch(128, 3) for _ in range(3))
+    for i in range(300):
+        (a if i % 2 else b).add(f"k{i % 37}")
+        both.add(f"k{i % 37}")
+    a.merge(b)
+    assert a.counters == both.counters
+    restored = CountMinSketch.from_bytes(128, 3, a.to_bytes())
+    assert restored.counters == both.counters
+
+
+def test_bucket_keeps_heaviest_candidates():
+    bucket = _Bucket(width=1024, depth=4, k=3)
+    for key, n in (("a", 1), ("b", 2), ("c", 3), ("heavy", 50)):
+        for _ in range(n):
+            bucket.add(key)
+    assert set(bucket.candidates) == {"b", "c", "heavy"}
+    assert bucket.candidates["heavy"] >= 50
+
+
+def test_record_buckets_by_time():
+    tracker = HeavyHitterTracker(bucket_seconds=300)
+    tracker.record("a", now=1000)
+    tracker.record("a", now=1199)
+    tracker.record("a", now=1200)
+    assert sorted(tracker._buckets) == [900, 1200]
+
+
+def test_window_includes_every_overlapping_bucket():
+    # 10 minutes back from 12:07 reaches into the 11:55 bucket; 12:05 is the current, partial one
+    now = 12 * 3600 + 7 * 60
+    assert window_start(now, 600, 300) == 11 * 3600 + 55 * 60
+    assert window_start(now, 60, 300) == 12 * 3600 + 5 * 60
+
+
+def test_estimate_top_sums_buckets():
+    def row(counts):
+        sketch = CountMinSketch(256, 4)
+        for key, n in counts.items():
+            sketch.add(key, n)
+        return SimpleNamespace(width=256, depth=4, counters=sketch.to_bytes(), candidates=counts)
+
+    rows = [row({"a": 5, "b": 1}), row({"b": 7}), row({"c": 2})]
+    assert estimate_top(rows, 2) == [{"userKey": "b", "count": 8}, {"userKey": "a", "count": 5}]
+    assert estimate_top([], 5) == []
+
+
+def test_flusher_survives_database_errors():
+    def broken_factory():
+        raise ConnectionError("db down")
+
+    async def run():
+        tracker = HeavyHitterTracker(bucket_seconds=300)
+        tracker.record("a", now=1000)
+        task = asyncio.create_task(tracker.run_flusher(broken_factory, interval=0.001))
+        await asyncio.sleep(0.05)
+        assert not task.done()
+        # Failed buckets are kept for the next flush instead of being dropped
+        assert tracker._buckets[900].candidates == {"a": 1}
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    assert asyncio.run(run())
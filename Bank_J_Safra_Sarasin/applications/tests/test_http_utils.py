@@ -0,0 +1,71 @@
+import pytest
+from starlette.requests import Request
+
+from common.http_utils import etag_matches, normalize_ip, parse_networks, trusted_client_ip
+
+TRUSTED = parse_networks("10.0.0.0/8, 127.0.0.1")
+
+
+def _request(peer: str | None, xff: str | None = None) -> Request:
+    headers = [(b"x-forwarded-for", xff.encode())] if xff is not None else []
+    scope = {"type": "http", "headers": headers, "client": (peer, 1234) if peer else None}
+    return Request(scope)
+
+
+def test_parse_networks():
+    assert [str(n) for n in parse_networks(" 10.1.2.3/8 ,, ::1 ")] == ["10.0.0.0/8", "::1/128"]
+    assert parse_networks("") == ()
+    with pytest.raises(ValueError):
+        parse_networks("not-an-ip")
+
+
+def test_untrusted_peer_ignores_forwarded_header():
+    assert trusted_client_ip(_request("203.0.113.9", "1.2.3.4"), TRUSTED) == "203.0.113.9"
+
+
+def test_no_trusted_proxies_keys_on_peer():
+    assert trusted_client_ip(_request("10.0.0.5", "1.2.3.4"), ()) == "10.0.0.5"
+
+
+def test_trusted_peer_uses_rightmost_untrusted_hop():
+    # Client spoofs the first entry; the ingress appends the real address
+    req = _request("10.0.0.5", "6.6.6.6, 198.51.100.7, 10.0.0.9")
+    assert trusted_client_ip(req, TRUSTED) == "198.51.100.7"
+
+
+def test_trusted_peer_without_header():
+    assert trusted_client_ip(_request("127.0.0.1"), TRUSTED) == "127.0.0.1"
+
+
+def test_all_hops_trusted_takes_leftmost():
+    assert trusted_client_ip(_request("10.0.0.5", "10.1.1.1, 10.2.2.2"), TRUSTED) == "10.1.1.1"
+
+
+def test_unparseable_hop_falls_back_to_peer():
+    assert trusted_client_ip(_request("10.0.0.5", "garbage"), TRUSTED) == "10.0.0.5"
+
+
+def test_no_client():
+    assert trusted_client_ip(_request(None), TRUSTED) is None
+
+
+def test_normalize_ip():
+    assert normalize_ip(" 2001:DB8::1 ") == "2001:db8::1"
+    assert normalize_ip("192.168.0.1") == "192.168.0.1"
+    assert normalize_ip("unknown") is None
+    assert normalize_ip(None) is None
+
+
+@pytest.mark.parametrize(
+    ("header", "expected"),
+    [
+        (None, False),
+        ('"2-10"', True),
+        ('W/"2-10"', True),
+        ('"1-1", "2-10"', True),
+        ("*", True),
+        ('"2-11"', False),
+    ],
+)
+def test_etag_matches(header, expected):
+    assert etag_matches(header, '"2-10"') is expected
@@ -0,0 +1,49 @@
+import pytest
+
+from common.idempotency import MAX_KEY_LENGTH, RecentKeys, clean_key
+
+
+@pytest.mark.parametrize("value, expected", [
+    (None, None),
+    ("", None),
+    ("   ", None),
+    ("  abc-123  ", "abc-123"),
+    ("550e8400-e29b-41d4-a716-446655440000", "550e8400-e29b-41d4-a716-446655440000"),
+    ("k" * MAX_KEY_LENGTH, "k" * MAX_KEY_LENGTH),
+])
+def test_clean_key(value, expected):
+    assert clean_key(value) == expected
+
+
+@pytest.mark.parametrize("value", ["k" * (MAX_KEY_LENGTH + 1), "zażółć", "tab\tinside", "nul\x00", "line\nbreak"])
+def test_clean_key_rejects(value):
+    with pytest.raises(ValueError):
+        clean_key(value)
+
+
+def test_recent_keys_are_scoped_per_user():
+    keys = RecentKeys()
+    keys.put("alice", "k1", {"statusCode": 200})
+    assert keys.get("alice", "k1") == {"statusCode": 200}
+    assert keys.get("bob", "k1") is None
+
+
+def test_recent_keys_evict_least_recently_used():
+    keys = RecentKeys(max_size=2)
+    keys.put("u", "a", {"n": 1})
+    keys.put("u", "b", {"n": 2})
+    assert keys.get("u", "a") == {"n": 1}  # refreshes "a"
+    keys.put("u", "c", {"n": 3})
+    assert keys.get("u", "b") is None
+    assert keys.get("u", "a") == {"n": 1}
+    assert len(keys) == 2
+
+
+def test_recent_keys_expire(clock):
+    keys = RecentKeys(ttl=10)
+    keys.put("u", "a", {"n": 1})
+    clock.now += 10
+    assert keys.get("u", "a") == {"n": 1}
+    clock.now += 0.5
+    assert keys.get("u", "a") is None
+    assert len(keys) == 0
@@ -0,0 +1,101 @@
+import asyncio
+from collections import Counter
+
+import pytest
+
+from common.live_stats import CountCache, StatsBroadcaster, Subscriber
+
+
+@pytest.fixture
+def broadcaster(monkeypatch):
+    b = StatsBroadcaster(["postgresql://db-0/x", "postgresql://db-1/x"], interval=0.01, idle_seconds=0.05)
+    b.started = 0
+
+    async def fake_run(dsn):
+        # Stands in for the LISTEN connection
+        b.started += 1
+        b._connected.add(dsn)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            b._connected.discard(dsn)
+
+    monkeypatch.setattr(b, "_run", fake_run)
+    return b
+
+
+def test_subscriber_filters_and_merges():
+    sub = Subscriber("iOS")
+    sub.push(Counter({"iOS": 2, "Android": 5}))
+    sub.push(Counter({"Android": 1}))
+    sub.push(Counter({"iOS": 1}))
+    assert sub.ready.is_set()
+    assert sub.take() == {"iOS": 3}
+    assert not sub.ready.is_set()
+
+
+def test_listen_stops_once_last_subscriber_left(broadcaster):
+    async def main():
+        sub = broadcaster.subscribe()
+        await asyncio.sleep(0.1)
+        assert broadcaster.running and broadcaster.listening  # subscribers keep it up
+        broadcaster.unsubscribe(sub)
+        await asyncio.sleep(0.1)
+        assert not broadcaster.running and not broadcaster.listening
+        broadcaster.subscribe()
+        await asyncio.sleep(0)
+        assert broadcaster.running and broadcaster.started == 4
+        await broadcaster.close()
+
+    asyncio.run(main())
+
+
+def test_count_cache_keeps_listen_alive_and_invalidates_after_stop(broadcaster):
+    cache = CountCache(broadcaster, max_age=60)
+
+    async def main():
+        cache.token("iOS")
+        await asyncio.sleep(0.01)
+        cache.put("iOS", cache.token("iOS"), 7)
+        for _ in range(10):
+            assert cache.get("iOS") == 7
+            await asyncio.sleep(0.02)
+        assert broadcaster.running
+        await asyncio.sleep(0.1)  # unused
+        assert not broadcaster.listening
+        assert cache.get("iOS") is None  # no LISTEN: an insert could have been missed
+        await broadcaster.close()
+
+    asyncio.run(main())
+
+
+def test_notification_bumps_versions_by_name(broadcaster):
+    broadcaster._on_notify(None, 0, "device_registrations", '{"ts": "t", "counts": {"iOS": 2, "bogus": 1}}')
+    assert broadcaster.versions["iOS"] == 1
+    assert broadcaster._pending == Counter({"iOS": 2, "Unknown": 1})
+    epoch = broadcaster.epoch
+    broadcaster._on_notify(None, 0, "device_registrations", "not json")
+    assert broadcaster.epoch == epoch + 1
+
+
+def test_stream_subscribes_only_when_iterated(monkeypatch, broadcaster):
+    from statistics_api import main as stats_main
+
+    monkeypatch.setattr(stats_main, "broadcaster", broadcaster)
+
+    class FakeRequest:
+        async def is_disconnected(self):
+            return False
+
+    async def main():
+        resp = await stats_main.stream_statistics(FakeRequest(), deviceType="iphone")
+        # Client gone before the body was iterated: nothing to leak
+        assert broadcaster.subscribers == set()
+        body = resp.body_iterator
+        assert await body.__anext__() == "retry: 3000\n\n"
+        assert [s.device_type for s in broadcaster.subscribers] == ["iOS"]
+        await body.aclose()
+        assert broadcaster.subscribers == set()
+        await broadcaster.close()
+
+    asyncio.run(main())
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from common import migrations, queries
+from common.config import write_legacy_columns
+from common.db import DeviceRegistration
+from common.device_types import DeviceType, device_type_code
+from common.migrations import Migration
+from common.tools import db_bootstrap
+
+
+@pytest.mark.parametrize("stmt", [
+    "ALTER TABLE public.device_registrations DROP COLUMN user_agent",
+    "ALTER TABLE public.device_registrations ALTER COLUMN client_ip TYPE INET USING client_ip::inet",
+    "alter table t alter column device_type set data type smallint",
+    "ALTER TABLE t ALTER COLUMN user_key SET NOT NULL",
+    "ALTER TABLE t RENAME COLUMN a TO b",
+    "DROP VIEW public.device_registrations_decoded",
+])
+def test_contract_statements_need_a_contract_migration(monkeypatch, stmt):
+    monkeypatch.setattr(migrations, "MIGRATIONS", (Migration(1, "x", (stmt,)),))
+    with pytest.raises(RuntimeError, match="contract=True"):
+        migrations._check_expand_only()
+    monkeypatch.setattr(migrations, "MIGRATIONS", (Migration(1, "x", (stmt,), contract=True),))
+    migrations._check_expand_only()
+
+
+@pytest.mark.parametrize("stmt, transactional", [
+    # A plain CREATE INDEX on an existing table blocks writes for the whole build
+    ("CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_a ON public.t (a)", True),
+    ("CREATE INDEX ix_a ON public.t (a)", False),
+    # Without IF NOT EXISTS a retry after a failed build errors out instead of rebuilding
+    ("CREATE INDEX CONCURRENTLY ix_a ON public.t (a)", False),
+])
+def test_concurrent_indexes_need_a_non_transactional_migration(monkeypatch, stmt, transactional):
+    monkeypatch.setattr(migrations, "MIGRATIONS", (Migration(1, "x", (stmt,), transactional=transactional),))
+    with pytest.raises(RuntimeError, match="transactional=False"):
+        migrations._check_concurrent()
+
+
+def test_concurrent_index_name():
+    stmt = next(s for m in migrations.MIGRATIONS if not m.transactional for s in m.statements)
+    assert migrations._CONCURRENT_INDEX.match(stmt).group("name") == "ux_device_registrations_idempotency"
+
+
+def test_shipped_migrations_are_expand_only():
+    migrations._check_expand_only()
+    assert not any(m.contract for m in migrations.MIGRATIONS)
+
+
+def test_model_keeps_legacy_string_columns():
+    # The previous release still reads and writes them during a rolling deploy
+    columns = DeviceRegistration.__table__.columns
+    assert str(columns["device_type"].type) == "VARCHAR(50)"
+    assert str(columns["client_ip"].type) == "VARCHAR(45)"
+    assert columns["device_type_code"].nullable
+    assert columns["client_inet"].nullable
+    # ...and with WRITE_LEGACY_COLUMNS=0 new rows leave them NULL (migration v11)
+    assert columns["device_type"].nullable
+
+
+def _registration(**kwargs):
+    return queries.registration_values(
+        user_key="u1", device_type=DeviceType.Android, user_agent="ua/1", user_agent_id=7,
+        client_ip="10.0.0.1", idempotency_key=None, **kwargs,
+    )
+
+
+def test_legacy_columns_are_written_until_the_flag_is_off(monkeypatch):
+    values = _registration()
+    assert (values["device_type"], values["user_agent"], values["client_ip"]) == ("Android", "ua/1", "10.0.0.1")
+    count = queries.device_type_count(DeviceType.Android)
+    assert "device_type = :dt" in count.text and count.compile().params == {"dt": "Android"}
+
+    monkeypatch.setattr(queries, "WRITE_LEGACY_COLUMNS", False)
+    values = _registration()
+    assert (values["device_type"], values["user_agent"], values["client_ip"]) == (None, None, None)
+    assert (values["device_type_code"], values["user_agent_id"], values["client_inet"]) == (
+        device_type_code(DeviceType.Android), 7, "10.0.0.1",
+    )
+    count = queries.device_type_count(DeviceType.Android)
+    assert "device_type_code = :code" in count.text
+    assert count.compile().params == {"code": device_type_code(DeviceType.Android)}
+
+
+@pytest.mark.parametrize("value, expected", [(None, True), ("1", True), ("0", False), ("false", False)])
+def test_write_legacy_columns_flag(monkeypatch, value, expected):
+    if value is None:
+        monkeypatch.delenv("WRITE_LEGACY_COLUMNS", raising=False)
+    else:
+        monkeypatch.setenv("WRITE_LEGACY_COLUMNS", value)
+    assert write_legacy_columns() is expected
+
+
+def test_workers_do_not_migrate_by_default(monkeypatch):
+    migrated = []
+
+    async def behind(engine):
+        return migrations.LATEST_VERSION - 1
+
+    async def migrate(engine, **kwargs):
+        migrated.append(engine)
+        return migrations.LATEST_VERSION
+
+    monkeypatch.setattr(db_bootstrap, "schema_version", behind)
+    monkeypatch.setattr(db_bootstrap, "migrate", migrate)
+    monkeypatch.delenv("DB_BOOTSTRAP", raising=False)
+    assert asyncio.run(db_bootstrap.bootstrap(None)) is False
+    assert migrated == []
+    monkeypatch.setenv("DB_BOOTSTRAP", "1")
+    assert asyncio.run(db_bootstrap.bootstrap(None)) is True
+    assert len(migrated) == 1
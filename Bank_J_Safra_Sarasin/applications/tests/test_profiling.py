@@ -0,0 +1,53 @@
+import asyncio
+import threading
+import time
+
+from common.profiling import ProfilingMiddleware, SamplingProfiler
+
+
+def _request(profiler: SamplingProfiler, busy: float) -> None:
+    async def app(scope, receive, send):
+        end = time.monotonic() + busy
+        while time.monotonic() < end:  # on-CPU in the loop thread, as a slow handler would be
+            pass
+
+    asyncio.run(ProfilingMiddleware(app, profiler)({"type": "http", "method": "GET"}, None, None))
+
+
+def test_samples_profiled_requests():
+    profiler = SamplingProfiler(sample_rate=1.0, interval=0.001)
+    _request(profiler, busy=0.1)
+    summary = profiler.summary()
+    assert summary["routes"]["GET (unmatched)"]["requests"] == 1
+    assert summary["routes"]["GET (unmatched)"]["samples"] > 0
+    assert profiler.collapsed().startswith("GET (unmatched);")
+
+
+def test_sampler_sleeps_on_event_between_requests(monkeypatch):
+    profiler = SamplingProfiler(sample_rate=1.0, interval=0.001)
+    _request(profiler, busy=0.02)
+    time.sleep(0.05)
+    assert profiler._thread.is_alive()
+    assert not profiler._wake.is_set()
+
+    ticks = []
+    real_sleep = time.sleep
+
+    def counting_sleep(seconds):
+        if threading.current_thread() is profiler._thread:
+            ticks.append(seconds)
+        real_sleep(seconds)
+
+    monkeypatch.setattr(time, "sleep", counting_sleep)
+    real_sleep(0.1)
+    assert ticks == []  # sample_rate > 0 used to wake it every interval forever
+    _request(profiler, busy=0.05)
+    assert ticks
+
+
+def test_off_means_no_thread():
+    profiler = SamplingProfiler(sample_rate=0.0)
+    assert not profiler.should_profile()
+    assert profiler._thread is None
+    assert profiler.start_window(10_000) == profiler.max_window
+    assert profiler.should_profile()
@@ -0,0 +1,141 @@
+import asyncio
+import time
+
+import pytest
+
+from common.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, render_metrics, retry_async
+
+
+def _tripped(clock, **kwargs) -> CircuitBreaker:
+    breaker = CircuitBreaker("dep", failure_rate=0.5, min_calls=4, window=4, open_seconds=10, **kwargs)
+    for failed in (False, True, False, True):
+        assert breaker.allow()
+        breaker.record(failed=failed)
+    assert breaker.state == OPEN
+    return breaker
+
+
+def test_stays_closed_below_min_calls(clock):
+    breaker = CircuitBreaker("dep", min_calls=4, window=4)
+    for _ in range(3):
+        breaker.record(failed=True)
+    assert breaker.state == CLOSED
+
+
+def test_opens_at_failure_rate_and_rejects(clock):
+    breaker = _tripped(clock)
+    assert not breaker.allow()
+    assert breaker.rejected_total == 1
+    assert breaker.opened_total == 1
+
+
+def test_half_open_probe_success_closes(clock):
+    breaker = _tripped(clock)
+    clock.now += 10
+    assert breaker.allow()
+    assert breaker.state == HALF_OPEN
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record(failed=False)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+
+
+def test_half_open_probe_failure_reopens(clock):
+    breaker = _tripped(clock)
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record(failed=True)
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+
+
+def test_release_returns_half_open_slot(clock):
+    breaker = _tripped(clock)
+    clock.now += 10
+    for _ in range(5):
+        assert breaker.allow()
+        breaker.release()  # e.g. the caller was cancelled mid-call
+    assert breaker.state == HALF_OPEN
+    assert breaker.calls_total == 4
+
+
+def test_cancelled_call_does_not_leak_probe_slot(clock):
+    breaker = _tripped(clock)
+    clock.now += 10
+
+    async def guarded_call():
+        assert breaker.allow()
+        failed = None
+        try:
+            await asyncio.sleep(10)
+            failed = False
+        finally:
+            if failed is None:
+                breaker.release()
+            else:
+                breaker.record(failed=failed)
+
+    async def main():
+        task = asyncio.create_task(guarded_call())
+        await asyncio.sleep(0)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert breaker.allow()
+
+
+def test_render_metrics(clock):
+    text = render_metrics([_tripped(clock)])
+    assert 'circuit_breaker_state{name="dep"} 2' in text
+    assert 'circuit_breaker_failures_total{name="dep"} 2' in text
+
+
+def test_retry_until_success():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        if len(calls) < 3:
+            raise ConnectionError("down")
+        return "ok"
+
+    result = asyncio.run(retry_async(fn, should_retry=lambda exc, r: exc is not None, attempts=3, base_delay=0))
+    assert result == "ok"
+    assert len(calls) == 3
+
+
+def test_retry_stops_when_not_safe():
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        raise ValueError("not retryable")
+
+    with pytest.raises(ValueError):
+        asyncio.run(retry_async(fn, should_retry=lambda exc, r: False, attempts=3))
+    assert len(calls) == 1
+
+
+def test_retry_returns_last_result():
+    async def fn():
+        return 503
+
+    assert asyncio.run(retry_async(fn, should_retry=lambda exc, r: True, attempts=2, base_delay=0)) == 503
+
+
+def test_deadline_caps_total_time():
+    calls = []
+
+    async def hung():
+        calls.append(1)
+        await asyncio.sleep(10)
+
+    started = time.monotonic()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(retry_async(
+            hung, should_retry=lambda exc, r: True, attempts=5, deadline=time.monotonic() + 0.2,
+        ))
+    assert time.monotonic() - started < 1.0
+    assert len(calls) == 1
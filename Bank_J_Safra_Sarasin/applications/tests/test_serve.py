@@ -0,0 +1,74 @@
+import pytest
+
+from common.tools import serve
+
+
+@pytest.fixture(autouse=True)
+def _clean_env(monkeypatch):
+    for name in ("WEB_CONCURRENCY", "WEB_MAX_WORKERS", "WEB_WORKER_MEMORY", "WEB_PRELOAD"):
+        monkeypatch.delenv(name, raising=False)
+    monkeypatch.setattr(serve, "available_cpus", lambda: 16)
+
+
+def test_cgroup_v2_cpu_quota(tmp_path):
+    (tmp_path / "cpu.max").write_text("150000 100000\n")
+    assert serve.cgroup_cpu_limit(tmp_path) == 1.5
+
+
+def test_cgroup_v2_cpu_unlimited(tmp_path):
+    (tmp_path / "cpu.max").write_text("max 100000\n")
+    assert serve.cgroup_cpu_limit(tmp_path) is None
+
+
+def test_cgroup_v1_cpu_quota(tmp_path):
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("200000")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    assert serve.cgroup_cpu_limit(tmp_path) == 2.0
+
+
+def test_cgroup_v1_cpu_unlimited(tmp_path):
+    (tmp_path / "cpu").mkdir()
+    (tmp_path / "cpu" / "cpu.cfs_quota_us").write_text("-1")
+    (tmp_path / "cpu" / "cpu.cfs_period_us").write_text("100000")
+    assert serve.cgroup_cpu_limit(tmp_path) is None
+
+
+def test_cgroup_memory_limits(tmp_path):
+    assert serve.cgroup_memory_limit(tmp_path) is None
+    (tmp_path / "memory.max").write_text("max")
+    assert serve.cgroup_memory_limit(tmp_path) is None
+    (tmp_path / "memory.max").write_text("536870912")
+    assert serve.cgroup_memory_limit(tmp_path) == 512 * 1024 * 1024
+
+
+def test_cgroup_v1_memory_unlimited(tmp_path):
+    (tmp_path / "memory").mkdir()
+    (tmp_path / "memory" / "memory.limit_in_bytes").write_text(str(9223372036854771712))
+    assert serve.cgroup_memory_limit(tmp_path) is None
+
+
+def test_workers_round_up_fractional_cores():
+    assert serve.pick_workers(1.5, None)[0] == 2
+
+
+def test_workers_capped_by_memory():
+    workers, reason = serve.pick_workers(4.0, 320 * 1024 * 1024)
+    assert workers == 2
+    assert "memory" in reason
+
+
+def test_workers_capped_by_max(monkeypatch):
+    monkeypatch.setenv("WEB_MAX_WORKERS", "3")
+    assert serve.pick_workers(None, None)[0] == 3
+
+
+def test_explicit_concurrency_wins(monkeypatch):
+    monkeypatch.setenv("WEB_CONCURRENCY", "5")
+    assert serve.pick_workers(1.0, 1) == (5, "WEB_CONCURRENCY")
+
+
+def test_build_options_uses_stock_worker():
+    options, _ = serve.build_options("0.0.0.0:8000")
+    assert options["worker_class"] == "uvicorn.workers.UvicornWorker"
+    assert options["preload_app"] is True
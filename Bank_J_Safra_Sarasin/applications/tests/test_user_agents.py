@@ -0,0 +1,36 @@
+import asyncio
+
+from common.db import DeviceRegistration
+from common.user_agents import MAX_USER_AGENT_LENGTH, UserAgentCache, resolve_user_agent, resolve_user_agents
+
+
+def test_cache_evicts_least_recently_used():
+    cache = UserAgentCache(max_size=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # refreshes "a"
+    cache.put("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert len(cache) == 2
+
+
+def test_cached_user_agents_need_no_database():
+    cache = UserAgentCache()
+    cache.put("ua-1", 11)
+    cache.put("x" * MAX_USER_AGENT_LENGTH, 12)
+    # session_factory is never touched when every UA is cached
+    ids = asyncio.run(resolve_user_agents(None, ["ua-1", None, "", "x" * (MAX_USER_AGENT_LENGTH + 5)], cache))
+    assert ids == {"ua-1": 11, "x" * MAX_USER_AGENT_LENGTH: 12}
+
+
+def test_missing_user_agent_is_none():
+    assert asyncio.run(resolve_user_agent(None, None, UserAgentCache())) is None
+    assert asyncio.run(resolve_user_agent(None, "", UserAgentCache())) is None
+
+
+def test_model_keeps_legacy_user_agent_column():
+    # The previous release still writes user_agent during a rolling deploy
+    columns = DeviceRegistration.__table__.columns
+    assert columns["user_agent"].nullable
+    assert columns["user_agent_id"].nullable
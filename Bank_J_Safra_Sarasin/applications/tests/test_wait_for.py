@@ -0,0 +1,96 @@
+import asyncio
+import json
+import socket
+import sys
+
+import pytest
+
+from common.tools import wait_for
+
+
+@pytest.mark.parametrize("dsn, label", [
+    ("postgresql://app:s3cret@db:5432/devicesdb?password=s3cret&sslkey=/keys/client.key", "db:5432/devicesdb"),
+    ("postgresql+asyncpg://postgres:postgres@db/devicesdb", "db/devicesdb"),
+    ("postgresql://u:p@[2001:db8::1]:6432/x?sslmode=require", "[2001:db8::1]:6432/x"),
+    ("postgresql:///devicesdb?host=/var/run/postgresql&password=s3cret", "/devicesdb"),
+])
+def test_postgres_label_has_no_secrets(dsn, label):
+    assert wait_for.postgres_label(dsn) == label
+
+
+def test_parse_targets():
+    targets = wait_for.parse_targets(["db:5432", "[::1]:80"], ["http://api:8000/readyz"], ["postgresql://u:p@db/x"])
+    assert [(kind, label) for kind, label, _ in targets] == [
+        ("tcp", "db:5432"), ("tcp", "[::1]:80"), ("http", "http://api:8000/readyz"), ("postgres", "db/x"),
+    ]
+    with pytest.raises(ValueError, match="Invalid port"):
+        wait_for.parse_targets(["db"], [], [])
+
+
+def _probe_sequence(*results):
+    calls = iter(results)
+
+    async def probe():
+        return next(calls)
+    return probe
+
+
+@pytest.fixture
+def sleeps(clock, monkeypatch):
+    slept = []
+
+    async def fake_sleep(seconds):
+        slept.append(seconds)
+        clock.now += seconds
+
+    monkeypatch.setattr(wait_for.asyncio, "sleep", fake_sleep)
+    monkeypatch.setattr(wait_for.random, "uniform", lambda low, high: high)
+    return slept
+
+
+def test_backoff_doubles_up_to_max_and_stops_at_deadline(sleeps):
+    never = _probe_sequence(*[False] * 10)
+    entry = asyncio.run(wait_for.wait_target("tcp", "db:5432", never, 5.0, base_delay=0.1, max_delay=2.0))
+    # The last sleep is cut to what is left before the deadline; one final probe follows it
+    assert sleeps == pytest.approx([0.1, 0.2, 0.4, 0.8, 1.6, 1.9])
+    assert entry == {"kind": "tcp", "target": "db:5432", "ready": False, "attempts": 7, "elapsed_ms": 5000.0}
+
+
+def test_stops_polling_once_ready(sleeps):
+    entry = asyncio.run(wait_for.wait_target("http", "u", _probe_sequence(False, False, True), 30.0))
+    assert entry["ready"] is True
+    assert entry["attempts"] == 3
+    assert sleeps == pytest.approx([0.1, 0.2])
+
+
+def test_report(monkeypatch, capsys):
+    async def postgres_up(url):
+        return True
+
+    monkeypatch.setattr(wait_for, "_probe_postgres", postgres_up)
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        port = listener.getsockname()[1]
+        monkeypatch.setattr(sys, "argv", [
+            "wait_for", "--tcp", f"127.0.0.1:{port}",
+            "--postgres", "postgresql://app:s3cret@db:5432/devicesdb?password=s3cret", "--timeout", "5",
+        ])
+        assert wait_for.main() == 0
+    out = capsys.readouterr().out
+    assert "s3cret" not in out
+    report_line, status = out.strip().splitlines()
+    report = json.loads(report_line)
+    assert status == "READY"
+    assert set(report) == {"ready", "elapsed_ms", "targets"}
+    assert report["ready"] is True
+    assert [(t["kind"], t["target"], t["ready"]) for t in report["targets"]] == [
+        ("tcp", f"127.0.0.1:{port}", True), ("postgres", "db:5432/devicesdb", True),
+    ]
+    assert all(set(t) == {"kind", "target", "ready", "attempts", "elapsed_ms"} for t in report["targets"])
+
+
+def test_invalid_tcp_target(monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["wait_for", "--tcp", "db:http"])
+    assert wait_for.main() == 2
+    assert "Invalid port" in capsys.readouterr().out